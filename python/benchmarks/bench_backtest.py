@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of `backtest` on synthetic data
+- Each case is a strategy, a number of bars, a grid size, a verbose level and a number of processes (`n_jobs`)
+- The time of each case is split into `initalize_data`, `analyze_strategies` and the rest of the run
+  (mostly `BaseStrategy.next` and the indicators), and its peak memory is traced separately
+- Results are stored as JSON under benchmarks/results, and compared with a previous run to catch regressions
+
+Usage (from the python directory, with fastquant installed)
+    python benchmarks/bench_backtest.py --suite quick
+    python benchmarks/bench_backtest.py --suite full --strategies smac rsi --bars 1000000 --grid 1
+    python benchmarks/bench_backtest.py --suite parallel
+    python benchmarks/bench_backtest.py --compare benchmarks/results/<previous label>.json
+"""
+
+import argparse
+import contextlib
+import gc
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from fastquant import backtest, STRATEGY_MAPPING
+from synthetic import get_synthetic_data, get_synthetic_sentiments
+
+RESULTS_PATH = Path(__file__).resolve().parent / "results"
+
+# `fastquant.backtest` is shadowed by the `backtest` function in the package namespace
+BACKTEST_MODULE = sys.modules["fastquant.backtest.backtest"]
+# Functions of the backtest module timed separately
+COMPONENTS = ["initalize_data", "analyze_strategies"]
+
+BARS = [1000, 10000, 100000, 1000000]
+GRIDS = [1, 100, 10000]
+VERBOSE = [0, 1, 2, 3]
+# Numbers of processes of the parallel suite, up to the available cores
+N_JOBS = sorted(
+    set(n for n in [1, 2, 4, os.cpu_count() or 1] if n <= (os.cpu_count() or 1))
+)
+
+# Parameters varied by the grids of each strategy, as (name, start) for integers or (name, (low, high)) for floats
+GRID_PARAMS = {
+    "rsi": [("rsi_lower", 5), ("rsi_upper", 55)],
+    "smac": [("fast_period", 2), ("slow_period", 30)],
+    "base": [("buy_prop", (0.01, 1.0))],
+    "macd": [("fast_period", 2), ("slow_period", 20)],
+    "emac": [("fast_period", 2), ("slow_period", 30)],
+    "bbands": [("period", 5), ("devfactor", (0.5, 3.0))],
+    "buynhold": [("buy_prop", (0.01, 1.0))],
+    "sentiment": [("senti", (0.01, 0.99))],
+    "custom": [("upper_limit", (50.0, 99.0)), ("lower_limit", (1.0, 50.0))],
+    "ternary": [("buy_prop", (0.01, 1.0))],
+}
+STRATEGY_KWARGS = {"ternary": dict(custom_column="ternary")}
+
+
+def get_grid(strategy, size):
+    """
+    Parameter values whose product has `size` combinations (rounded to a power of the number of parameters)
+    """
+    params = GRID_PARAMS.get(strategy, [("buy_prop", (0.01, 1.0))])
+    n_values = int(round(size ** (1.0 / len(params))))
+    grid = dict()
+    for name, start in params:
+        if isinstance(start, tuple):
+            values = np.linspace(start[0], start[1], n_values).round(6).tolist()
+        else:
+            values = list(range(start, start + n_values))
+        grid[name] = values if size > 1 else values[0]
+    return grid
+
+
+def get_cases(suite):
+    """
+    Cases of a suite, each a dict of `strategy`, `bars`, `grid`, `verbose` and `n_jobs`
+
+    - quick: every strategy on 1k bars, then one larger size, grid and each verbose level for "smac"
+    - default: every strategy on 1k and 10k bars, then sweeps of each axis for "smac"
+    - full: every combination of the axes (hours, and grids of 10k need `--result-mode metrics`)
+    - parallel: a grid of 100 "smac" runs on 10k bars with each number of processes of `N_JOBS`,
+      whose speedup over `n_jobs=1` is printed
+    """
+    if suite == "parallel":
+        return [
+            dict(strategy="smac", bars=10000, grid=100, verbose=0, n_jobs=n_jobs)
+            for n_jobs in N_JOBS
+        ]
+    strategies = list(STRATEGY_MAPPING.keys())
+    if suite == "full":
+        axes = itertools.product(strategies, BARS, GRIDS, VERBOSE)
+    elif suite == "quick":
+        axes = itertools.chain(
+            itertools.product(strategies, [1000], [1], [0]),
+            [("smac", 10000, 1, 0), ("smac", 1000, 100, 0)],
+            itertools.product(["smac"], [1000], [1], VERBOSE),
+        )
+    elif suite == "default":
+        axes = itertools.chain(
+            itertools.product(strategies, [1000, 10000], [1], [0]),
+            itertools.product(["smac"], BARS[:3], [1], [0]),
+            itertools.product(["smac"], [1000, 10000], GRIDS[:2], [0]),
+            itertools.product(["smac"], [10000], [1], VERBOSE),
+        )
+    else:
+        raise ValueError("suite should be 'quick', 'default', 'full' or 'parallel'")
+
+    cases = []
+    for strategy, bars, grid, verbose in axes:
+        case = dict(strategy=strategy, bars=bars, grid=grid, verbose=verbose, n_jobs=1)
+        if case not in cases:
+            cases.append(case)
+    return cases
+
+
+@contextlib.contextmanager
+def timed_components():
+    """
+    Accumulates the time spent in each of `COMPONENTS` while the context is open
+    """
+    timings = dict.fromkeys(COMPONENTS, 0.0)
+    originals = {name: getattr(BACKTEST_MODULE, name) for name in COMPONENTS}
+
+    def timed(name, func):
+        def wrapper(*args, **kwargs):
+            tstart = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings[name] += time.perf_counter() - tstart
+
+        return wrapper
+
+    for name, func in originals.items():
+        setattr(BACKTEST_MODULE, name, timed(name, func))
+    try:
+        yield timings
+    finally:
+        for name, func in originals.items():
+            setattr(BACKTEST_MODULE, name, func)
+
+
+def run_case(case, repeat=1, memory=True, result_mode="full"):
+    """
+    Runs a case `repeat` times and returns its fastest time and component times, and its peak memory
+    """
+    data = get_synthetic_data(case["bars"])
+    kwargs = dict(
+        get_grid(case["strategy"], case["grid"]),
+        **STRATEGY_KWARGS.get(case["strategy"], dict()),
+    )
+    if case["strategy"] == "sentiment":
+        kwargs["sentiments"] = get_synthetic_sentiments(data)
+        data = data.set_index("dt")
+
+    def run():
+        # Logs are written but not kept, as they would be in a terminal
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            backtest(
+                case["strategy"],
+                data.copy(),
+                plot=False,
+                verbose=case["verbose"],
+                result_mode=result_mode,
+                n_jobs=case["n_jobs"],
+                **kwargs,
+            )
+
+    result = dict(case, time=float("inf"))
+    for _ in range(repeat):
+        gc.collect()
+        with timed_components() as timings:
+            tstart = time.perf_counter()
+            run()
+            total = time.perf_counter() - tstart
+        if total < result["time"]:
+            result.update(time=total, **timings)
+            result["simulation"] = total - sum(timings.values())
+
+    # Allocations of the worker processes aren't traced
+    if memory and case["n_jobs"] == 1:
+        # Traced separately since tracing slows down every allocation
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run()
+            result["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def get_label():
+    """
+    Short hash of the current git commit, or the current time outside of a repository
+    """
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+def compare(results_df, baseline_path, threshold):
+    """
+    Prints the ratio of each metric to the baseline, and returns the cases slower or larger by more than `threshold`
+
+    The components are printed to locate a regression, but only the total time and the peak memory
+    are checked since the shortest components are dominated by noise
+    """
+    with open(baseline_path) as f:
+        baseline_df = pd.DataFrame(json.load(f)["results"])
+    # Results saved before the parallel cases ran in a single process
+    baseline_df["n_jobs"] = baseline_df.get("n_jobs", 1)
+    keys = ["strategy", "bars", "grid", "verbose", "n_jobs"]
+    merged = results_df.merge(baseline_df, on=keys, suffixes=("", "_baseline"))
+    ratios = []
+    for metric in ["time", "simulation"] + COMPONENTS + ["peak_memory_mb"]:
+        if metric in merged.columns and metric + "_baseline" in merged.columns:
+            merged[metric + "_ratio"] = merged[metric] / merged[metric + "_baseline"]
+            ratios.append(metric + "_ratio")
+
+    print(merged[keys + ratios].to_string(index=False, float_format="{:.2f}".format))
+    checked = [r for r in ["time_ratio", "peak_memory_mb_ratio"] if r in ratios]
+    return merged[(merged[checked] > 1 + threshold).any(axis=1)]
+
+
+def print_speedups(results_df):
+    """
+    Prints the speedup of the cases run with several processes over the same case with `n_jobs=1`
+    """
+    keys = ["strategy", "bars", "grid", "verbose"]
+    serial = results_df[results_df.n_jobs == 1][keys + ["time"]]
+    merged = results_df[results_df.n_jobs > 1].merge(
+        serial, on=keys, suffixes=("", "_serial")
+    )
+    if not len(merged):
+        return
+    merged["speedup"] = merged["time_serial"] / merged["time"]
+    print(
+        merged[keys + ["n_jobs", "time", "time_serial", "speedup"]].to_string(
+            index=False, float_format="{:.2f}".format
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark backtest on synthetic data")
+    parser.add_argument(
+        "--suite", default="default", help="quick, default, full or parallel"
+    )
+    parser.add_argument("--strategies", nargs="+", help="only run these strategies")
+    parser.add_argument("--bars", nargs="+", type=int, help="only run these sizes")
+    parser.add_argument("--grid", nargs="+", type=int, help="only run these grid sizes")
+    parser.add_argument("--verbose", nargs="+", type=int, help="only run these levels")
+    parser.add_argument(
+        "--n-jobs",
+        nargs="+",
+        type=int,
+        help="run each case with these numbers of processes",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="runs timed per case")
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip the traced run of peak memory"
+    )
+    parser.add_argument(
+        "--result-mode",
+        default="full",
+        help="result_mode of backtest (full or metrics)",
+    )
+    parser.add_argument("--label", default=None, help="name of the results file")
+    parser.add_argument("--compare", default=None, help="results file to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative increase reported as a regression by --compare",
+    )
+    args = parser.parse_args()
+
+    filters = dict(
+        strategy=args.strategies, bars=args.bars, grid=args.grid, verbose=args.verbose
+    )
+    cases = [
+        case
+        for case in get_cases(args.suite)
+        if all(values is None or case[key] in values for key, values in filters.items())
+    ]
+    if args.n_jobs:
+        cases = [
+            dict(case, n_jobs=n_jobs)
+            for case in cases
+            if case["n_jobs"] == 1
+            for n_jobs in args.n_jobs
+        ]
+
+    results = []
+    for i, case in enumerate(cases):
+        result = run_case(case, args.repeat, not args.no_memory, args.result_mode)
+        results.append(result)
+        print(
+            "[{}/{}] {strategy} bars={bars} grid={grid} verbose={verbose} n_jobs={n_jobs}: {time:.3f}s".format(
+                i + 1, len(cases), **result
+            )
+            + (
+                ", {:.1f} MB".format(result["peak_memory_mb"])
+                if "peak_memory_mb" in result
+                else ""
+            )
+        )
+
+    print_speedups(pd.DataFrame(results))
+
+    label = args.label or get_label()
+    RESULTS_PATH.mkdir(exist_ok=True)
+    results_file = RESULTS_PATH / "{}.json".format(label)
+    with open(results_file, "w") as f:
+        json.dump(
+            dict(
+                label=label,
+                date=datetime.now().isoformat(),
+                python=platform.python_version(),
+                platform=platform.platform(),
+                suite=args.suite,
+                result_mode=args.result_mode,
+                results=results,
+            ),
+            f,
+            indent=1,
+        )
+    print("Results saved to", results_file)
+
+    if args.compare:
+        regressions = compare(pd.DataFrame(results), args.compare, args.threshold)
+        if len(regressions):
+            print(
+                "{} regressions above {:.0%}".format(len(regressions), args.threshold)
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
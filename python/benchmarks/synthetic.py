@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic OHLCV data for the benchmarks, so that they run offline
+- Prices follow a geometric random walk, with a seeded generator so every run uses the same bars
+- The dataframes are saved next to the sample data in `DATA_PATH` and reused by later runs
+
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from fastquant.config import DATA_PATH
+
+SYNTHETIC_FILE = "synthetic_ohlcv_{}.csv"
+
+# Daily bars would go past the last date pandas supports for the largest sizes
+MAX_DAILY_BARS = 50000
+
+
+def make_synthetic_data(n_bars, seed=0):
+    """
+    Generates `n_bars` of OHLCV data, with the `custom` and `ternary` columns of the custom strategies
+    """
+    rng = np.random.RandomState(seed)
+    freq = "B" if n_bars <= MAX_DAILY_BARS else "min"
+    dts = pd.date_range("1990-01-01", periods=n_bars, freq=freq)
+
+    log_returns = rng.normal(0.0002, 0.015, n_bars)
+    close = 100 * np.exp(np.cumsum(log_returns))
+    open_ = close * np.exp(rng.normal(0, 0.005, n_bars))
+    spread = np.abs(rng.normal(0, 0.01, n_bars)) * close
+    data = pd.DataFrame(
+        {
+            "dt": dts,
+            "open": open_.round(4),
+            "high": (np.maximum(open_, close) + spread).round(4),
+            "low": (np.minimum(open_, close) - spread).round(4),
+            "close": close.round(4),
+            "volume": rng.randint(1000, 100000, n_bars),
+            "custom": (rng.random_sample(n_bars) * 100).round(4),
+            "ternary": rng.choice([-1, 0, 0, 0, 1], n_bars),
+        }
+    )
+    return data
+
+
+def get_synthetic_data(n_bars, seed=0):
+    """
+    Loads the synthetic data of `n_bars` from `DATA_PATH`, generating it on the first call
+    """
+    path = Path(DATA_PATH, SYNTHETIC_FILE.format(n_bars))
+    if seed == 0 and path.exists():
+        return pd.read_csv(path, parse_dates=["dt"])
+
+    data = make_synthetic_data(n_bars, seed)
+    if seed == 0:
+        data.to_csv(path, index=False)
+    return data
+
+
+def get_synthetic_sentiments(data, seed=0):
+    """
+    Sentiment scores in [-1, 1] for a fifth of the bars of `data`, keyed by their datetimes (see `get_bt_news_sentiment`)
+    """
+    rng = np.random.RandomState(seed)
+    dts = data.dt[rng.random_sample(len(data)) < 0.2]
+    scores = rng.uniform(-1, 1, len(dts)).round(4)
+    return dict(zip(dts, scores))
@@ -6,4 +6,5 @@ from .portfolio import *
 from .config import *
 from .backtest import *
 from .data import *
+from .store import *
 from .notification import *
@@ -2,3 +2,8 @@
 
 from fastquant.backtest.backtest import backtest
 from fastquant.backtest.backtest import STRATEGY_MAPPING
+from fastquant.backtest.optimize import optimize
+from fastquant.backtest.batch import backtest_many
+from fastquant.backtest.walk_forward import walk_forward_backtest
+from fastquant.backtest.incremental import incremental_backtest
+from fastquant.backtest.monte_carlo import monte_carlo
@@ -16,6 +16,7 @@ import backtrader.analyzers as btanalyzers
 import pandas as pd
 import numpy as np
 from collections.abc import Iterable
+import itertools
 import time
 from pandas.api.types import is_numeric_dtype
 
@@ -29,10 +30,32 @@ from fastquant.config import (
     DEFAULT_PANDAS,
 )
 from fastquant.strategies.mappings import STRATEGY_MAPPING
+from fastquant.strategies.expression import ExpressionStrategy
 
 # Other backtest components
-from fastquant.backtest.data_prep import initalize_data
-from fastquant.backtest.post_backtest import analyze_strategies, plot_results
+from fastquant.backtest.cache import (
+    ResultCache,
+    get_data_fingerprint,
+    get_run_key,
+    set_strat_id,
+)
+from fastquant.backtest.data_prep import initalize_data, is_stream_source
+from fastquant.backtest.post_backtest import (
+    analyze_strategies,
+    combine_run_results,
+    plot_results,
+)
+from fastquant.backtest.runner import (
+    build_cerebro,
+    run_analyzed,
+    run_parallel,
+    run_stratrun,
+)
+from fastquant.backtest.metrics import METRICS, get_metric_names
+from fastquant.backtest.profiling import Profiler
+from fastquant.backtest.search import sample_product
+from fastquant.backtest.vectorized import run_vectorized
+from fastquant.store import StoreSelection
 
 strat_docs = "\nExisting strategies:\n\n" + "\n".join(
     [key + "\n" + value.__doc__ for key, value in STRATEGY_MAPPING.items()]
@@ -54,7 +77,7 @@ def docstring_parameter(*sub):
 @docstring_parameter(strat_docs)
 def backtest(
     strategy,
-    data,  # Treated as csv path is str, and dataframe of pd.DataFrame
+    data,  # Treated as csv path is str, and dataframe of pd.DataFrame (or streamed, see below)
     commission=COMMISSION_PER_TRANSACTION,
     init_cash=INIT_CASH,
     plot=True,
@@ -65,6 +88,7 @@ def backtest(
     sort_by="rnorm",
     sentiments=[],
     strats={},  # Only used when strategy = "multi"
+    multi_mode="combined",  # Only used when strategy = "multi"
     return_history=False,
     return_plot=False,
     channel="",
@@ -77,6 +101,15 @@ def backtest(
     data_kwargs={},
     plot_kwargs={},
     fig=None,
+    n_jobs=1,
+    engine="backtrader",
+    result_mode="full",
+    search="grid",
+    n_samples=None,
+    seed=None,
+    cache=None,
+    profile=False,
+    metrics=None,
     **kwargs,
 ):
     """Backtest financial data with a specified trading strategy
@@ -85,8 +118,14 @@ def backtest(
     ----------------
     strategy : str or an instance of `fastquant.strategies.base.BaseStrategy`
         see list of accepted strategy keys below
-    data : pandas.DataFrame
-        dataframe with at least close price indexed with time
+    data : pandas.DataFrame, str, StoreSelection or iterator
+        dataframe with at least close price indexed with time, or the path of a CSV file.
+        A selection of a local store (`OHLCVStore(...).select(symbol, start_date, end_date)`) is read
+        from its memory-mapped files, and by each worker process with `n_jobs` instead of a copy.
+        A Parquet/Arrow dataset path (a file or a directory) or an iterator of dataframes
+        (e.g. `pd.read_csv(path, chunksize=100000)`) is streamed a chunk at a time instead of loaded
+        in full, with a bounded number of bars kept by each run. Streamed data is only run by
+        engine="backtrader" without a plot, cache or indicator history, and an iterator by a single run
     commission : float
         commission per transaction [0, 1]
     init_cash : float
@@ -101,6 +140,11 @@ def backtest(
         df of sentiment [0, 1] indexed by time (applicable if `strategy`=='senti')
     strats : dict
         dictionary of strategy parameters (applicable if `strategy`=='multi')
+    multi_mode : str
+        "combined" to run every combination of the strategies in `strats` together on a single portfolio,
+        where a signal of any strategy is traded, or "independent" to run the parameters of each strategy
+        as its own grid search, which takes the sum of their grid sizes instead of their product
+        (applicable if `strategy`=='multi') (default="combined")
     return_history : bool
         return history of transactions (i.e. buy and sell timestamps) (default=False)
     return_plot: bool
@@ -116,19 +160,67 @@ def backtest(
     figsize : tuple
         The size of the figure to be displayed at the end of the backtest (default=(30, 15))
     data_class : bt.feed.DataBase
-        Custom backtrader database to be used as a parent class instead bt.feed. (default=None)
+        Custom backtrader database to be used as a parent class, e.g. bt.feeds.PandasData. By default, the columns are loaded from numpy arrays by `ArrayData` (default=None)
     data_kwargs : dict
-        Datafeed keyword arguments (empty dict by default)
+        Datafeed keyword arguments, where keys other than the parameters of bt.feed.DataBase (e.g. column indices) use bt.feeds.PandasData (empty dict by default)
     F : dict
         Argument for function cerebro.plot() (empty dict by default)
+    n_jobs : int
+        Number of processes used to run the parameter combinations, where -1 uses all the available cores (default=1)
+    engine : str
+        "backtrader" to run the strategy bar by bar, or "vectorized" to compute the built-in strategies
+        with array operations (no stop loss, take profit or cash additions) (default="backtrader")
+    result_mode : str
+        "full" to keep the strategy of every run until the grid search ends, or "metrics" to keep only
+        the metrics of each run as soon as it ends, which bounds the memory of large grid searches
+        (not compatible with `return_history`) (default="full")
+    search : str
+        "grid" to run every combination of the parameter values, or "random" or "lhs" (Latin hypercube)
+        to run at most `n_samples` combinations drawn from them (default="grid")
+    n_samples : int
+        Number of combinations drawn when `search` is "random" or "lhs" (default=None)
+    seed : int
+        Seed of the combinations drawn when `search` is "random" or "lhs" (default=None)
+    cache : bool or str
+        True to store the result of each run in a SQLite file under `DATA_PATH`, or the path of the file to use.
+        Runs already stored for the same data and parameters are skipped, so an interrupted or
+        extended grid search only runs its new combinations (default=None)
+    profile : bool
+        Also return a dataframe of the seconds spent in each phase of the backtest (data, setup, run,
+        metrics, history, sort, plot), and in the signals and orders of the strategies (default=False)
+    metrics : list
+        Metrics kept in the results (e.g. ["rnorm", "maxdrawdown"]), along with `sort_by`, `pnl` and `final_value`.
+        The metrics are computed after each run from its portfolio value and trades (default: the metrics of the
+        backtrader analyzers). "sortino" and "calmar" are only computed when requested, and "rolling_sharpe" adds
+        the annualized Sharpe ratio of the last 252 returns to the periodic history
     {0}
     """
-    # Setting initial support for 1 cpu
-    # Return the full strategy object to get all run information
-    cerebro = bt.Cerebro(stdstats=False, maxcpus=1, optreturn=False)
-    cerebro.addobserver(bt.observers.Broker)
-    cerebro.addobserver(bt.observers.Trades)
-    cerebro.addobserver(bt.observers.BuySell)
+    if result_mode == "metrics" and return_history:
+        raise ValueError("return_history is not available with result_mode='metrics'")
+    independent = strategy == "multi" and multi_mode == "independent"
+    if strategy == "multi" and multi_mode not in ["combined", "independent"]:
+        raise ValueError("multi_mode should be 'combined' or 'independent'")
+    if independent and engine != "backtrader":
+        raise ValueError("multi strategies are only run by engine='backtrader'")
+    streaming = is_stream_source(data)
+    if streaming and (engine != "backtrader" or plot or cache):
+        raise ValueError(
+            "Streamed data is only run by engine='backtrader', with plot=False and no cache"
+        )
+    if search != "grid" and (n_samples is None or strategy == "multi"):
+        raise ValueError(
+            "search='{}' needs `n_samples` and a single strategy".format(search)
+        )
+
+    profiler = Profiler()
+    profiler.start("setup")
+
+    metric_names = get_metric_names(
+        [*(METRICS if metrics is None else metrics), sort_by]
+    )
+    # Runs with `n_jobs` other than 1 are distributed by fastquant instead of backtrader,
+    # and observers are only needed by the plot
+    cerebro = build_cerebro(init_cash, commission, observers=plot)
 
     # Convert all non iterables and strings into lists
     kwargs = {
@@ -139,6 +231,10 @@ def backtest(
     # Add logging parameters based on the `verbose` parameter
     logging_params = get_logging_params(verbose)
     kwargs.update(logging_params)
+    if profile and engine == "backtrader":
+        kwargs["profile"] = [True]
+    # The orders, and the value, cash and size of every bar, are only recorded for the history
+    kwargs["record_history"] = [return_history]
 
     # Add Strategy
     strat_names = []
@@ -156,6 +252,8 @@ def backtest(
                 slippage=slippage,
                 single_position=single_position,
                 short_max=short_max,
+                record_history=[return_history],
+                **logging_params,
                 **params,
             )
             strat_names.append(strat)
@@ -169,9 +267,11 @@ def backtest(
         else:
             strat_name = strategy
             strategy = STRATEGY_MAPPING[strategy]
+        if issubclass(strategy, ExpressionStrategy):
+            # The other names of the expressions are searched like parameters
+            strategy = strategy.with_params(kwargs)
 
-        cerebro.optstrategy(
-            strategy,
+        strat_kwargs = dict(
             init_cash=[init_cash],
             commission=commission,
             channel=channel,
@@ -183,86 +283,245 @@ def backtest(
             short_max=short_max,
             **kwargs,
         )
+        cerebro.optstrategy(strategy, **strat_kwargs)
+        if search != "grid":
+            # Replace the product of the parameter values with a sample of it
+            values = dict(zip(strat_kwargs, cerebro.iterize(strat_kwargs.values())))
+            cerebro.strats[-1] = [
+                (strategy, (), params)
+                for params in sample_product(values, n_samples, search, seed)
+            ]
         strat_names.append(strat_name)
 
-    # Apply Total, Average, Compound and Annualized Returns calculated using a logarithmic approach
-    cerebro.addanalyzer(btanalyzers.Returns, _name="returns")
-    cerebro.addanalyzer(btanalyzers.SharpeRatio, _name="mysharpe")
-    cerebro.addanalyzer(btanalyzers.DrawDown, _name="drawdown")
-    cerebro.addanalyzer(btanalyzers.TimeDrawDown, _name="timedraw")
-    cerebro.addanalyzer(
-        btanalyzers.TradeAnalyzer, _name="tradeanalyzer"
-    )  # trade analyzer
-
-    cerebro.broker.setcommission(commission=commission)
+    profiler.stop("setup")
 
     # Initalize and verify data
-    pd_data, data, data_format_dict = initalize_data(
-        data, strat_name, symbol, data_class, sentiments, data_kwargs
-    )
-    cerebro.adddata(pd_data)
-    cerebro.broker.setcash(init_cash)
-    # Allows us to set buy price based on next day closing
-    # (technically impossible, but reasonable assuming you use all your money to buy market at the end of the next day)
-    cerebro.broker.set_coc(True)
+    source = data
+    with profiler.phase("data"):
+        pd_data, data, data_format_dict = initalize_data(
+            data, strat_name, symbol, data_class, sentiments, data_kwargs
+        )
+        cerebro.adddata(pd_data)
     if verbose > 0:
         print("Starting Portfolio Value: %.2f" % cerebro.broker.getvalue())
 
-    # clock the start of the process
-    tstart = time.time()
-    stratruns = cerebro.run()
+    # Strategy objects of each run, only kept by the serial backtrader engine in "full" mode
+    stratruns = None
+    if (
+        engine == "backtrader"
+        and n_jobs == 1
+        and result_mode == "full"
+        and not cache
+        and not independent
+        and not streaming
+    ):
+        # clock the start of the process
+        tstart = time.time()
+        with profiler.phase("run"):
+            stratruns = cerebro.run()
 
-    # clock the end of the process
-    tend = time.time()
+        # clock the end of the process
+        tend = time.time()
 
-    if verbose > 0:
-        # print out the result
-        print("Time used (seconds):", str(tend - tstart))
-
-    # Get History, Optimal Parameters and Strategy Metrics
-    sorted_combined_df, optim_params, history_dict = analyze_strategies(
-        init_cash,
-        stratruns,
-        data,
-        strat_names,
-        strategy,
-        strats,
-        sort_by,
-        return_history,
-        verbose,
-        multi_line_indicators,
-        **kwargs,
-    )
+        if verbose > 0:
+            # print out the result
+            print("Time used (seconds):", str(tend - tstart))
+
+        # Get History, Optimal Parameters and Strategy Metrics
+        sorted_combined_df, optim_params, history_dict = analyze_strategies(
+            init_cash,
+            stratruns,
+            data,
+            strat_names,
+            strategy,
+            strats,
+            sort_by,
+            return_history,
+            verbose,
+            multi_line_indicators,
+            metrics=metric_names,
+            profiler=profiler,
+            **kwargs,
+        )
+    else:
+        if independent:
+            # The grid of each strategy is run alone, one strategy after the other
+            # Each run is named after the position of its strategy in `cerebro.strats`
+            iterstrats, run_strat_names = [], []
+            for name, strat in zip(strat_names, cerebro.strats):
+                for stratparams in strat:
+                    iterstrats.append((stratparams,))
+                    run_strat_names.append([name])
+        else:
+            # Same combinations (and order) that `cerebro.run()` would go through
+            iterstrats = list(itertools.product(*cerebro.strats))
+            run_strat_names = None
+        if (
+            streaming
+            and not isinstance(data, str)
+            and (len(iterstrats) > 1 or n_jobs != 1)
+        ):
+            raise ValueError(
+                "An iterator of dataframes is only run once, use a Parquet/Arrow path for grids or n_jobs"
+            )
+        if verbose > 0:
+            print("==================================================")
+            print("Number of strat runs:", len(iterstrats))
+            print("Strat names:", strat_names)
+
+        run_results = [None] * len(iterstrats)
+        result_cache = None
+        if cache:
+            result_cache = ResultCache(None if cache is True else cache)
+            fingerprint = get_data_fingerprint(
+                data, symbol=symbol, data_class=data_class, data_kwargs=data_kwargs
+            )
+            run_keys = [
+                get_run_key(
+                    fingerprint,
+                    iterstrat,
+                    engine=engine,
+                    metrics=metric_names,
+                    init_cash=init_cash,
+                    commission=commission,
+                    strat_names=strat_names,
+                    # The history is named after the searched parameters
+                    history=(
+                        [sorted(kwargs), strats, multi_line_indicators]
+                        if return_history
+                        else None
+                    ),
+                )
+                for iterstrat in iterstrats
+            ]
+            for strat_idx, run_key in enumerate(run_keys):
+                result = result_cache.get(run_key)
+                if result is not None:
+                    run_results[strat_idx] = set_strat_id(result, strat_idx)
+            if verbose > 0:
+                print(
+                    "Cached strat runs:",
+                    sum(result is not None for result in run_results),
+                )
+
+        def on_result(strat_idx, result):
+            run_results[strat_idx] = result
+            profiler.add(result.get("timings"))
+            if result_cache is not None:
+                result_cache.set(run_keys[strat_idx], result)
+
+        # Only the runs missing from the cache are computed
+        strat_idxs = [i for i, result in enumerate(run_results) if result is None]
+        cerebro_kwargs = dict(
+            init_cash=init_cash,
+            commission=commission,
+            observers=False,
+            exactbars=1 if streaming else False,
+        )
+        analyze_kwargs = dict(
+            init_cash=init_cash,
+            strat_names=strat_names,
+            strategy=strategy,
+            strats=strats,
+            return_history=return_history,
+            verbose=verbose,
+            multi_line_indicators=multi_line_indicators,
+            metrics=metric_names,
+            **kwargs,
+        )
+
+        tstart = time.time()
+        profiler.start("run")
+        try:
+            if engine == "vectorized":
+                vectorized_results = run_vectorized(
+                    [iterstrats[i] for i in strat_idxs],
+                    data,
+                    return_history,
+                    verbose,
+                    metrics=metric_names,
+                    **kwargs,
+                )
+                for strat_idx, result in zip(strat_idxs, vectorized_results):
+                    on_result(strat_idx, set_strat_id(result, strat_idx))
+            elif n_jobs == 1:
+                # Each run is analyzed as soon as it ends, so that its strategy can be freed
+                run_analyzed(
+                    iterstrats,
+                    strat_idxs,
+                    pd_data,
+                    cerebro_kwargs,
+                    analyze_kwargs,
+                    callback=on_result,
+                    run_strat_names=run_strat_names,
+                )
+            elif strat_idxs:
+                worker_data_kwargs = dict(
+                    symbol=symbol, data_class=data_class, data_kwargs=data_kwargs
+                )
+                if isinstance(source, StoreSelection):
+                    # Workers read the selection from the store instead of receiving a copy of the data
+                    worker_data_kwargs.update(
+                        strategy_name=strat_name, sentiments=sentiments
+                    )
+                run_parallel(
+                    iterstrats,
+                    source if isinstance(source, StoreSelection) else data,
+                    n_jobs,
+                    data_kwargs=worker_data_kwargs,
+                    cerebro_kwargs=cerebro_kwargs,
+                    analyze_kwargs=analyze_kwargs,
+                    strat_idxs=strat_idxs,
+                    callback=on_result,
+                    run_strat_names=run_strat_names,
+                )
+        finally:
+            if result_cache is not None:
+                result_cache.close()
+        tend = time.time()
+        profiler.stop("run")
+        if engine == "backtrader" and n_jobs == 1:
+            # Serial runs are analyzed as soon as they end, within the run phase
+            profiler.timings["run"] -= (
+                profiler.timings["metrics"] + profiler.timings["history"]
+            )
+
+        if verbose > 0:
+            print("Time used (seconds):", str(tend - tstart))
+
+        with profiler.phase("sort"):
+            sorted_combined_df, optim_params, history_dict = combine_run_results(
+                run_results, sort_by, return_history, verbose
+            )
 
     # Plot
 
     if plot and strategy != "multi":
+        profiler.start("plot")
         # Plot only with the optimal parameters when multiple strategy runs are required
-        if sorted_combined_df.shape[0] != 1:
-            if verbose > 0:
-                print("=============================================")
-                print("Plotting backtest for optimal parameters ...")
-            _, fig = backtest(
-                strategy,
-                data,
-                plot=plot,
-                verbose=0,
-                sort_by=sort_by,
-                return_plot=return_plot,
-                plot_kwargs=plot_kwargs,
-                **optim_params,
-            )
+        if sorted_combined_df.shape[0] != 1 and verbose > 0:
+            print("=============================================")
+            print("Plotting backtest for optimal parameters ...")
+        optim_idx = sorted_combined_df.strat_id.iloc[0]
+        if stratruns is not None:
+            cerebro.runstrats = [stratruns[optim_idx]]
         else:
-            fig = plot_results(cerebro, data_format_dict, figsize, **plot_kwargs)
-
-    if return_history and return_plot:
-        return sorted_combined_df, history_dict, fig
-    elif return_history:
-        return sorted_combined_df, history_dict
-    elif return_plot:
-        return sorted_combined_df, fig
-    else:
-        return sorted_combined_df
+            # Other engines don't keep their strategies, so only the optimal run is repeated
+            optim_stratrun = run_stratrun(
+                iterstrats[optim_idx], pd_data, dict(cerebro_kwargs, observers=True)
+            )
+            cerebro = optim_stratrun[0].cerebro
+        fig = plot_results(cerebro, data_format_dict, figsize, **plot_kwargs)
+        profiler.stop("plot")
+
+    outputs = [sorted_combined_df]
+    if return_history:
+        outputs.append(history_dict)
+    if return_plot:
+        outputs.append(fig)
+    if profile:
+        outputs.append(profiler.report())
+    return tuple(outputs) if len(outputs) > 1 else outputs[0]
 
 
 def get_logging_params(verbose):
@@ -11,6 +11,7 @@ from backtrader.indicators import (
 )
 import re
 
+from fastquant.indicators.custom import ExpressionSignals
 
 # Some indicators contain multiple "lines" instead of just one
 # From source code `lines` attribute of the indacator
@@ -86,6 +87,13 @@ MULTI_LINE_INDICATORS = [
             "chikou_span",
         ),
     ),
+    (
+        ExpressionSignals,
+        (
+            "buy",
+            "sell",
+        ),
+    ),
 ]
 
 
@@ -125,9 +133,11 @@ def get_indicators_as_dict(strat_run, multi_line_indicators):
 
 def get_line_names(indicator, multi_line_ind):
 
+    # Memoized indicators have the lines of the indicator they wrap
+    indicator_type = getattr(indicator, "indicator_class", None) or type(indicator)
     for indicator_class, line_names in multi_line_ind:
         # Check the type/class # isinstance doesnt work on subclasses correctly
-        if type(indicator) == indicator_class:
+        if indicator_type == indicator_class:
             return line_names
     return ()
 
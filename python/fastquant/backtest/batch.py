@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Backtesting of a strategy across many symbols
+- Each symbol is fetched (or taken from the given data) and backtested by the same worker,
+  so fetching the next symbols overlaps with backtesting the current ones
+- Worker processes are reused across symbols, so imports and setup happen once per worker
+
+"""
+
+import multiprocessing
+import warnings
+
+import pandas as pd
+
+from fastquant.backtest.backtest import backtest
+from fastquant.backtest.runner import get_n_jobs
+from fastquant.data.stocks.stocks import get_stock_data
+
+
+def _backtest_symbol(args):
+    symbol, data, strategy, start_date, end_date, source, kwargs = args
+    try:
+        if data is None:
+            data = get_stock_data(symbol, start_date, end_date, source=source)
+        result = backtest(strategy, data, symbol=symbol, **kwargs)
+    except Exception as e:
+        # A missing or malformed symbol shouldn't stop the rest of the scan
+        return symbol, None, "{}: {}".format(type(e).__name__, e)
+    return symbol, result, None
+
+
+def backtest_many(
+    symbols,
+    strategy,
+    start_date=None,
+    end_date=None,
+    n_jobs=1,
+    source="yahoo",
+    data=None,
+    sort_by="rnorm",
+    verbose=0,
+    **kwargs,
+):
+    """Backtests a strategy, or a grid of its parameters, on each symbol of a universe
+
+    Parameters
+    ----------------
+    symbols : list of str
+        symbols to backtest (e.g. `get_stock_table().Symbol`)
+    strategy : str or an instance of `fastquant.strategies.base.BaseStrategy`
+        strategy to backtest on each symbol (same as `backtest`)
+    start_date : str
+        starting date (YYYY-MM-DD) of the data fetched with `get_stock_data`
+    end_date : str
+        ending date (YYYY-MM-DD) of the data fetched with `get_stock_data`
+    n_jobs : int
+        number of worker processes, where each symbol is run by a single worker
+        (None or -1 uses all the available cores) (default=1)
+    source : str
+        source of the data fetched with `get_stock_data` (default="yahoo")
+    data : dict
+        dataframes already loaded for some symbols, keyed by symbol (these aren't fetched) (default=None)
+    sort_by : str
+        metric used to sort the runs of each symbol and pick its optimal parameters (default="rnorm")
+    verbose : int
+        verbosity of each `backtest` (default=0)
+    kwargs : dict
+        other arguments of `backtest`, including the parameters of the strategy or lists of them for a grid search
+
+    Returns
+    -------
+    A tuple of
+    - pandas.DataFrame of the results of every symbol (same columns as `backtest`, with `symbol` set)
+    - pandas.DataFrame of the optimal run of each symbol, indexed by symbol
+
+    Symbols which fail to load or backtest are skipped with a warning.
+    """
+    data = data or dict()
+    kwargs = dict(kwargs, plot=False, verbose=verbose, sort_by=sort_by)
+    # Each symbol already has its own process, so its grid runs serially
+    kwargs["n_jobs"] = 1
+    tasks = [
+        (symbol, data.get(symbol), strategy, start_date, end_date, source, kwargs)
+        for symbol in symbols
+    ]
+
+    n_jobs = min(get_n_jobs(n_jobs), max(len(tasks), 1))
+    if n_jobs == 1:
+        outputs = map(_backtest_symbol, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(n_jobs)
+        # Symbols are dispatched one at a time since their fetch and run times vary widely
+        outputs = pool.imap(_backtest_symbol, tasks)
+
+    results = []
+    try:
+        for symbol, result, error in outputs:
+            if error is not None:
+                warnings.warn("Skipping {}: {}".format(symbol, error))
+                continue
+            results.append(result)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if not results:
+        raise ValueError("None of the symbols could be backtested")
+
+    combined_df = pd.concat(results, ignore_index=True)
+    optim_df = (
+        combined_df.groupby("symbol", sort=False)
+        .head(1)
+        .set_index("symbol")
+        .sort_values(sort_by, ascending=False, na_position="last", kind="stable")
+    )
+    return combined_df, optim_df
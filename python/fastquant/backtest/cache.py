@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of the results of strategy runs
+- Each run is keyed by a hash of the data, the strategy classes and all their parameters
+- Results are stored in a SQLite file as soon as each run ends, so an interrupted grid search
+  resumes from the runs it already completed
+
+"""
+
+import hashlib
+import pickle
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from fastquant.config import DATA_PATH
+
+# Default cache file, used by `backtest(cache=True)`
+CACHE_FILE = "backtest_cache.sqlite"
+
+# Changing this invalidates the results stored by previous versions
+CACHE_VERSION = 1
+
+# Parameters that only affect what is printed or timed
+LOGGING_PARAMS = [
+    "strategy_logging",
+    "periodic_logging",
+    "transaction_logging",
+    "profile",
+    "record_history",
+]
+
+
+def get_data_fingerprint(data, **data_kwargs):
+    """
+    Hash of the content of a dataframe processed by `initalize_data`, and of the arguments used to build its feed
+    """
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+    digest.update(repr([(c, str(t)) for c, t in data.dtypes.items()]).encode())
+    digest.update(_to_key(data_kwargs).encode())
+    return digest.hexdigest()
+
+
+def _to_key(obj):
+    """
+    Deterministic text of `obj`, where numpy scalars equal their python values and classes are named by their path
+    """
+    if isinstance(obj, dict):
+        return (
+            "{"
+            + ",".join(
+                "{}:{}".format(_to_key(k), _to_key(obj[k]))
+                for k in sorted(obj, key=str)
+            )
+            + "}"
+        )
+    if isinstance(obj, (list, tuple)):
+        return "[" + ",".join(_to_key(x) for x in obj) + "]"
+    if isinstance(obj, type):
+        return "{}.{}".format(obj.__module__, obj.__qualname__)
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    return repr(obj)
+
+
+def get_run_key(fingerprint, iterstrat, **extra):
+    """
+    Key of a parameter combination (a tuple of `(strategy class, args, kwargs)`) on the data of `fingerprint`
+
+    `extra` holds the other settings that change the result of the run (e.g. the engine)
+    """
+    strats = [
+        (
+            stratcls,
+            sargs,
+            {k: v for k, v in skwargs.items() if k not in LOGGING_PARAMS},
+        )
+        for stratcls, sargs, skwargs in iterstrat
+    ]
+    text = _to_key([CACHE_VERSION, fingerprint, strats, extra])
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    SQLite store of the outputs of `analyze_stratrun`, keyed by `get_run_key`
+
+    Parameters
+    ----------
+    path : str
+        path of the SQLite file, created if it doesn't exist (default: backtest_cache.sqlite under `DATA_PATH`)
+    """
+
+    def __init__(self, path=None):
+        self.path = str(path or Path(DATA_PATH, CACHE_FILE))
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result BLOB)"
+        )
+        self.connection.commit()
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT result FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        return pickle.loads(row[0]) if row is not None else None
+
+    def set(self, key, result):
+        # Committed right away, so that the run survives an interruption of the search
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results (key, result) VALUES (?, ?)",
+            (key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)),
+        )
+        self.connection.commit()
+
+    def clear(self):
+        self.connection.execute("DELETE FROM results")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+def set_strat_id(result, strat_idx):
+    """
+    Assigns the strat id of the current search to the history of a cached result
+    """
+    for key in ["orders", "periodic", "indicators"]:
+        for df in result[key]:
+            df["strat_id"] = strat_idx
+    return result
@@ -1,55 +1,271 @@
+import array
+import itertools
+import os
+from collections.abc import Iterable
+
+import numpy as np
 import pandas as pd
 import backtrader as bt
+from backtrader.linebuffer import LineBuffer
 from pandas.api.types import is_numeric_dtype
 
 
+from fastquant.backtest.metrics import EPOCH_DATE_NUM
 from fastquant.config import DEFAULT_PANDAS
+from fastquant.store import StoreSelection
 
+NS_PER_DAY = 86400 * 10**9
 
-def initalize_data(
-    data,
-    strategy_name,
-    symbol=None,
-    data_class=None,
-    sentiments=None,
-    data_kwargs={},
-    verbose=None,
-):
+# Feed classes generated by `get_array_data_class`, keyed by their base class and extra lines
+ARRAY_DATA_CLASSES = dict()
 
-    # Treat `data` as a path if it's a string; otherwise, it's treated as a pandas dataframe
+# Formats of the datasets streamed by `StreamData`, by file extension (directories are read as Parquet)
+STREAM_FORMATS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".arrow": "ipc",
+    ".ipc": "ipc",
+    ".feather": "ipc",
+}
+# Rows read at a time from a Parquet/Arrow dataset
+STREAM_BATCH_SIZE = 100000
+# Bars read ahead of the current one, so that the strategies see the end of a stream coming
+STREAM_LOOKAHEAD = 2
+
+
+class ArrayData(bt.feed.DataBase):
+    """
+    Data feed whose lines are loaded from contiguous float64 numpy arrays (see `get_feed_arrays`)
+
+    The arrays are copied into the line buffers at once when preloading,
+    instead of a bar at a time through pandas indexing as in `bt.feeds.PandasData`
+    """
+
+    params = (("arrays", None), ("symbol", None))
+
+    # Whether the bars are read while running instead of preloaded
+    streaming = False
+
+    def start(self):
+        super().start()
+        self.set_arrays(self.p.arrays)
+
+    def set_arrays(self, arrays):
+        self._arrays = arrays
+        self._idx = -1
+        self._n_bars = len(arrays["datetime"])
+        self._line_arrays = [
+            (getattr(self.lines, name), values)
+            for name, values in arrays.items()
+            if name in self.lines.getlinealiases()
+        ]
+
+    def preload(self):
+        bulk = (
+            not self._tzinput
+            and not self._filters
+            and self.lines.datetime.mode == LineBuffer.UnBounded
+        )
+        if not bulk:
+            # Time zones and filters are applied by `load` a bar at a time
+            return super().preload()
+
+        dts = self._arrays["datetime"]
+        mask = (dts >= self.fromdate) & (dts <= self.todate)
+        n_bars = int(mask.sum())
+        for name in self.lines.getlinealiases():
+            values = self._arrays.get(name)
+            line = getattr(self.lines, name)
+            if values is None:
+                values = np.full(n_bars, np.nan)
+            elif n_bars < len(values):
+                values = values[mask]
+            line.array = array.array("d", np.ascontiguousarray(values).tobytes())
+            line.idx = n_bars - 1
+            line.lencount = n_bars
+
+        self._last()
+        self.home()
+
+    def _load(self):
+        self._idx += 1
+        if self._idx >= self._n_bars:
+            return False
+        # Bounded lines keep the values as they are given, and the broker expects python floats
+        for line, values in self._line_arrays:
+            line[0] = float(values[self._idx])
+        return True
+
+
+class StreamData(ArrayData):
+    """
+    Data feed that reads the chunks of a Parquet/Arrow dataset or of an iterator of dataframes while running,
+    and only keeps the chunk of the current bar in memory
+
+    `chunks` is called at the start of every run, and returns an iterator of the chunks prepared by `prepare_data`.
+    Backtrader only keeps a bounded number of bars of its lines with `Cerebro(exactbars=1)`
+    """
+
+    params = (("chunks", None), ("params_tuple", None))
+
+    streaming = True
+
+    def start(self):
+        bt.feed.DataBase.start(self)
+        self._chunks = self.p.chunks()
+        self._names = None
+        self.set_arrays(dict(datetime=np.array([])))
+
+    def preload(self):
+        return bt.feed.DataBase.preload(self)
+
+    def qbuffer(self, savemem=0, replaying=False):
+        # One extra bar, so that the last bar is still in the lines after the end of the stream is read
+        for line in self.lines:
+            line.qbuffer(savemem=savemem, extrasize=1)
+
+    def read_chunk(self):
+        """
+        Appends the next chunk to the bars not loaded yet, and returns False at the end of the stream
+        """
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        arrays = get_feed_arrays(chunk, self.p.params_tuple)
+        if self._names is None:
+            self._names = list(arrays)
+        start = self._idx + 1
+        self.set_arrays(
+            {
+                name: np.concatenate(
+                    [
+                        self._arrays.get(name, np.array([]))[start:],
+                        arrays.get(name, np.full(len(chunk), np.nan)),
+                    ]
+                )
+                for name in self._names
+            }
+        )
+        return True
+
+    def bars_left(self):
+        """
+        Number of bars after the current one, which is exact up to `STREAM_LOOKAHEAD`
+        """
+        return self._n_bars - self._idx - 1
+
+    def _load(self):
+        # Reads ahead of the bar loaded here, which becomes the current one
+        while self.bars_left() <= STREAM_LOOKAHEAD + 1 and self.read_chunk():
+            pass
+        return super()._load()
+
+
+def get_array_data_class(extra_lines, base=ArrayData):
+    """
+    Subclass of `base` with the lines `extra_lines`, generated once for each base class and tuple of lines
+    """
+    key = (base, extra_lines)
+    if key not in ARRAY_DATA_CLASSES:
+
+        class CustomArrayData(base):
+            """
+            Data feed that includes all the numeric columns in the input dataframe
+            """
+
+            lines = extra_lines
+
+        ARRAY_DATA_CLASSES[key] = CustomArrayData
+    return ARRAY_DATA_CLASSES[key]
+
+
+def date2num(dts):
+    """
+    Vectorized `bt.date2num` of a series of datetimes, converted to UTC if they have a time zone
+    """
+    dts = pd.to_datetime(pd.Series(dts))
+    if dts.dt.tz is not None:
+        dts = dts.dt.tz_convert("UTC").dt.tz_localize(None)
+    ns = dts.values.astype("datetime64[ns]").astype(np.int64)
+    days, ns = np.divmod(ns, NS_PER_DAY)
+    hours, ns = np.divmod(ns, 3600 * 10**9)
+    minutes, ns = np.divmod(ns, 60 * 10**9)
+    seconds, ns = np.divmod(ns, 10**9)
+    # Same operations as `bt.date2num`, so the floats are equal
+    return (days + EPOCH_DATE_NUM) + (
+        hours / 24.0 + minutes / 1440.0 + seconds / 86400.0 + (ns // 1000) / 8.64e10
+    )
+
+
+def get_feed_arrays(data, params_tuple):
+    """
+    Lines of `ArrayData` as float64 arrays, from the columns of `params_tuple` in `data`
+
+    The default lines missing from `params_tuple` are matched with the columns regardless of case,
+    as `bt.feeds.PandasData` does
+    """
+    columns = {col.lower(): col for col, _ in params_tuple}
+    arrays = dict()
+    for col, default in DEFAULT_PANDAS + tuple((col, None) for col, _ in params_tuple):
+        col_name = columns.get(col.lower()) if default == -1 else col
+        if col in arrays or col_name not in data.columns:
+            continue
+        if col == "datetime":
+            arrays[col] = date2num(data[col_name])
+        else:
+            arrays[col] = data[col_name].to_numpy(dtype=float, na_value=np.nan)
+    return arrays
+
+
+def is_stream_source(data):
+    """
+    Whether `data` is streamed by `StreamData`: a Parquet/Arrow dataset path, or an iterator of dataframes
+    """
     if isinstance(data, str):
-        if verbose > 0:
-            print("Reading path as pandas dataframe ...")
-        # Rename dt to datetime
-        data = pd.read_csv(data, header=0, parse_dates=["dt"])
+        return (
+            os.path.isdir(data) or os.path.splitext(data)[1].lower() in STREAM_FORMATS
+        )
+    return isinstance(data, Iterable) and not isinstance(data, (pd.DataFrame, dict))
 
-    # Add dividend column in case it doesn't exist
-    # This is utilized if `invest_div` is set to True in `backtest` `kwargs` (True by default)
-    if "dividend" not in data.columns:
-        data["dividend"] = 0
 
-    if strategy_name == "sentiment":
-        data = include_sentiment_score(data, sentiments)
+def read_dataset_batches(path, batch_size=STREAM_BATCH_SIZE):
+    """
+    Dataframes of `batch_size` rows of a Parquet/Arrow file or directory, read with pyarrow
+    """
+    try:
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise ImportError("pyarrow is required to stream Parquet/Arrow datasets")
 
-    # If a `close` column exists but an `open` column doesn't, create a new `open` column with the same values as the `close` column
-    # This is for easier handling of next day trades (w/ the assumption that next day open is equal to current day close)
-    if "close" in data.columns and "open" not in data.columns:
-        data["open"] = data.close.shift().values
+    fmt = STREAM_FORMATS.get(os.path.splitext(path)[1].lower(), "parquet")
+    for batch in ds.dataset(path, format=fmt).to_batches(batch_size=batch_size):
+        yield batch.to_pandas()
 
-    # If data has `dt` as the index and `dt` or `datetime` are not already columns, set `dt` as the first column
-    # This means `backtest` supports the dataframe whether `dt` is the index or a column
-    if len(set(["dt", "datetime"]).intersection(data.columns)) == 0:
-        if data.index.name == "dt":
-            data = data.reset_index()
-        # If the index is a datetime index, set this as the datetime column
-        elif isinstance(data.index, pd.DatetimeIndex):
-            data.index.name = "dt"
-            data = data.reset_index()
 
-    # Rename "dt" column to "datetime" to match the formal alias
-    data = data.rename(columns={"dt": "datetime"})
-    data["datetime"] = pd.to_datetime(data.datetime)
+def iter_chunks(source, strategy_name=None, sentiments=None):
+    """
+    Chunks of a Parquet/Arrow dataset path or of an iterator of dataframes, prepared by `prepare_data`
+    """
+    if isinstance(source, str):
+        source = read_dataset_batches(source)
+    last_close = np.nan
+    for chunk in source:
+        if len(chunk) == 0:
+            continue
+        derived_open = "close" in chunk.columns and "open" not in chunk.columns
+        chunk = prepare_data(chunk, strategy_name, sentiments)
+        if derived_open:
+            # The open of the first bar is the close of the last bar of the previous chunk
+            chunk.iloc[0, chunk.columns.get_loc("open")] = last_close
+            last_close = chunk.close.iloc[-1]
+        yield chunk
+
 
+def get_params_tuple(data):
+    """
+    Index of the numeric columns and the datetime column of `data`, and the numeric columns
+    that aren't default lines of backtrader
+    """
     numeric_cols = [col for col in data.columns if is_numeric_dtype(data[col])]
     params_tuple = tuple(
         [
@@ -62,6 +278,93 @@ def initalize_data(
     non_default_numeric_cols = tuple(
         [col for col, _ in params_tuple if col not in default_cols]
     )
+    return params_tuple, non_default_numeric_cols
+
+
+def initalize_stream(
+    source, strategy_name, symbol=None, sentiments=None, data_kwargs={}
+):
+    """
+    `StreamData` feed of a Parquet/Arrow dataset path or of an iterator of dataframes (see `initalize_data`)
+
+    The lines of the feed are the columns of the first chunk. An iterator can only be run once,
+    while a path is read again by each run
+    """
+    chunks = iter_chunks(source, strategy_name, sentiments)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        raise ValueError("The data stream has no rows")
+    params_tuple, non_default_numeric_cols = get_params_tuple(first_chunk)
+
+    def get_chunks():
+        nonlocal chunks
+        if chunks is None:
+            if not isinstance(source, str):
+                raise ValueError(
+                    "An iterator of dataframes can only be backtested once, use a Parquet/Arrow path instead"
+                )
+            return iter_chunks(source, strategy_name, sentiments)
+        # The first run continues the chunks read to get the columns
+        run_chunks, chunks = itertools.chain([first_chunk], chunks), None
+        return run_chunks
+
+    CustomStreamData = get_array_data_class(non_default_numeric_cols, StreamData)
+    feed = CustomStreamData(
+        dataname=source,
+        chunks=get_chunks,
+        params_tuple=params_tuple,
+        symbol=symbol,
+        **data_kwargs,
+    )
+    return feed, source, tuple_to_dict(params_tuple)
+
+
+def initalize_data(
+    data,
+    strategy_name=None,
+    symbol=None,
+    data_class=None,
+    sentiments=None,
+    data_kwargs={},
+    verbose=None,
+):
+    """
+    Data feed of `data`, the dataframe it was built from, and the index of each of its columns
+
+    `data` is a dataframe, a CSV path, a `StoreSelection` of an `OHLCVStore`, or a Parquet/Arrow dataset
+    path or an iterator of dataframes (e.g. `pd.read_csv(path, chunksize=...)`), which are streamed by
+    `StreamData` instead of loaded in full. The source of a stream is returned instead of a dataframe
+    """
+    if is_stream_source(data):
+        if data_class:
+            raise ValueError("data_class is not supported by streamed data")
+        return initalize_stream(data, strategy_name, symbol, sentiments, data_kwargs)
+
+    if isinstance(data, StoreSelection):
+        # The columns are views of the memory-mapped store
+        data = data.read()
+
+    # Treat `data` as a path if it's a string; otherwise, it's treated as a pandas dataframe
+    if isinstance(data, str):
+        if verbose > 0:
+            print("Reading path as pandas dataframe ...")
+        # Rename dt to datetime
+        data = pd.read_csv(data, header=0, parse_dates=["dt"])
+
+    data = prepare_data(data, strategy_name, sentiments)
+    params_tuple, non_default_numeric_cols = get_params_tuple(data)
+    data_format_dict = tuple_to_dict(params_tuple)
+
+    # The array feed supports the parameters of `bt.feed.DataBase`, but not the column parameters of PandasData
+    if not data_class and set(data_kwargs).issubset(ArrayData.params._getkeys()):
+        CustomArrayData = get_array_data_class(non_default_numeric_cols)
+        pd_data = CustomArrayData(
+            dataname=data,
+            arrays=get_feed_arrays(data, params_tuple),
+            symbol=symbol,
+            **data_kwargs,
+        )
+        return pd_data, data, data_format_dict
 
     # Use custom data class if input
     if data_class:
@@ -92,8 +395,6 @@ def initalize_data(
             # add the parameter to the parameters inherited from the base class
             params = params_tuple + (("symbol", symbol),)
 
-    data_format_dict = tuple_to_dict(params_tuple)
-
     pd_data = CustomData(
         dataname=data, symbol=symbol, **data_format_dict, **data_kwargs
     )
@@ -101,6 +402,39 @@ def initalize_data(
     return pd_data, data, data_format_dict
 
 
+def prepare_data(data, strategy_name=None, sentiments=None):
+    """
+    Adds the dividend, sentiment and open columns used by the strategies, and the datetime column
+    """
+    # Add dividend column in case it doesn't exist
+    # This is utilized if `invest_div` is set to True in `backtest` `kwargs` (True by default)
+    if "dividend" not in data.columns:
+        data["dividend"] = 0
+
+    if strategy_name == "sentiment":
+        data = include_sentiment_score(data, sentiments)
+
+    # If a `close` column exists but an `open` column doesn't, create a new `open` column with the same values as the `close` column
+    # This is for easier handling of next day trades (w/ the assumption that next day open is equal to current day close)
+    if "close" in data.columns and "open" not in data.columns:
+        data["open"] = data.close.shift().values
+
+    # If data has `dt` as the index and `dt` or `datetime` are not already columns, set `dt` as the first column
+    # This means `backtest` supports the dataframe whether `dt` is the index or a column
+    if len(set(["dt", "datetime"]).intersection(data.columns)) == 0:
+        if data.index.name == "dt":
+            data = data.reset_index()
+        # If the index is a datetime index, set this as the datetime column
+        elif isinstance(data.index, pd.DatetimeIndex):
+            data.index.name = "dt"
+            data = data.reset_index()
+
+    # Rename "dt" column to "datetime" to match the formal alias
+    data = data.rename(columns={"dt": "datetime"})
+    data["datetime"] = pd.to_datetime(data.datetime)
+    return data
+
+
 def include_sentiment_score(data, sentiments):
 
     # initialize series for sentiments
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental backtests, which continue a previous run on the new bars of the data
+- A snapshot holds the state of the broker and the strategy at the end of a run,
+  and the last bars of the data to warm up the indicators of the next run
+- Each daily update only runs the warm-up bars and the new bars instead of the full history
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from fastquant.backtest.backtest import get_logging_params
+from fastquant.backtest.data_prep import initalize_data
+from fastquant.backtest.metrics import get_drawdown_metrics, get_returns_metrics
+from fastquant.backtest.runner import run_stratrun
+from fastquant.config import INIT_CASH, COMMISSION_PER_TRANSACTION
+from fastquant.strategies.mappings import STRATEGY_MAPPING
+
+# Orders which stay open across bars, and which aren't kept in snapshots
+UNSUPPORTED_PARAMS = ["stop_loss", "stop_trail"]
+
+
+def incremental_backtest(
+    strategy,
+    data,
+    snapshot=None,
+    warmup_bars=None,
+    init_cash=INIT_CASH,
+    commission=COMMISSION_PER_TRANSACTION,
+    verbose=0,
+    **kwargs,
+):
+    """Backtests a single parameter combination, continuing from the snapshot of a previous run if given
+
+    Parameters
+    ----------------
+    strategy : str or an instance of `fastquant.strategies.base.BaseStrategy`
+        strategy to backtest (same as `backtest`, except "multi")
+    data : pandas.DataFrame
+        dataframe with at least close price indexed with time. With a snapshot, only the bars after
+        the end of the snapshot are used, so it can hold either the new bars or the full history
+    snapshot : dict
+        snapshot returned by a previous call, whose strategy, parameters and state are continued (default=None)
+    warmup_bars : int
+        number of bars kept in the snapshot to warm up the indicators of the next run
+        (default: 5 times the minimum period of the strategy, and at least 250).
+        Indicators with a recursive smoothing (e.g. EMA, RSI) only match a full run approximately
+    init_cash, commission, verbose, kwargs
+        same as `backtest`, ignored when continuing a snapshot (except `verbose` and `channel`)
+
+    Returns
+    -------
+    A tuple of
+    - pandas.DataFrame with a single row of the parameters, the action of the last bar,
+      and the metrics of the bars run by this call
+    - the snapshot of the end of this run, to pass to the next call
+    """
+    if snapshot is None:
+        if isinstance(strategy, str):
+            strategy = STRATEGY_MAPPING[strategy]
+        unsupported = [k for k in UNSUPPORTED_PARAMS if kwargs.get(k)]
+        if unsupported:
+            raise ValueError(
+                "{} not supported by incremental backtests".format(
+                    ", ".join(unsupported)
+                )
+            )
+        params = dict(init_cash=init_cash, commission=commission, **kwargs)
+        state = None
+        _, new_data, _ = initalize_data(data.copy(), None, params.get("symbol"))
+        run_data = new_data
+        start_value = init_cash
+    else:
+        strategy = snapshot["strategy"]
+        params = dict(snapshot["params"])
+        if "channel" in kwargs:
+            params["channel"] = kwargs["channel"]
+        state = snapshot["state"]
+        _, new_data, _ = initalize_data(data.copy(), None, params.get("symbol"))
+        new_data = new_data[new_data.datetime > state["dt"]]
+        run_data = pd.concat([snapshot["data"], new_data], ignore_index=True)
+        if snapshot["derived_open"]:
+            # The open of the first new bar is the close of the last snapshot bar
+            run_data["open"] = run_data.close.shift().values
+        # Trading resumes at the last bar of the snapshot, which the previous run couldn't trade on
+        params.update(resume_state=state, trade_start=state["dt"])
+        start_value = state["value"]
+
+    if len(new_data) == 0:
+        raise ValueError("No new bars to backtest")
+
+    pd_data, run_data, _ = initalize_data(run_data, None, params.get("symbol"))
+    stratrun = run_stratrun(
+        [(strategy, (), dict(params, **get_logging_params(verbose)))],
+        pd_data,
+        dict(
+            init_cash=params["init_cash"],
+            commission=params["commission"],
+            observers=False,
+        ),
+    )
+    strat = stratrun[0]
+    end_state = strat.end_state
+
+    values = np.array(strat.periodic_history["portfolio_value"])
+    metrics = dict(
+        dt=end_state["dt"],
+        action=strat.action,
+        **get_returns_metrics(start_value, strat.final_value, max(len(values), 1)),
+        maxdrawdown=(
+            get_drawdown_metrics(np.append(start_value, values))["max"]["drawdown"]
+        ),
+        pnl=strat.pnl,
+        final_value=strat.final_value,
+    )
+    params = {
+        k: v for k, v in params.items() if k not in ["resume_state", "trade_start"]
+    }
+    result_df = pd.DataFrame([dict(**params, **metrics)])
+
+    if warmup_bars is None:
+        warmup_bars = max(5 * strat._minperiod, 250)
+    new_snapshot = dict(
+        strategy=strategy,
+        params=params,
+        state=end_state,
+        data=run_data.iloc[-warmup_bars:].reset_index(drop=True),
+        derived_open=(
+            snapshot["derived_open"]
+            if snapshot is not None
+            else "open" not in data.columns
+        ),
+    )
+    return result_df, new_snapshot
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Performance metrics computed from a recorded portfolio value curve and trade list
+- Each function mirrors the backtrader analyzer used by `backtest`, with the same output keys
+- `get_run_metrics` computes all of them after a run, replacing the analyzers updated at every bar
+
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from fastquant.indicators.numpy_indicators import sma, stddev
+
+# Annualization factor used by the Returns analyzer for daily data
+TRADING_DAYS = 252
+RISK_FREE_RATE = 0.01
+
+# `bt.date2num` of 1970-01-01, the origin of numpy datetimes
+EPOCH_DATE_NUM = 719163
+
+TRADE_METRICS = [
+    "total",
+    "win_rate",
+    "won",
+    "lost",
+    "won_avg",
+    "won_avg_prcnt",
+    "lost_avg",
+    "lost_avg_prcnt",
+    "won_max",
+    "won_max_prcnt",
+    "lost_max",
+    "lost_max_prcnt",
+]
+
+# Metrics of each run, in the column order of the results of `backtest`
+METRICS = [
+    "rtot",
+    "ravg",
+    "rnorm",
+    "rnorm100",
+    "len",
+    "drawdown",
+    "moneydown",
+    "max",
+    "maxdrawdown",
+    "maxdrawdownperiod",
+    "sharperatio",
+    "pnl",
+    "final_value",
+    *TRADE_METRICS,
+]
+
+# Metrics only computed when requested with the `metrics` of `backtest`, after the ones of `METRICS`
+OPTIONAL_METRICS = [
+    "sortino",
+    "calmar",
+    # Column of the periodic history instead of a metric of each run
+    "rolling_sharpe",
+]
+
+
+def get_returns_metrics(start_value, end_value, n_periods, tann=TRADING_DAYS):
+    """
+    Equivalent of `backtrader.analyzers.Returns` (log returns)
+    """
+    try:
+        nlrtot = end_value / start_value
+    except ZeroDivisionError:
+        rtot = float("-inf")
+    else:
+        rtot = float("-inf") if nlrtot < 0.0 else math.log(nlrtot)
+
+    ravg = rtot / n_periods
+    rnorm = math.expm1(ravg * tann) if ravg > float("-inf") else ravg
+    return dict(rtot=rtot, ravg=ravg, rnorm=rnorm, rnorm100=rnorm * 100.0)
+
+
+def get_drawdown_metrics(values):
+    """
+    Equivalent of `backtrader.analyzers.DrawDown`, where `values` is the portfolio value at every bar
+    """
+    values = np.asarray(values, dtype=float)
+    peaks = np.maximum.accumulate(values)
+    moneydown = peaks - values
+    drawdown = 100.0 * moneydown / peaks
+
+    # Length of the current drawdown streak at every bar
+    idx = np.arange(len(values))
+    last_peak = np.maximum.accumulate(np.where(drawdown == 0, idx, -1))
+    lens = np.where(drawdown != 0, idx - last_peak, 0)
+
+    return {
+        "len": int(lens[-1]),
+        "drawdown": float(drawdown[-1]),
+        "moneydown": float(moneydown[-1]),
+        "max": {
+            "len": int(lens.max()),
+            "drawdown": float(drawdown.max()),
+            "moneydown": float(moneydown.max()),
+        },
+    }
+
+
+def get_time_drawdown_metrics(values):
+    """
+    Equivalent of `backtrader.analyzers.TimeDrawDown`, where `values` is the portfolio value at every period
+    """
+    values = np.asarray(values, dtype=float)
+    peaks = np.maximum.accumulate(values)
+    drawdown = 100.0 * (peaks - values) / peaks
+
+    # The streak is only reset when a strictly higher peak is reached
+    idx = np.arange(len(values))
+    prev_peaks = np.concatenate([[-np.inf], peaks[:-1]])
+    last_peak = np.maximum.accumulate(np.where(values > prev_peaks, idx, 0))
+    in_drawdown = np.cumsum(drawdown != 0)
+    lens = in_drawdown - in_drawdown[last_peak]
+
+    return dict(maxdrawdown=float(drawdown.max()), maxdrawdownperiod=int(lens.max()))
+
+
+def get_sharpe_ratio(values, years, start_value, riskfreerate=RISK_FREE_RATE):
+    """
+    Equivalent of `backtrader.analyzers.SharpeRatio` with its default yearly timeframe
+
+    `years` holds the calendar year of every value, and the ratio is None if it can't be computed
+    """
+    values = np.asarray(values, dtype=float)
+    years = np.asarray(years)
+    year_ends = np.flatnonzero(np.append(years[1:] != years[:-1], True))
+    end_values = values[year_ends]
+    start_values = np.concatenate([[start_value], end_values[:-1]])
+    excess = end_values / start_values - 1.0 - riskfreerate
+
+    retdev = excess.std()
+    if len(excess) == 0 or retdev == 0:
+        return dict(sharperatio=None)
+    return dict(sharperatio=float(excess.mean() / retdev))
+
+
+def get_trade_metrics(trade_pnls, n_trades, init_cash):
+    """
+    Win/loss statistics of the closed trades (net of commission), as assembled from `TradeAnalyzer`
+
+    `n_trades` is the number of opened trades, which includes the ones still open at the end
+    """
+    pnls = np.asarray(trade_pnls, dtype=float)
+    metrics = dict(total=n_trades)
+    for key in ["win_rate", "won", "lost"]:
+        metrics[key] = np.nan
+
+    if len(pnls):
+        won = pnls[pnls >= 0]
+        lost = pnls[pnls < 0]
+        metrics["win_rate"] = len(won) / n_trades
+        metrics["won"] = len(won)
+        metrics["lost"] = len(lost)
+        won_avg = won.sum() / (len(won) or 1.0)
+        lost_avg = lost.sum() / (len(lost) or 1.0)
+        won_max = max(won.max(), 0.0) if len(won) else 0.0
+        lost_max = min(lost.min(), 0.0) if len(lost) else 0.0
+    else:
+        won_avg = lost_avg = won_max = lost_max = np.nan
+
+    metrics.update(
+        won_avg=won_avg,
+        won_avg_prcnt=won_avg / init_cash * 100,
+        lost_avg=lost_avg,
+        lost_avg_prcnt=lost_avg / init_cash * 100,
+        won_max=won_max,
+        won_max_prcnt=won_max / init_cash * 100,
+        lost_max=lost_max,
+        lost_max_prcnt=lost_max / init_cash * 100,
+    )
+    # Same column order as the results of `backtest`
+    return {key: metrics[key] for key in TRADE_METRICS}
+
+
+def get_metric_names(metrics=None):
+    """
+    Names of `METRICS` needed for `metrics` (all of them if None), which always include the final value and pnl
+    """
+    if metrics is None:
+        return list(METRICS)
+    names = METRICS + OPTIONAL_METRICS
+    unknown = [metric for metric in metrics if metric not in names]
+    if unknown:
+        raise ValueError("Unknown metrics {}, choose from {}".format(unknown, names))
+    return [
+        metric
+        for metric in names
+        if metric in metrics or metric in ["pnl", "final_value"]
+    ]
+
+
+def get_period_returns(values, start_value):
+    """
+    Simple returns of consecutive values, where the first value is relative to `start_value`
+    """
+    values = np.asarray(values, dtype=float)
+    return values / np.concatenate([[start_value], values[:-1]]) - 1.0
+
+
+def get_sortino_ratio(
+    values, start_value, riskfreerate=RISK_FREE_RATE, tann=TRADING_DAYS
+):
+    """
+    Annualized Sortino ratio of the daily `values`, which only penalizes the returns below the risk free rate
+    """
+    excess = get_period_returns(values, start_value) - riskfreerate / tann
+    downside = math.sqrt(np.mean(np.minimum(excess, 0.0) ** 2)) if len(excess) else 0
+    if downside == 0:
+        return np.nan
+    return float(excess.mean() / downside * math.sqrt(tann))
+
+
+def get_calmar_ratio(rnorm, maxdrawdown):
+    """
+    Annualized return over the maximum drawdown (both in %)
+    """
+    if not maxdrawdown:
+        return np.nan
+    return rnorm * 100.0 / maxdrawdown
+
+
+def get_rolling_sharpe(
+    returns, window=TRADING_DAYS, riskfreerate=RISK_FREE_RATE, tann=TRADING_DAYS
+):
+    """
+    Annualized Sharpe ratio of the daily `returns` over a rolling `window`, NaN until `window` returns are available
+    """
+    excess = np.asarray(returns, dtype=float) - riskfreerate / tann
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return sma(excess, window) / stddev(excess, window) * math.sqrt(tann)
+
+
+def get_bar_dates(date_nums):
+    """
+    Dates (numpy datetime64[D]) of backtrader date numbers
+    """
+    return (np.floor(np.asarray(date_nums, dtype=float)) - EPOCH_DATE_NUM).astype(
+        "datetime64[D]"
+    )
+
+
+def get_bar_datetimes(date_nums, tz=None):
+    """
+    Datetimes (numpy datetime64[us]) of backtrader date numbers, rounded like `bt.num2date`,
+    in the timezone `tz` of their feed (same as `datetime.datetime(0)` of the feed)
+    """
+    date_nums = np.asarray(date_nums, dtype=float)
+    days = np.floor(date_nums)
+    hours, remainder = np.divmod(24.0 * (date_nums - days), 1)
+    minutes, remainder = np.divmod(60.0 * remainder, 1)
+    seconds, remainder = np.divmod(60.0 * remainder, 1)
+    microseconds = (1e6 * remainder).astype(np.int64)
+    # Same compensation of the rounding errors as `bt.num2date`
+    microseconds[microseconds < 10] = 0
+    microseconds[microseconds > 999990] = 1000000
+    seconds = (
+        (days.astype(np.int64) - EPOCH_DATE_NUM) * 86400
+        + hours.astype(np.int64) * 3600
+        + minutes.astype(np.int64) * 60
+        + seconds.astype(np.int64)
+    )
+    dts = (seconds * 1000000 + microseconds).astype("datetime64[us]")
+    if tz is not None:
+        dts = pd.DatetimeIndex(dts).tz_localize("UTC").tz_convert(tz)
+        dts = dts.tz_localize(None).values.astype("datetime64[us]")
+    return dts
+
+
+class ValueCurve:
+    """
+    Portfolio value at every bar, reduced as it is recorded to what `get_run_metrics` needs:
+    the drawdown of the latest bar and its maxima, and the first and last value of every day
+
+    `update` can be called on consecutive chunks of bars, so the memory is bounded by the number of days
+    """
+
+    def __init__(self):
+        self.peak = -np.inf
+        self.drawdown = dict(len=0, drawdown=0.0, moneydown=0.0)
+        self.max = dict(len=0, drawdown=0.0, moneydown=0.0)
+        self.dates = []
+        self.day_starts = []
+        self.day_ends = []
+
+    def update(self, values, dates):
+        """
+        Adds the portfolio `values` of the next bars and their `dates` (or backtrader date numbers)
+        """
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return self
+        dates = np.asarray(dates)
+        if dates.dtype.kind == "f":
+            dates = get_bar_dates(dates)
+        dates = dates.astype("datetime64[D]")
+
+        # Same drawdown as `get_drawdown_metrics`, continuing the peak and the streak of the previous bars
+        peaks = np.maximum.accumulate(np.maximum(values, self.peak))
+        moneydown = peaks - values
+        drawdown = 100.0 * moneydown / peaks
+        idx = np.arange(len(values))
+        last_peak = np.maximum.accumulate(np.where(drawdown == 0, idx, -1))
+        lens = np.where(
+            drawdown != 0,
+            np.where(last_peak >= 0, idx - last_peak, self.drawdown["len"] + idx + 1),
+            0,
+        )
+        self.peak = peaks[-1]
+        self.drawdown = dict(
+            len=int(lens[-1]),
+            drawdown=float(drawdown[-1]),
+            moneydown=float(moneydown[-1]),
+        )
+        self.max = dict(
+            len=max(self.max["len"], int(lens.max())),
+            drawdown=max(self.max["drawdown"], float(drawdown.max())),
+            moneydown=max(self.max["moneydown"], float(moneydown.max())),
+        )
+
+        day_starts = np.flatnonzero(np.append(True, dates[1:] != dates[:-1]))
+        day_ends = np.append(day_starts[1:] - 1, len(values) - 1)
+        if self.dates and self.dates[-1][-1] == dates[0]:
+            # The first day continues the last day of the previous bars
+            self.day_ends[-1][-1] = values[day_ends[0]]
+            day_starts, day_ends = day_starts[1:], day_ends[1:]
+        self.dates.append(dates[day_starts])
+        self.day_starts.append(values[day_starts])
+        self.day_ends.append(values[day_ends])
+        return self
+
+    def get_days(self):
+        """
+        Dates, first values and last values of every day
+        """
+        return tuple(
+            np.concatenate(chunks) if chunks else np.array([])
+            for chunks in [self.dates, self.day_starts, self.day_ends]
+        )
+
+
+def get_run_metrics(
+    values,
+    dates,
+    start_value,
+    final_value,
+    pnl,
+    trade_pnls,
+    n_trades,
+    metrics=None,
+):
+    """
+    Metrics of a run computed from its portfolio value at every bar and its closed trades,
+    with the same keys and values as the backtrader analyzers
+
+    Parameters
+    ----------
+    values : array or ValueCurve
+        portfolio value at every bar of the data, including the bars before the strategy starts trading,
+        or a `ValueCurve` that recorded them (then `dates` is ignored)
+    dates : array
+        dates of the bars, which split them into daily and yearly periods
+    start_value, final_value : float
+        portfolio value before the first bar, and after the pending cash of the last bar is credited
+    pnl : float
+        profit of the run, net of the cash added during the run
+    trade_pnls : array
+        profit of each closed trade, net of commission
+    n_trades : int
+        number of trades opened during the run
+    metrics : list
+        names in `METRICS` and `OPTIONAL_METRICS` to return (default: the ones of `METRICS`)
+    """
+    curve = values
+    if not isinstance(curve, ValueCurve):
+        curve = ValueCurve().update(values, dates)
+    days, day_starts, day_ends = curve.get_days()
+
+    run_metrics = {
+        **get_returns_metrics(start_value, final_value, len(days)),
+        **curve.drawdown,
+        "max": dict(curve.max),
+        **get_time_drawdown_metrics(day_starts),
+        **get_sharpe_ratio(day_ends, days.astype("datetime64[Y]"), start_value),
+        "pnl": pnl,
+        "final_value": final_value,
+        **get_trade_metrics(trade_pnls, n_trades, start_value),
+    }
+    metrics = METRICS if metrics is None else metrics
+    if "sortino" in metrics:
+        run_metrics["sortino"] = get_sortino_ratio(day_ends, start_value)
+    if "calmar" in metrics:
+        run_metrics["calmar"] = get_calmar_ratio(
+            run_metrics["rnorm"], run_metrics["max"]["drawdown"]
+        )
+    return {
+        key: run_metrics[key]
+        for key in METRICS + OPTIONAL_METRICS
+        if key in metrics and key in run_metrics
+    }
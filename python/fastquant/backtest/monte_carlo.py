@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo simulations of the history of a backtest
+- "trade_shuffle" reorders (or redraws) the closed trades of the run
+- "block_bootstrap" redraws blocks of consecutive periodic returns, which keeps their short term dependence
+- Every simulated path of a chunk is computed at once with array operations
+
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from fastquant.backtest.metrics import RISK_FREE_RATE
+
+METHODS = ["trade_shuffle", "block_bootstrap"]
+
+
+def get_run_history(result, strat_id=None):
+    """
+    Orders and periodic history of a single run from the output of `backtest(..., return_history=True)`
+
+    `result` is either the `(results, history)` tuple, where the optimal run is used by default,
+    or the history dict, which should then hold a single run unless `strat_id` is given
+    """
+    if isinstance(result, tuple):
+        results, history = result[:2]
+        if strat_id is None:
+            strat_id = results.strat_id.iloc[0]
+    else:
+        history = result
+
+    periodic = history["periodic"]
+    orders = history["orders"]
+    if strat_id is None:
+        strat_ids = periodic.strat_id.unique()
+        if len(strat_ids) != 1:
+            raise ValueError(
+                "The history holds {} runs, choose one with `strat_id`".format(
+                    len(strat_ids)
+                )
+            )
+        strat_id = strat_ids[0]
+    periodic = periodic[periodic.strat_id == strat_id]
+    orders = orders[orders.strat_id == strat_id]
+    if len(periodic) < 2:
+        raise ValueError("The run of strat_id {} has no history".format(strat_id))
+    return orders, periodic
+
+
+def get_trade_pnls(orders):
+    """
+    Pnl of each closed trade of an orders history, net of the commissions of the orders that opened
+    and closed it (as the `pnlcomm` of the trades of backtrader)
+    """
+    pnls = []
+    position = trade_pnl = 0.0
+    for size, commission, pnl in orders[["size", "commission", "pnl"]].itertuples(
+        index=False
+    ):
+        # Part of the order that reduces the position, where a reversal opens a new trade with the rest
+        closed = 0.0
+        if position and (size > 0) != (position > 0):
+            closed = size if abs(size) <= abs(position) else -position
+        closed_commission = commission * abs(closed) / abs(size)
+        trade_pnl += pnl - closed_commission
+        position += closed
+        if closed and not position:
+            pnls.append(trade_pnl)
+            trade_pnl = 0.0
+        trade_pnl -= commission - closed_commission
+        position += size - closed
+    return np.array(pnls, dtype=float)
+
+
+def get_periods_per_year(dts, n_periods):
+    """
+    Number of periods per year over the time spanned by `dts`
+    """
+    dts = pd.to_datetime(pd.Series(dts))
+    years = (dts.iloc[-1] - dts.iloc[0]).days / 365.25
+    return n_periods / years if years > 0 else n_periods
+
+
+def simulate_paths(returns, start_value, periods_per_year):
+    """
+    Final value, maximum drawdown (%) and annualized Sharpe ratio of each path (row) of `returns`
+    """
+    values = start_value * np.cumprod(1.0 + returns, axis=1)
+    peaks = np.maximum(np.maximum.accumulate(values, axis=1), start_value)
+    maxdrawdown = 100.0 * (1.0 - values / peaks).max(axis=1)
+
+    excess = returns - RISK_FREE_RATE / periods_per_year
+    std = excess.std(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe = np.where(
+            std > 1e-12, excess.mean(axis=1) / std * math.sqrt(periods_per_year), np.nan
+        )
+    return dict(final_value=values[:, -1], maxdrawdown=maxdrawdown, sharpe=sharpe)
+
+
+def monte_carlo(
+    result,
+    n=10000,
+    method="trade_shuffle",
+    strat_id=None,
+    block_size=20,
+    replace=False,
+    chunk_size=1000,
+    seed=None,
+):
+    """Simulates `n` alternative paths of a backtest to get the distribution of its final value, drawdown and Sharpe ratio
+
+    Parameters
+    ----------------
+    result : tuple or dict
+        output of `backtest(..., return_history=True)`, or its history dict
+    n : int
+        number of simulated paths (default=10000)
+    method : str
+        "trade_shuffle" to shuffle the order of the closed trades, where each trade compounds its
+        return on the portfolio value left by the previous ones, or "block_bootstrap" to redraw
+        the periodic returns in blocks of `block_size` consecutive periods (default="trade_shuffle")
+    strat_id : int
+        run of the history to simulate (default: the optimal run of a `(results, history)` tuple,
+        or the only run of a history dict)
+    block_size : int
+        number of consecutive returns in each block of "block_bootstrap" (default=20)
+    replace : bool
+        draw the trades of "trade_shuffle" with replacement, which also varies the final value
+        (a shuffle without replacement keeps it, and only changes the drawdown) (default=False)
+    chunk_size : int
+        number of paths computed at once, which bounds the memory to `chunk_size` times the number
+        of trades or periods (default=1000)
+    seed : int
+        seed of the random draws (default=None)
+
+    Returns
+    -------
+    pandas.DataFrame with the `final_value`, `maxdrawdown` (%) and annualized `sharpe` of each path,
+    where the Sharpe ratio is computed on the returns of each trade for "trade_shuffle"
+    """
+    if method not in METHODS:
+        raise ValueError("method should be one of {}".format(METHODS))
+    orders, periodic = get_run_history(result, strat_id)
+    values = periodic.portfolio_value.values.astype(float)
+    start_value = values[0]
+
+    if method == "trade_shuffle":
+        pnls = get_trade_pnls(orders)
+        if len(pnls) == 0:
+            raise ValueError("The run has no closed trades to shuffle")
+        equity = start_value + np.concatenate([[0.0], np.cumsum(pnls)[:-1]])
+        returns = pnls / equity
+    else:
+        returns = values[1:] / values[:-1] - 1.0
+        block_size = min(block_size, len(returns))
+    periods_per_year = get_periods_per_year(periodic.dt, len(returns))
+
+    rng = np.random.RandomState(seed)
+    n_returns = len(returns)
+    chunks = []
+    for chunk_start in range(0, n, chunk_size):
+        n_paths = min(chunk_size, n - chunk_start)
+        if method == "trade_shuffle" and replace:
+            idx = rng.randint(0, n_returns, size=(n_paths, n_returns))
+        elif method == "trade_shuffle":
+            idx = rng.rand(n_paths, n_returns).argsort(axis=1)
+        else:
+            n_blocks = math.ceil(n_returns / block_size)
+            starts = rng.randint(0, n_returns - block_size + 1, (n_paths, n_blocks))
+            idx = (starts[:, :, None] + np.arange(block_size)).reshape(n_paths, -1)
+            idx = idx[:, :n_returns]
+        chunks.append(
+            pd.DataFrame(simulate_paths(returns[idx], start_value, periods_per_year))
+        )
+    return pd.concat(chunks, ignore_index=True)
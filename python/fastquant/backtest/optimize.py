@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sequential optimization of strategy parameters
+- Each trial is a `backtest` run of the parameters proposed by a sampler
+- Samplers are registered in `fastquant.backtest.search`
+
+"""
+
+import pandas as pd
+
+from fastquant.backtest.backtest import backtest
+from fastquant.backtest.post_backtest import print_dict
+from fastquant.backtest.search import SAMPLER_MAPPING, get_dimensions
+
+
+def optimize(
+    strategy,
+    data,
+    space,
+    n_trials=100,
+    objective="rnorm",
+    search="tpe",
+    seed=None,
+    verbose=1,
+    **kwargs,
+):
+    """Searches the parameters of a strategy that maximize a backtest metric
+
+    Parameters
+    ----------------
+    strategy : str or an instance of `fastquant.strategies.base.BaseStrategy`
+        strategy to optimize (same as `backtest`, except "multi")
+    data : pandas.DataFrame
+        dataframe with at least close price indexed with time
+    space : dict
+        parameters to search, where each value is either
+        - a tuple `(low, high)` of a numeric range (integers if both bounds are integers)
+        - a tuple `(low, high, "log")` of a numeric range searched on a log scale
+        - a list or range of the values to choose from
+        - any other value, used as is in every trial
+    n_trials : int
+        number of parameter combinations evaluated (default=100)
+    objective : str
+        metric of the `backtest` results to maximize (default="rnorm")
+    search : str or sampler object
+        "tpe" (Tree-structured Parzen Estimator), "gp" (Gaussian process), "random",
+        or any object with `ask()` returning a dict of parameters and `tell(params, value)` (default="tpe")
+    seed : int
+        seed of the sampler, to reproduce a search (default=None)
+    verbose : int
+        1 to print each trial and the optimal parameters, 0 for no logs (default=1)
+    kwargs : dict
+        other arguments of `backtest`, used in every trial
+
+    Returns
+    -------
+    pandas.DataFrame of the metrics of each evaluated parameter combination, sorted by `objective`
+    (same columns as `backtest`, with the trial number as `strat_id`)
+    """
+    dimensions, fixed = get_dimensions(space)
+    if isinstance(search, str):
+        if search not in SAMPLER_MAPPING:
+            raise ValueError(
+                "search should be one of {}".format(list(SAMPLER_MAPPING.keys()))
+            )
+        sampler = SAMPLER_MAPPING[search](dimensions, seed=seed)
+    else:
+        sampler = search
+
+    # Results of each distinct parameter combination, since proposals can repeat on discrete spaces
+    results = dict()
+    for trial in range(n_trials):
+        params = sampler.ask()
+        key = tuple(sorted((name, repr(value)) for name, value in params.items()))
+        if key not in results:
+            result = backtest(
+                strategy,
+                data,
+                plot=False,
+                verbose=0,
+                sort_by=objective,
+                **kwargs,
+                **fixed,
+                **params,
+            )
+            if objective not in result.columns:
+                raise ValueError("{} is not a backtest metric".format(objective))
+            result["strat_id"] = trial
+            results[key] = result
+
+        value = results[key][objective].iloc[0]
+        sampler.tell(params, value)
+        if verbose > 0:
+            print_dict(params, "Trial {} ({}={}):".format(trial, objective, value))
+
+    sorted_combined_df = (
+        pd.concat(list(results.values()))
+        .sort_values(objective, ascending=False, na_position="last", kind="stable")
+        .reset_index(drop=True)
+    )
+    if verbose > 0:
+        optim_params = {d.name: sorted_combined_df[d.name].iloc[0] for d in dimensions}
+        print_dict(optim_params, "Optimal parameters:")
+
+    return sorted_combined_df
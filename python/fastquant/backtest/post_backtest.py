@@ -1,10 +1,17 @@
 from fastquant.strategies.buy_and_hold import BuyAndHoldStrategy
+import time
+
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import backtrader as bt
 
 from fastquant.backtest.backtest_indicators import get_indicators_as_dict
+from fastquant.backtest.metrics import (
+    get_bar_dates,
+    get_rolling_sharpe,
+    get_run_metrics,
+)
 from fastquant.config import GLOBAL_PARAMS
 
 """
@@ -16,6 +23,29 @@ Post backtest functionalities
 """
 
 
+def get_strategy_metrics(strat, init_cash, metrics=None):
+    """
+    Metrics of a finished strategy, from the portfolio value at every bar and the trades it recorded
+    (see `fastquant.backtest.metrics.get_run_metrics`)
+    """
+    if strat.value_curve is not None:
+        # Streamed runs reduce their values as they go (see `BaseStrategy.reduce_value_history`)
+        values, dates = strat.value_curve, None
+    else:
+        values = np.asarray(strat.value_history, dtype=float)
+        dates = get_bar_dates(strat.data.datetime.array[: len(values)])
+    return get_run_metrics(
+        values,
+        dates,
+        init_cash,
+        strat.final_value,
+        strat.pnl,
+        strat.trade_pnls,
+        strat.n_trades,
+        metrics,
+    )
+
+
 def analyze_strategies(
     init_cash,
     stratruns,
@@ -27,27 +57,78 @@ def analyze_strategies(
     return_history,
     verbose,
     multi_line_indicators=None,
+    metrics=None,
+    profiler=None,
     **kwargs
 ):
-    params = []
-    metrics = []
     if verbose > 0:
         print("==================================================")
         print("Number of strat runs:", len(stratruns))
         print("Number of strats per run:", len(stratruns[0]))
         print("Strat names:", strat_names)
 
+    run_results = [
+        analyze_stratrun(
+            init_cash,
+            stratrun,
+            strat_idx,
+            strat_names,
+            strategy,
+            strats,
+            return_history,
+            verbose,
+            multi_line_indicators,
+            metrics,
+            **kwargs
+        )
+        for strat_idx, stratrun in enumerate(stratruns)
+    ]
+
+    if profiler is None:
+        return combine_run_results(run_results, sort_by, return_history, verbose)
+    for result in run_results:
+        profiler.add(result["timings"])
+    with profiler.phase("sort"):
+        return combine_run_results(run_results, sort_by, return_history, verbose)
+
+
+def analyze_stratrun(
+    init_cash,
+    stratrun,
+    strat_idx,
+    strat_names,
+    strategy,
+    strats,
+    return_history,
+    verbose,
+    multi_line_indicators=None,
+    metrics=None,
+    **kwargs
+):
+    """
+    Extracts the parameters, metrics and (optionally) the history of a single strategy run
+
+    `strat_names` are the names of the strategies of the run, in their order in the run.
+    The output only holds plain python and pandas objects, so that it can be sent back from worker processes.
+    `metrics` are the names of the metrics to compute (default: the ones of `METRICS`).
+    Its `timings` hold the seconds spent in each phase of the analysis (see `fastquant.backtest.profiling`)
+    """
+    timings = dict(metrics=0.0, history=0.0)
+    strats_params = {}
     order_history_dfs = []
     periodic_history_dfs = []
     indicator_history_dfs = []
-    for strat_idx, stratrun in enumerate(stratruns):
-        strats_params = {}
-
-        if verbose > 0:
-            print("**************************************************")
 
-        for i, strat in enumerate(stratrun):
-            # Get indicator history
+    if verbose > 0:
+        print("**************************************************")
+
+    for i, strat in enumerate(stratrun):
+        tstart = time.perf_counter()
+        # Get indicator history
+        if strat.streaming:
+            # Streamed runs only keep the last bars of their indicators
+            indicators_df = pd.DataFrame(dict(dt=[]))
+        else:
             st_dtime = [
                 bt.utils.date.num2date(num) for num in strat.lines.datetime.plot()
             ]
@@ -55,147 +136,102 @@ def analyze_strategies(
             indicators_df = pd.DataFrame(indicators_dict)
             indicators_df.insert(0, "dt", st_dtime)
 
-            strat_name = strat_names[i]
-            p_raw = strat.p._getkwargs()
-            p, selected_p = {}, {}
-            for k, v in p_raw.items():
-                if k not in [
-                    "strategy_logging",
-                    "periodic_logging",
-                    "transaction_logging",
-                ]:
-                    # Make sure the parameters are mapped to the corresponding strategy
-                    if strategy == "multi":
-                        key = (
-                            "{}.{}".format(strat_name, k)
-                            if k not in GLOBAL_PARAMS
-                            else k
-                        )
-                        # make key with format: e.g. smac.slow_period40_fast_period10
-                        if k in strats[strat_name]:
-                            selected_p[k] = v
-                        pkeys = "_".join(
-                            ["{}{}".format(*i) for i in selected_p.items()]
-                        )
-                        history_key = "{}.{}".format(strat_name, pkeys)
-                    else:
-                        key = k
-
-                        # make key with format: e.g. slow_period40_fast_period10
-                        if k in kwargs.keys():
-                            selected_p[k] = v
-                        history_key = "_".join(
-                            ["{}{}".format(*i) for i in selected_p.items()]
-                        )
-                    p[key] = v
-
-            strats_params = {**strats_params, **p}
-
-            if return_history:
-                # columns are decided in log method of BaseStrategy class in base.py
-                order_history_df = strat.order_history_df
-                order_history_df["dt"] = pd.to_datetime(order_history_df.dt)
-                # combine rows with identical index
-                # history_df = order_history_df.set_index('dt').dropna(how='all')
-                # history_dfs[history_key] = order_history_df.stack().unstack().astype(float)
-                order_history_df.insert(0, "strat_name", history_key)
-                order_history_df.insert(0, "strat_id", strat_idx)
-                order_history_dfs.append(order_history_df)
-
-                periodic_history_df = strat.periodic_history_df
-                periodic_history_df["dt"] = pd.to_datetime(periodic_history_df.dt)
-                periodic_history_df.insert(0, "strat_name", history_key)
-                periodic_history_df.insert(0, "strat_id", strat_idx)
-                periodic_history_df[
-                    "return"
-                ] = periodic_history_df.portfolio_value.pct_change()
-                periodic_history_dfs.append(periodic_history_df)
-
-                indicators_df.insert(0, "strat_name", history_key)
-                indicators_df.insert(0, "strat_id", strat_idx)
-                indicator_history_dfs.append(indicators_df)
-
-        # We run metrics on the last strat since all the metrics will be the same for all strats
-        returns = strat.analyzers.returns.get_analysis()
-        sharpe = strat.analyzers.mysharpe.get_analysis()
-        drawdown = strat.analyzers.drawdown.get_analysis()
-        timedraw = strat.analyzers.timedraw.get_analysis()
-        tradeanalyzer = strat.analyzers.tradeanalyzer.get_analysis()
-
-        # Combine dicts for returns and sharpe
-        m = {
-            **returns,
-            **drawdown,
-            **timedraw,
-            **sharpe,
-            "pnl": strat.pnl,
-            "final_value": strat.final_value,
-        }
-
-        if "total" in tradeanalyzer.keys():
-            total = tradeanalyzer["total"]["total"]
-        else:
-            total = np.nan
-
-        if "won" in tradeanalyzer.keys():
-            win_rate = tradeanalyzer["won"]["total"] / tradeanalyzer["total"]["total"]
-            won = tradeanalyzer["won"]["total"]
-            won_avg = tradeanalyzer["won"]["pnl"]["average"]
-            won_avg_prcnt = tradeanalyzer["won"]["pnl"]["average"] / init_cash * 100
-            won_max = tradeanalyzer["won"]["pnl"]["max"]
-            won_max_prcnt = tradeanalyzer["won"]["pnl"]["max"] / init_cash * 100
-        else:
-            win_rate = np.nan
-            won = np.nan
-            won_avg = np.nan
-            won_avg_prcnt = np.nan
-            won_max = np.nan
-            won_max_prcnt = np.nan
-
-        if "lost" in tradeanalyzer.keys():
-            lost = tradeanalyzer["lost"]["total"]
-            lost_avg = tradeanalyzer["lost"]["pnl"]["average"]
-            lost_avg_prcnt = tradeanalyzer["lost"]["pnl"]["average"] / init_cash * 100
-            lost_max = tradeanalyzer["lost"]["pnl"]["max"]
-            lost_max_prcnt = tradeanalyzer["lost"]["pnl"]["max"] / init_cash * 100
-        else:
-            lost = np.nan
-            lost_avg = np.nan
-            lost_avg_prcnt = np.nan
-            lost_max = np.nan
-            lost_max_prcnt = np.nan
-
-        m2 = {
-            "total": total,
-            "win_rate": win_rate,
-            "won": won,
-            "lost": lost,
-            "won_avg": won_avg,
-            "won_avg_prcnt": won_avg_prcnt,
-            "lost_avg": lost_avg,
-            "lost_avg_prcnt": lost_avg_prcnt,
-            "won_max": won_max,
-            "won_max_prcnt": won_max_prcnt,
-            "lost_max": lost_max,
-            "lost_max_prcnt": lost_max_prcnt,
-        }
-
-        m = {**m, **m2}
-
-        params.append(strats_params)
-        metrics.append(m)
-        if verbose > 0:
-            print("--------------------------------------------------")
-            print_dict(strats_params, "Strategy Parameters")
-            print_dict(returns, "Returns")
-            print_dict(sharpe, "Sharpe")
-            print_dict(drawdown, "Drawdown")
-            print_dict(timedraw, "Timedraw")
-
-    params_df = pd.DataFrame(params)
+        strat_name = strat_names[i]
+        p_raw = strat.p._getkwargs()
+        p, selected_p = {}, {}
+        for k, v in p_raw.items():
+            if k not in [
+                "strategy_logging",
+                "periodic_logging",
+                "transaction_logging",
+                "profile",
+                "record_history",
+                "trade_start",
+                "resume_state",
+            ]:
+                # Make sure the parameters are mapped to the corresponding strategy
+                if strategy == "multi":
+                    key = "{}.{}".format(strat_name, k) if k not in GLOBAL_PARAMS else k
+                    # make key with format: e.g. smac.slow_period40_fast_period10
+                    if k in strats[strat_name]:
+                        selected_p[k] = v
+                    pkeys = "_".join(["{}{}".format(*i) for i in selected_p.items()])
+                    history_key = "{}.{}".format(strat_name, pkeys)
+                else:
+                    key = k
+
+                    # make key with format: e.g. slow_period40_fast_period10
+                    if k in kwargs.keys():
+                        selected_p[k] = v
+                    history_key = "_".join(
+                        ["{}{}".format(*i) for i in selected_p.items()]
+                    )
+                p[key] = v
+
+        strats_params = {**strats_params, **p}
+
+        if return_history:
+            # columns are decided in log method of BaseStrategy class in base.py
+            order_history_df = strat.order_history_df
+            order_history_df["dt"] = pd.to_datetime(order_history_df.dt)
+            # combine rows with identical index
+            # history_df = order_history_df.set_index('dt').dropna(how='all')
+            # history_dfs[history_key] = order_history_df.stack().unstack().astype(float)
+            order_history_df.insert(0, "strat_name", history_key)
+            order_history_df.insert(0, "strat_id", strat_idx)
+            order_history_dfs.append(order_history_df)
+
+            periodic_history_df = strat.periodic_history_df
+            periodic_history_df["dt"] = pd.to_datetime(periodic_history_df.dt)
+            periodic_history_df.insert(0, "strat_name", history_key)
+            periodic_history_df.insert(0, "strat_id", strat_idx)
+            periodic_history_df["return"] = (
+                periodic_history_df.portfolio_value.pct_change()
+            )
+            if metrics is not None and "rolling_sharpe" in metrics:
+                periodic_history_df["rolling_sharpe"] = get_rolling_sharpe(
+                    periodic_history_df["return"].values
+                )
+            periodic_history_dfs.append(periodic_history_df)
+
+            indicators_df.insert(0, "strat_name", history_key)
+            indicators_df.insert(0, "strat_id", strat_idx)
+            indicator_history_dfs.append(indicators_df)
+
+        timings["history"] += time.perf_counter() - tstart
+        # Signal timings of strategies run with `profile=True`
+        for name, seconds in getattr(strat, "timings", {}).items():
+            timings[name] = timings.get(name, 0.0) + seconds
+
+    tstart = time.perf_counter()
+    # We run metrics on the last strat since all the metrics will be the same for all strats
+    m = get_strategy_metrics(strat, init_cash, metrics)
+    timings["metrics"] += time.perf_counter() - tstart
+
+    if verbose > 0:
+        print("--------------------------------------------------")
+        print_dict(strats_params, "Strategy Parameters")
+        print_dict(m, "Metrics")
+
+    return dict(
+        params=strats_params,
+        metrics=m,
+        orders=order_history_dfs,
+        periodic=periodic_history_dfs,
+        indicators=indicator_history_dfs,
+        timings=timings,
+    )
+
+
+def combine_run_results(run_results, sort_by, return_history, verbose):
+    """
+    Combines the outputs of `analyze_stratrun` (ordered by strat id) into the sorted metrics dataframe,
+    the optimal parameters, and the history dict
+    """
+    params_df = pd.DataFrame([r["params"] for r in run_results])
     # Set the index as a separate strat id column, so that we retain the information after sorting
     strat_ids = pd.DataFrame({"strat_id": params_df.index.values})
-    metrics_df = pd.DataFrame(metrics)
+    metrics_df = pd.DataFrame([r["metrics"] for r in run_results])
 
     # Find optimal parameters
     sorted_combined_df, optim_params = sort_metrics_params_and_strats(
@@ -204,9 +240,11 @@ def analyze_strategies(
 
     # History dict
     if return_history:
-        order_history = pd.concat(order_history_dfs)
-        periodic_history = pd.concat(periodic_history_dfs)
-        indicator_history = pd.concat(indicator_history_dfs)
+        order_history = pd.concat([df for r in run_results for df in r["orders"]])
+        periodic_history = pd.concat([df for r in run_results for df in r["periodic"]])
+        indicator_history = pd.concat(
+            [df for r in run_results for df in r["indicators"]]
+        )
         history_dict = dict(
             orders=order_history,
             periodic=periodic_history,
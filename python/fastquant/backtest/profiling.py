@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Timing breakdown of a `backtest` call, returned with `profile=True`
+- Each phase of `backtest` (data, setup, run, analysis, sorting, plotting) is timed in the main process
+- The analysis of each run and the signals of each strategy are timed where they run,
+  and sent back with the results of the run
+
+"""
+
+import contextlib
+import time
+
+import pandas as pd
+
+# Phases of `backtest`, in the order they run
+PHASES = ["data", "setup", "run", "metrics", "history", "sort", "plot"]
+
+# Parts of the run measured inside `BaseStrategy.next`
+STRATEGY_PHASES = ["signals", "orders"]
+
+
+class Profiler:
+    """
+    Accumulates the seconds spent in each phase of a backtest
+    """
+
+    def __init__(self):
+        self.timings = dict.fromkeys(PHASES + STRATEGY_PHASES, 0.0)
+        self.tstart = time.perf_counter()
+        self.phase_starts = {}
+
+    def start(self, name):
+        self.phase_starts[name] = time.perf_counter()
+
+    def stop(self, name):
+        self.timings[name] += time.perf_counter() - self.phase_starts.pop(name)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def add(self, timings):
+        """
+        Adds the timings measured by a run (e.g. the `timings` of an `analyze_stratrun` output)
+        """
+        for name, seconds in (timings or {}).items():
+            self.timings[name] += seconds
+
+    def report(self):
+        """
+        pandas.DataFrame of the seconds spent in each phase and their share of the total time of the call
+
+        `signals` and `orders` are the parts of `run` spent in `buy_signal`/`sell_signal` and in the
+        rest of `BaseStrategy.next`. With `n_jobs` other than 1, `metrics`, `history`, `signals` and `orders`
+        are summed across the worker processes and overlap with `run`
+        """
+        total = time.perf_counter() - self.tstart
+        report_df = pd.DataFrame(
+            {"seconds": pd.Series(self.timings, dtype=float)},
+        )
+        report_df.loc["total", "seconds"] = total
+        report_df["share"] = report_df.seconds / total if total > 0 else 0.0
+        report_df.index.name = "phase"
+        return report_df
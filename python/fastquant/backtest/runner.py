@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Execution of strategy runs outside of a single `cerebro.run()` call
+- Creation of a preconfigured Cerebro
+- Running a list of parameter combinations one at a time, or over a process pool
+
+"""
+
+import contextlib
+import gc
+import math
+import multiprocessing
+import os
+
+import backtrader as bt
+import backtrader.analyzers as btanalyzers
+
+from fastquant.backtest.data_prep import initalize_data
+from fastquant.backtest.post_backtest import analyze_stratrun
+
+# Backtrader analyzers that can be attached by `build_cerebro`, by their name in `strat.analyzers`
+ANALYZERS = {
+    # Total, Average, Compound and Annualized Returns calculated using a logarithmic approach
+    "returns": btanalyzers.Returns,
+    "mysharpe": btanalyzers.SharpeRatio,
+    "drawdown": btanalyzers.DrawDown,
+    "timedraw": btanalyzers.TimeDrawDown,
+    "tradeanalyzer": btanalyzers.TradeAnalyzer,
+}
+
+# State of each worker process, set once by `_init_worker`
+_WORKER = {}
+
+
+def build_cerebro(init_cash, commission, analyzers=(), observers=True, exactbars=False):
+    """
+    Creates a Cerebro with the observers, analyzers and broker settings used by `backtest`
+
+    The metrics of `backtest` are computed after each run (see `analyze_stratrun`), so `analyzers` are
+    only the names of the `ANALYZERS` to also attach, and the observers are only needed to plot the run.
+    Both are updated at every bar of every run. `exactbars=1` bounds the bars kept by the lines,
+    and reads the data while running instead of preloading it (see `StreamData`)
+    """
+    # Return the full strategy object to get all run information
+    cerebro = bt.Cerebro(
+        stdstats=False, maxcpus=1, optreturn=False, exactbars=exactbars
+    )
+    if observers:
+        cerebro.addobserver(bt.observers.Broker)
+        cerebro.addobserver(bt.observers.Trades)
+        cerebro.addobserver(bt.observers.BuySell)
+
+    for name in analyzers:
+        cerebro.addanalyzer(ANALYZERS[name], _name=name)
+
+    cerebro.broker.setcommission(commission=commission)
+    cerebro.broker.setcash(init_cash)
+    # Allows us to set buy price based on next day closing
+    # (technically impossible, but reasonable assuming you use all your money to buy market at the end of the next day)
+    cerebro.broker.set_coc(True)
+    return cerebro
+
+
+def get_n_jobs(n_jobs):
+    """
+    Converts `n_jobs` into a number of processes, where None or a negative value means all available cores
+    """
+    if n_jobs is None or n_jobs < 0:
+        return os.cpu_count() or 1
+    return max(int(n_jobs), 1)
+
+
+def run_stratrun(iterstrat, feed, cerebro_kwargs):
+    """
+    Runs a single parameter combination (a tuple of `(strategy class, args, kwargs)`) on an initialized feed
+    """
+    cerebro = build_cerebro(**cerebro_kwargs)
+    cerebro.adddata(feed)
+    for stratcls, sargs, skwargs in iterstrat:
+        cerebro.addstrategy(stratcls, *sargs, **skwargs)
+    return cerebro.run()
+
+
+@contextlib.contextmanager
+def frozen_gc():
+    """
+    Keeps the objects created before the runs out of the garbage collections made while the context is open,
+    so that the collection after each run only visits the objects of the runs instead of every live object
+    """
+    if gc.get_freeze_count():
+        # Already frozen by the caller
+        yield
+        return
+    gc.freeze()
+    try:
+        yield
+    finally:
+        gc.unfreeze()
+
+
+def run_analyzed(
+    iterstrats,
+    strat_idxs,
+    feed,
+    cerebro_kwargs,
+    analyze_kwargs,
+    callback=None,
+    run_strat_names=None,
+):
+    """
+    Runs and analyzes the parameter combinations `strat_idxs` of `iterstrats` one at a time
+
+    Only the output of `analyze_stratrun` is kept, so each strategy can be freed once analyzed.
+    `callback(strat_idx, result)` is called as soon as each run is analyzed.
+    `run_strat_names` are the names of the strategies of each combination, when they differ across
+    combinations (default: the `strat_names` of `analyze_kwargs`)
+    """
+    results = []
+    with frozen_gc():
+        for strat_idx in strat_idxs:
+            stratrun = run_stratrun(iterstrats[strat_idx], feed, cerebro_kwargs)
+            if run_strat_names is not None:
+                analyze_kwargs = dict(
+                    analyze_kwargs, strat_names=run_strat_names[strat_idx]
+                )
+            result = analyze_stratrun(
+                stratrun=stratrun, strat_idx=strat_idx, **analyze_kwargs
+            )
+            results.append(result)
+            if callback is not None:
+                callback(strat_idx, result)
+            # Strategies reference their Cerebro, lines and analyzers in cycles,
+            # which are only freed by the garbage collector
+            del stratrun
+            gc.collect()
+    return results
+
+
+def _init_worker(
+    iterstrats, data, data_kwargs, cerebro_kwargs, analyze_kwargs, run_strat_names
+):
+    # The feed is built once per worker and reused by every run assigned to it
+    feed, _, _ = initalize_data(data, **data_kwargs)
+    _WORKER.update(
+        iterstrats=iterstrats,
+        feed=feed,
+        cerebro_kwargs=cerebro_kwargs,
+        analyze_kwargs=analyze_kwargs,
+        run_strat_names=run_strat_names,
+    )
+
+
+def _run_chunk(strat_idxs):
+    return run_analyzed(
+        _WORKER["iterstrats"],
+        strat_idxs,
+        _WORKER["feed"],
+        _WORKER["cerebro_kwargs"],
+        _WORKER["analyze_kwargs"],
+        run_strat_names=_WORKER["run_strat_names"],
+    )
+
+
+def run_parallel(
+    iterstrats,
+    data,
+    n_jobs,
+    data_kwargs,
+    cerebro_kwargs,
+    analyze_kwargs,
+    strat_idxs=None,
+    callback=None,
+    run_strat_names=None,
+):
+    """
+    Runs each parameter combination in `iterstrats` over a pool of `n_jobs` processes
+
+    Parameters
+    ----------
+    iterstrats : list
+        list of parameter combinations, each a tuple of `(strategy class, args, kwargs)` (same as `cerebro.strats`)
+    data : pandas.DataFrame or fastquant.store.StoreSelection
+        dataframe already processed by `initalize_data`, or a selection of a store that each worker reads
+        from its memory map instead of receiving a copy of the data
+    n_jobs : int
+        number of worker processes (None or -1 uses all the available cores)
+    data_kwargs : dict
+        keyword arguments of `initalize_data` used to build the feed in each worker
+    cerebro_kwargs : dict
+        keyword arguments of `build_cerebro`
+    analyze_kwargs : dict
+        keyword arguments of `analyze_stratrun`
+    strat_idxs : list
+        strat ids of the combinations to run (default: all of them)
+    callback : function
+        called with `(strat_idx, result)` in the main process as soon as each chunk of runs is received
+    run_strat_names : list
+        names of the strategies of each combination (default: the `strat_names` of `analyze_kwargs`)
+
+    Returns
+    -------
+    list of the outputs of `analyze_stratrun`, ordered by strat id
+    """
+    if strat_idxs is None:
+        strat_idxs = range(len(iterstrats))
+    strat_idxs = list(strat_idxs)
+    n_jobs = min(get_n_jobs(n_jobs), len(strat_idxs))
+    # Several chunks per worker keeps the load balanced when run times differ across parameters
+    chunksize = max(math.ceil(len(strat_idxs) / (n_jobs * 4)), 1)
+    chunks = [
+        strat_idxs[i : i + chunksize] for i in range(0, len(strat_idxs), chunksize)
+    ]
+
+    pool = multiprocessing.Pool(
+        n_jobs,
+        initializer=_init_worker,
+        initargs=(
+            iterstrats,
+            data,
+            data_kwargs,
+            cerebro_kwargs,
+            analyze_kwargs,
+            run_strat_names,
+        ),
+    )
+    results = []
+    try:
+        for chunk, chunk_results in zip(chunks, pool.imap(_run_chunk, chunks)):
+            results.extend(chunk_results)
+            if callback is not None:
+                for strat_idx, result in zip(chunk, chunk_results):
+                    callback(strat_idx, result)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
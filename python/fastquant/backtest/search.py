@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Search spaces and samplers of parameter combinations
+- Parsing of a search space into dimensions, each mapped from the unit interval
+- Random, Tree-structured Parzen Estimator (TPE) and Gaussian process (GP) samplers
+- Random and Latin hypercube sampling of the product of parameter values
+
+A sampler proposes parameters with `ask()` and is given the objective value of each proposal
+with `tell(params, value)`, where higher values are better
+"""
+
+import numbers
+import random
+
+import numpy as np
+from scipy.stats import norm
+
+
+class Dimension:
+    """
+    A searched parameter, mapped from a unit interval position `u` in [0, 1]
+
+    Parameters
+    ----------
+    name : str
+        name of the parameter
+    low, high : int or float
+        bounds of a numeric range (integers if both bounds are integers)
+    log : bool
+        whether the range is searched on a log scale
+    choices : list
+        values of a categorical parameter, in the place of `low` and `high`
+    """
+
+    def __init__(self, name, low=None, high=None, log=False, choices=None):
+        self.name = name
+        self.choices = list(choices) if choices is not None else None
+        if self.choices is None:
+            if low > high:
+                raise ValueError(
+                    "{}: the lower bound is above the upper bound".format(name)
+                )
+            if log and low <= 0:
+                raise ValueError("{}: log scale needs positive bounds".format(name))
+        self.low = low
+        self.high = high
+        self.log = log
+        self.is_int = (
+            self.choices is None
+            and isinstance(low, numbers.Integral)
+            and isinstance(high, numbers.Integral)
+        )
+
+    def from_unit(self, u):
+        if self.choices is not None:
+            return self.choices[min(int(u * len(self.choices)), len(self.choices) - 1)]
+
+        low, high = self.low, self.high
+        if self.is_int:
+            # Each integer covers the same width of the unit interval
+            low, high = low - 0.5, high + 0.5
+        if self.log:
+            value = np.exp(np.log(low) + u * (np.log(high) - np.log(low)))
+        else:
+            value = low + u * (high - low)
+
+        if self.is_int:
+            return int(min(max(round(value), self.low), self.high))
+        return float(value)
+
+
+def get_dimensions(space):
+    """
+    Parses a search space into its dimensions and its fixed parameters
+
+    Each value of `space` is either
+    - a tuple `(low, high)` of a numeric range, or `(low, high, "log")` for a log scale range
+    - a list or range of the values to choose from
+    - any other value, which is passed as is to every trial
+    """
+    dimensions = []
+    fixed = dict()
+    for name, spec in space.items():
+        if (
+            isinstance(spec, tuple)
+            and len(spec) in [2, 3]
+            and all(isinstance(x, numbers.Number) for x in spec[:2])
+        ):
+            if len(spec) == 3 and spec[2] != "log":
+                raise ValueError(
+                    "{}: the third element of a range can only be 'log'".format(name)
+                )
+            dimensions.append(Dimension(name, spec[0], spec[1], log=len(spec) == 3))
+        elif isinstance(spec, (list, range)):
+            dimensions.append(Dimension(name, choices=spec))
+        else:
+            fixed[name] = spec
+    return dimensions, fixed
+
+
+def sample_product(values, n_samples, method="random", seed=None):
+    """
+    Draws at most `n_samples` distinct combinations from the product of `values`, without expanding it
+
+    Parameters
+    ----------
+    values : dict
+        values of each parameter, as lists or ranges
+    n_samples : int
+        number of combinations to draw (all of them if the product is smaller)
+    method : str
+        "random" to draw combinations uniformly without replacement, or "lhs" for a Latin hypercube,
+        where the values of each parameter are covered evenly (duplicate combinations are dropped)
+    seed : int
+        seed of the draw
+
+    Returns
+    -------
+    list of dicts of parameters, in the order of the product
+    """
+    names = list(values.keys())
+    seqs = [v if isinstance(v, range) else list(v) for v in values.values()]
+    sizes = [len(seq) for seq in seqs]
+    total = int(np.prod(sizes, dtype=object))
+
+    if method == "random":
+        # Sampling the indices of the product never builds the product itself
+        idxs = random.Random(seed).sample(range(total), min(n_samples, total))
+        positions = []
+        for idx in idxs:
+            position = []
+            for size in sizes[::-1]:
+                idx, pos = divmod(idx, size)
+                position.append(pos)
+            positions.append(tuple(position[::-1]))
+    elif method == "lhs":
+        rng = np.random.RandomState(seed)
+        units = np.column_stack(
+            [
+                (rng.permutation(n_samples) + rng.uniform(size=n_samples)) / n_samples
+                for _ in sizes
+            ]
+        )
+        positions = [
+            tuple(min(int(u * size), size - 1) for u, size in zip(row, sizes))
+            for row in units
+        ]
+    else:
+        raise ValueError("method should be 'random' or 'lhs'")
+
+    return [
+        {name: seq[pos] for name, seq, pos in zip(names, seqs, position)}
+        for position in sorted(set(positions))
+    ]
+
+
+class RandomSampler:
+    """
+    Draws every parameter uniformly (or log-uniformly) at random
+    """
+
+    def __init__(self, dimensions, seed=None):
+        self.dimensions = dimensions
+        self.rng = np.random.RandomState(seed)
+        self.units = []
+        self.values = []
+        self._asked = dict()
+
+    def ask(self):
+        u = self.ask_unit()
+        params = {d.name: d.from_unit(x) for d, x in zip(self.dimensions, u)}
+        self._asked[self._params_key(params)] = u
+        return params
+
+    def tell(self, params, value):
+        u = self._asked.pop(self._params_key(params))
+        # Failed or undefined objectives rank below every other trial
+        value = float(value) if value is not None else np.nan
+        self.units.append(u)
+        self.values.append(value if np.isfinite(value) else -np.inf)
+
+    def ask_unit(self):
+        return self.rng.uniform(size=len(self.dimensions))
+
+    def _params_key(self, params):
+        return tuple(repr(params[d.name]) for d in self.dimensions)
+
+
+class TPESampler(RandomSampler):
+    """
+    Tree-structured Parzen Estimator
+
+    After `n_startup_trials` random trials, the trials are split into the best `gamma` share and
+    the rest. Candidates are drawn from a kernel density of the best trials, and the one with
+    the highest ratio of its density among the best trials to its density among the rest is picked.
+    """
+
+    def __init__(
+        self, dimensions, seed=None, n_startup_trials=10, n_candidates=24, gamma=0.25
+    ):
+        super().__init__(dimensions, seed)
+        self.n_startup_trials = n_startup_trials
+        self.n_candidates = n_candidates
+        self.gamma = gamma
+
+    def ask_unit(self):
+        if len(self.values) < self.n_startup_trials:
+            return super().ask_unit()
+
+        units = np.array(self.units)
+        order = np.argsort(self.values)[::-1]
+        n_good = max(1, int(np.ceil(self.gamma * len(order))))
+        good, bad = units[order[:n_good]], units[order[n_good:]]
+
+        candidates = np.empty((self.n_candidates, len(self.dimensions)))
+        score = np.zeros(self.n_candidates)
+        for j in range(len(self.dimensions)):
+            good_mus, good_sigmas = self._parzen(good[:, j])
+            bad_mus, bad_sigmas = self._parzen(bad[:, j])
+            candidates[:, j] = self._sample(good_mus, good_sigmas)
+            score += np.log(self._density(candidates[:, j], good_mus, good_sigmas))
+            score -= np.log(self._density(candidates[:, j], bad_mus, bad_sigmas))
+        return candidates[np.argmax(score)]
+
+    def _parzen(self, x):
+        # One kernel per observation, plus a wide prior kernel at the middle of the interval
+        mus = np.append(x, 0.5)
+        # The bandwidth of each kernel is the distance to its farthest neighbor
+        order = np.argsort(x)
+        edges = np.concatenate([[0.0], x[order], [1.0]])
+        bandwidths = np.maximum(edges[1:-1] - edges[:-2], edges[2:] - edges[1:-1])
+        sigmas = np.empty(len(x))
+        sigmas[order] = np.clip(bandwidths, 1.0 / min(100, len(x) + 1), 1.0)
+        return mus, np.append(sigmas, 1.0)
+
+    def _sample(self, mus, sigmas):
+        idxs = self.rng.randint(len(mus), size=self.n_candidates)
+        samples = self.rng.normal(mus[idxs], sigmas[idxs])
+        # Resample the kernels truncated to the unit interval
+        outside = (samples < 0) | (samples > 1)
+        while outside.any():
+            samples[outside] = self.rng.normal(
+                mus[idxs][outside], sigmas[idxs][outside]
+            )
+            outside = (samples < 0) | (samples > 1)
+        return samples
+
+    def _density(self, x, mus, sigmas):
+        mass = norm.cdf((1 - mus) / sigmas) - norm.cdf(-mus / sigmas)
+        pdfs = norm.pdf((x[:, None] - mus) / sigmas) / (sigmas * mass)
+        return pdfs.mean(axis=1) + 1e-12
+
+
+class GPSampler(RandomSampler):
+    """
+    Gaussian process regression of the objective with a Matern 5/2 kernel
+
+    After `n_startup_trials` random trials, the candidate with the highest expected improvement
+    is picked among random points and perturbations of the best trial.
+    """
+
+    length_scales = [0.05, 0.1, 0.2, 0.4, 0.8, 1.6]
+
+    def __init__(
+        self, dimensions, seed=None, n_startup_trials=10, n_candidates=2000, noise=1e-4
+    ):
+        super().__init__(dimensions, seed)
+        self.n_startup_trials = n_startup_trials
+        self.n_candidates = n_candidates
+        self.noise = noise
+
+    def ask_unit(self):
+        if len(self.values) < self.n_startup_trials:
+            return super().ask_unit()
+
+        units = np.array(self.units)
+        values = np.array(self.values)
+        finite = np.isfinite(values)
+        if not finite.any():
+            return super().ask_unit()
+        spread = values[finite].std() or 1.0
+        values = np.where(finite, values, values[finite].min() - spread)
+        y = (values - values.mean()) / (values.std() or 1.0)
+
+        # Length scale maximizing the marginal likelihood
+        fits = [self._fit(units, y, scale) for scale in self.length_scales]
+        scale, chol, alpha, _ = max(fits, key=lambda fit: fit[3])
+
+        best = units[np.argmax(y)]
+        n_local = self.n_candidates // 10
+        candidates = np.vstack(
+            [
+                self.rng.uniform(size=(self.n_candidates - n_local, units.shape[1])),
+                np.clip(
+                    best + self.rng.normal(0, 0.05, size=(n_local, units.shape[1])),
+                    0,
+                    1,
+                ),
+            ]
+        )
+        k = self._kernel(candidates, units, scale)
+        mu = k @ alpha
+        v = np.linalg.solve(chol, k.T)
+        sigma = np.sqrt(np.maximum(1.0 - (v * v).sum(axis=0), 1e-12))
+
+        # Expected improvement over the best trial
+        z = (mu - y.max()) / sigma
+        ei = (mu - y.max()) * norm.cdf(z) + sigma * norm.pdf(z)
+        return candidates[np.argmax(ei)]
+
+    def _kernel(self, a, b, scale):
+        d = np.sqrt(((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2)) / scale
+        return (1 + np.sqrt(5) * d + 5.0 / 3.0 * d**2) * np.exp(-np.sqrt(5) * d)
+
+    def _fit(self, x, y, scale):
+        k = self._kernel(x, x, scale) + self.noise * np.eye(len(x))
+        chol = np.linalg.cholesky(k)
+        alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, y))
+        log_likelihood = -0.5 * y @ alpha - np.log(np.diag(chol)).sum()
+        return scale, chol, alpha, log_likelihood
+
+
+# Register the samplers available by name here
+SAMPLER_MAPPING = {
+    "random": RandomSampler,
+    "tpe": TPESampler,
+    "gp": GPSampler,
+}
@@ -0,0 +1,678 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vectorized backtesting engine for the built-in signal strategies
+- Buy and sell signals are computed as whole arrays instead of bar by bar
+- The broker is only stepped on the bars with a signal, following the order logic of `BaseStrategy.next`,
+  and jumps over the bars of held signals (e.g. ternary or custom columns) where no order can be placed,
+  since the cash and position in between are set by the orders
+- Metrics are derived from the resulting portfolio value curve
+
+Used by `backtest` when `engine="vectorized"`
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from fastquant.backtest.backtest_indicators import rename_indicator
+from fastquant.backtest.metrics import get_rolling_sharpe, get_run_metrics
+from fastquant.backtest.post_backtest import print_dict
+from fastquant.config import SELL_PROP
+from fastquant.indicators.numpy_indicators import (
+    bollinger,
+    crossover,
+    ema,
+    macd,
+    rsi,
+    shift,
+    sma,
+)
+from fastquant.strategies.expression import ExpressionCompiler
+from fastquant.strategies import (
+    BaseStrategy,
+    BBandsStrategy,
+    BuyAndHoldStrategy,
+    CustomStrategy,
+    EMACStrategy,
+    ExpressionStrategy,
+    MACDStrategy,
+    RSIStrategy,
+    SMACStrategy,
+    TernaryStrategy,
+)
+
+LOGGING_PARAMS = [
+    "strategy_logging",
+    "periodic_logging",
+    "transaction_logging",
+    "profile",
+    "record_history",
+]
+
+# Parameters set for a run by the backtest functions, which aren't reported like the logging flags
+RUN_PARAMS = ["trade_start", "resume_state"]
+
+# Parameters that rely on intrabar or calendar logic only available in the backtrader engine
+UNSUPPORTED_PARAMS = [
+    "stop_loss",
+    "stop_trail",
+    "take_profit",
+    "add_cash_amount",
+    "trade_start",
+]
+
+
+def _cached(cache, key, func, *args):
+    # Indicators are shared by all the combinations of a sweep that use the same parameters
+    if key not in cache:
+        cache[key] = func(*args)
+    return cache[key]
+
+
+def _label(name, *params):
+    # Same column name as the indicator history of the backtrader engine
+    return rename_indicator("{}({})".format(name, ",".join(str(x) for x in params)))
+
+
+def _crossover_signals(name, fast, slow, p):
+    cross = crossover(fast, slow)
+    minperiod = max(p["fast_period"], p["slow_period"]) + 1
+    indicators = {
+        _label(name, p["fast_period"]): fast,
+        _label(name, p["slow_period"]): slow,
+        "CrossOver": cross,
+    }
+    return cross > 0, cross < 0, minperiod, indicators
+
+
+def smac_signals(data, p, cache):
+    close = data["close"]
+    fast = _cached(cache, ("sma", p["fast_period"]), sma, close, p["fast_period"])
+    slow = _cached(cache, ("sma", p["slow_period"]), sma, close, p["slow_period"])
+    return _crossover_signals("SMA", fast, slow, p)
+
+
+def emac_signals(data, p, cache):
+    close = data["close"]
+    fast = _cached(cache, ("ema", p["fast_period"]), ema, close, p["fast_period"])
+    slow = _cached(cache, ("ema", p["slow_period"]), ema, close, p["slow_period"])
+    return _crossover_signals("EMA", fast, slow, p)
+
+
+def rsi_signals(data, p, cache):
+    rsi_line = _cached(
+        cache, ("rsi", p["rsi_period"]), rsi, data["close"], p["rsi_period"]
+    )
+    buy = rsi_line < p["rsi_lower"]
+    sell = rsi_line > p["rsi_upper"]
+    indicators = {_label("RelativeStrengthIndex", p["rsi_period"]): rsi_line}
+    return buy, sell, p["rsi_period"] + 1, indicators
+
+
+def bbands_signals(data, p, cache):
+    close = data["close"]
+    mid, top, bot = _cached(
+        cache,
+        ("bollinger", p["period"], p["devfactor"]),
+        bollinger,
+        close,
+        p["period"],
+        p["devfactor"],
+    )
+    indicators = {
+        rename_indicator("BBands({},{})".format(p["period"], p["devfactor"]), line): x
+        for line, x in [("mid", mid), ("top", top), ("bot", bot)]
+    }
+    return close < bot, close > top, p["period"], indicators
+
+
+def macd_signals(data, p, cache):
+    close = data["close"]
+    macd_params = (p["fast_period"], p["slow_period"], p["signal_period"])
+    macd_line, signal = _cached(
+        cache, ("macd",) + macd_params, macd, close, *macd_params
+    )
+    cross = crossover(macd_line, signal)
+
+    # Control market trend
+    sma_line = _cached(cache, ("sma", p["sma_period"]), sma, close, p["sma_period"])
+    sma_delayed = shift(sma_line, p["dir_period"])
+    smadir = sma_line - sma_delayed
+    buy = (cross > 0) & (smadir < 0.0)
+    sell = (cross < 0) & (smadir > 0.0)
+    minperiod = max(
+        max(p["fast_period"], p["slow_period"]) + p["signal_period"],
+        p["sma_period"] + p["dir_period"],
+    )
+    indicators = {
+        rename_indicator("MACD{}".format(macd_params), "macd"): macd_line,
+        rename_indicator("MACD{}".format(macd_params), "signal"): signal,
+        "CrossOver": cross,
+        _label("SMA", p["sma_period"]): sma_line,
+        # Line operations have no plot label
+        "indicator3": sma_delayed,
+        "indicator4": smadir,
+    }
+    return buy, sell, minperiod, indicators
+
+
+def custom_signals(data, p, cache):
+    custom = data[p["custom_column"]]
+    indicators = dict(CustomIndicator=custom)
+    return custom < p["lower_limit"], custom > p["upper_limit"], 1, indicators
+
+
+def ternary_signals(data, p, cache):
+    custom = np.trunc(data[p["custom_column"]])
+    buy = custom == p["buy_int"]
+    sell = custom == p["sell_int"]
+    return buy, sell, 1, dict(CustomIndicator=data[p["custom_column"]])
+
+
+def expression_signals(data, p, cache):
+    variables = {
+        k: v for k, v in p.items() if k not in ExpressionStrategy.params._getkeys()
+    }
+    compiler = ExpressionCompiler(data, variables, cache)
+    buy, buy_minperiod = compiler.compile(p["buy"])
+    sell, sell_minperiod = compiler.compile(p["sell"])
+    minperiod = max(buy_minperiod, sell_minperiod)
+    # Same lines as the `ExpressionSignals` indicator, which are NaN until its minimum period
+    warmup = np.arange(len(buy)) < minperiod - 1
+    indicators = dict(
+        ExpressionSignals_buy=np.where(warmup, np.nan, buy),
+        ExpressionSignals_sell=np.where(warmup, np.nan, sell),
+    )
+    return buy, sell, minperiod, indicators
+
+
+def buy_and_hold_signals(data, p, cache):
+    n = len(data["close"])
+    # The buy signal stays on, so it takes precedence over the sell signal on the second to the last bar
+    sell = np.arange(n) == n - 2
+    return np.ones(n, dtype=bool), sell, 1, dict()
+
+
+def base_signals(data, p, cache):
+    n = len(data["close"])
+    return np.zeros(n, dtype=bool), np.zeros(n, dtype=bool), 1, dict()
+
+
+# Register the vectorized signals of a strategy here
+SIGNAL_MAPPING = {
+    SMACStrategy: smac_signals,
+    EMACStrategy: emac_signals,
+    RSIStrategy: rsi_signals,
+    BBandsStrategy: bbands_signals,
+    MACDStrategy: macd_signals,
+    CustomStrategy: custom_signals,
+    TernaryStrategy: ternary_signals,
+    ExpressionStrategy: expression_signals,
+    BuyAndHoldStrategy: buy_and_hold_signals,
+    BaseStrategy: base_signals,
+}
+
+
+class _Account:
+    """
+    Broker state of a vectorized run (long or short positions of a single asset, with close-on-close fills)
+    """
+
+    def __init__(self, n, commission, cash):
+        self.commission = commission
+        self.sizes = np.zeros(n)
+        # Updated with the same operations as the cash of the broker, since the fills
+        # that take all of it are decided by its rounding
+        self.cash = cash
+        self.fill_bars = []
+        self.fill_cash = []
+        self.position = 0
+        self.pprice = 0.0
+        self.orders = []
+        self.trade_pnls = []
+        self.n_trades = 0
+        self._trade_pnl = 0.0
+        self._trade_comm = 0.0
+        # Average price of the trade, which backtrader rounds apart from the one of the position
+        self._trade_price = 0.0
+
+    def split(self, size):
+        """Part of an order of `size` that reduces the position and part that opens a new one"""
+        oldsize = self.position
+        closed = 0
+        if oldsize and (size > 0) != (oldsize > 0):
+            closed = size if abs(size) <= abs(oldsize) else -oldsize
+        return size - closed, closed
+
+    def check(self, size, price):
+        """
+        Cash left after an order of `size` at `price`, computed like the broker
+        does before accepting it (a negative value is a margin rejection)
+        """
+        opened, closed = self.split(size)
+        cash = self.cash
+        if closed:
+            cash += -closed * price
+            cash -= abs(closed) * self.commission * price
+        if opened:
+            cash -= opened * price
+            cash -= abs(opened) * self.commission * price
+        return cash
+
+    def execute(self, bar, size, price):
+        """Fills an order of `size` (negative for sells) at `price` on `bar`"""
+        opened, closed = self.split(size)
+        comm = 0.0
+        pnl = 0.0
+        # Positive for long positions and negative for short ones, as in backtrader
+        value = 0.0
+        if closed:
+            closed_comm = abs(closed) * self.commission * price
+            pnl = -closed * (price - self.pprice)
+            value -= closed * self.pprice
+            comm += closed_comm
+            self.cash += -closed * self.pprice + pnl
+            self.cash -= closed_comm
+            self._trade_pnl += -closed * (price - self._trade_price)
+            self._trade_comm += closed_comm
+            self.position += closed
+            if not self.position:
+                self.trade_pnls.append(self._trade_pnl - self._trade_comm)
+                self._trade_pnl = self._trade_comm = 0.0
+        if opened:
+            opened_comm = abs(opened) * self.commission * price
+            cash = self.cash - opened * price
+            cash -= opened_comm
+            if cash < 0:
+                # The broker only closes the position when the cash left by its own rounding
+                # doesn't afford the rest, and the order isn't completed
+                self.record(bar, closed)
+                return
+            if not self.position:
+                self.n_trades += 1
+                self.pprice = price
+                self._trade_price = opened * price / opened
+            else:
+                self.pprice = (self.position * self.pprice + opened * price) / (
+                    self.position + opened
+                )
+                self._trade_price = (
+                    self.position * self._trade_price + opened * price
+                ) / (self.position + opened)
+            value += opened * price
+            comm += opened_comm
+            self.cash = cash
+            self._trade_comm += opened_comm
+            self.position += opened
+
+        self.record(bar, size)
+        self.orders.append((bar, size, price, value, comm, pnl))
+
+    def record(self, bar, size):
+        """Keeps the position size and cash after a fill on `bar`"""
+        self.sizes[bar] += size
+        self.fill_bars.append(bar)
+        self.fill_cash.append(self.cash)
+
+
+def can_buy(cash, close, p):
+    """Whether the cash affords a buy at the close (arrays or numbers)"""
+    return cash >= 10 if p["fractional"] else cash >= close
+
+
+def get_run_ends(signal_bars, buy, sell):
+    """
+    Index in `signal_bars` of the last bar of the run of each of them,
+    where a run is a stretch of consecutive bars holding the same buy and sell signals
+    """
+    flags = buy[signal_bars].astype(int) + 2 * sell[signal_bars]
+    new_run = np.ones(len(signal_bars), dtype=bool)
+    new_run[1:] = (np.diff(signal_bars) != 1) | (np.diff(flags) != 0)
+    run_starts = np.flatnonzero(new_run)
+    run_lengths = np.diff(np.append(run_starts, len(signal_bars)))
+    return np.repeat(run_starts + run_lengths - 1, run_lengths)
+
+
+def simulate(data, buy, sell, minperiod, p):
+    """
+    Runs the order logic of `BaseStrategy.next` on the bars with a buy or sell signal
+
+    Held signals (e.g. the ternary or custom column of a model) only place an order on a few of their bars,
+    so after a bar without an order, the rest of its run is skipped up to the first bar where the state
+    that blocked the order changes. The cash and position in between follow from the orders
+
+    Returns the account, and the cash and position size at every bar (after fills and dividends)
+    """
+    close = data["close"]
+    open_ = data["open"]
+    n = len(close)
+    start = minperiod - 1
+    # Cash added by the strategy is only credited by the broker on the next bar,
+    # so the dividend of the first bar is never invested
+    dividend = np.zeros(n)
+    if p["invest_div"]:
+        dividend[start + 1 :] = data["dividend"][start + 1 :]
+    cum_dividend = np.cumsum(dividend)
+
+    dividend_bars = np.flatnonzero(dividend).tolist()
+    n_dividends = 0
+
+    account = _Account(n, p["commission"], p["init_cash"])
+    strategy_position = -1 if p["single_position"] is not None else None
+
+    def fill(t, size):
+        # Orders filled at the close of the signal bar that leave the cash negative
+        # are rejected by the broker (margin)
+        if account.check(size, close[t]) < 0:
+            return
+        account.execute(t + 1, size, close[t])
+
+    # The last bar is skipped since orders are filled on the next bar
+    signal_bars = np.flatnonzero((buy | sell)[start : n - 1]) + start
+    run_ends = get_run_ends(signal_bars, buy, sell).tolist()
+    bars = signal_bars.tolist()
+    idx = 0
+    while idx < len(bars):
+        t = bars[idx]
+        while n_dividends < len(dividend_bars) and dividend_bars[n_dividends] <= t:
+            account.cash += dividend[dividend_bars[n_dividends]]
+            n_dividends += 1
+        cash = account.cash
+        position = account.position
+        stock_value = position * close[t]
+        n_orders = len(account.orders)
+        last_strategy_position = strategy_position
+
+        if buy[t] and strategy_position in [0, -1, None]:
+            branch = "buy"
+            strategy_position = 1 if strategy_position in [0, -1] else None
+            affordable = can_buy(cash, close[t], p)
+            if affordable:
+                position_size = abs(position)
+                if p["execution_type"] == "close":
+                    afforded_size = cash / (
+                        (close[t] * (1 + p["slippage"])) * (1 + p["commission"])
+                    )
+                    buy_prop_size = position_size + (
+                        (afforded_size - position_size) * p["buy_prop"]
+                    )
+                    final_size = min(buy_prop_size, afforded_size)
+                    if not p["fractional"]:
+                        final_size = int(final_size)
+                else:
+                    afforded_size = int(
+                        cash / (open_[t + 1] * (1 + p["commission"] + 0.001))
+                    )
+                    buy_prop_size = position_size + (
+                        (afforded_size - position_size) * p["buy_prop"]
+                    )
+                    final_size = min(buy_prop_size, afforded_size)
+                if final_size:
+                    fill(t, abs(final_size))
+
+        elif sell[t] and strategy_position in [1, -1, None]:
+            branch = "sell"
+            strategy_position = 0 if strategy_position in [1, -1] else None
+            if p["allow_short"]:
+                price = close[t + 1] if p["execution_type"] == "close" else open_[t + 1]
+                value = cash + stock_value
+                size = max(
+                    int(value * p["short_max"] * p["sell_prop"] / price) + position, 0
+                )
+                if size > 0:
+                    fill(t, -size)
+            elif stock_value > 0:
+                if p["execution_type"] == "close":
+                    if SELL_PROP == 1:
+                        size = position
+                    else:
+                        size = int((stock_value / close[t + 1]) * p["sell_prop"])
+                else:
+                    size = int((p["init_cash"] / open_[t + 1]) * p["sell_prop"])
+                if size:
+                    fill(t, -abs(size))
+
+        # The exit signals default to the opposite signal
+        elif sell[t]:
+            branch = "exit"
+            if position > 0:
+                strategy_position = None if strategy_position is None else -1
+                fill(t, -position)
+
+        elif buy[t]:
+            branch = "exit"
+            if position < 0:
+                strategy_position = None if strategy_position is None else -1
+                fill(t, -position)
+
+        # Without an order or a new strategy position, the next bars of the run
+        # only place one once the state that blocked this one changes
+        if (
+            idx < run_ends[idx]
+            and len(account.orders) == n_orders
+            and strategy_position == last_strategy_position
+        ):
+            if branch == "exit" or (
+                branch == "sell" and not p["allow_short"] and not position
+            ):
+                # The position only changes with an order
+                idx = run_ends[idx]
+            elif branch == "buy" and not affordable and run_ends[idx] - idx > 8:
+                # Only the dividends add cash until the next order
+                run = signal_bars[idx + 1 : run_ends[idx] + 1]
+                run_cash = cash + cum_dividend[run] - cum_dividend[t]
+                affordable_bars = np.flatnonzero(can_buy(run_cash, close[run], p))
+                idx = (
+                    idx + affordable_bars[0] if len(affordable_bars) else run_ends[idx]
+                )
+        idx += 1
+
+    # The cash after each fill includes the dividends up to its signal bar
+    fill_bars = np.array([0] + account.fill_bars)
+    fill_cash = np.array([p["init_cash"]] + account.fill_cash)
+    fill_dividend = np.append(0.0, cum_dividend[fill_bars[1:] - 1])
+    last_fill = np.searchsorted(fill_bars, np.arange(n), side="right") - 1
+    cash = fill_cash[last_fill] - fill_dividend[last_fill] + cum_dividend
+    sizes = np.cumsum(account.sizes)
+    return account, cash, sizes
+
+
+def get_signals_func(strategy):
+    """
+    Vectorized signals of a strategy class, or None if it has none
+    """
+    if strategy in SIGNAL_MAPPING:
+        return SIGNAL_MAPPING[strategy]
+    # Classes of `ExpressionStrategy.with_params` only add the parameters of their expressions
+    if ExpressionStrategy in strategy.__bases__ and strategy.variable_names:
+        return expression_signals
+    return None
+
+
+def get_strategy_params(strategy, skwargs):
+    """
+    All the parameters of `strategy` (defaults updated with `skwargs`), excluding the logging flags
+    """
+    params = strategy.params._getkwargsdefault()
+    params.update(skwargs)
+    return {k: v for k, v in params.items() if k not in LOGGING_PARAMS}
+
+
+def run_vectorized_strat(strategy, data, skwargs, cache=None, metrics=None):
+    """
+    Runs a single parameter combination of `strategy` on the arrays in `data`
+
+    Returns the parameters, the metrics (same keys as `analyze_stratrun`), and the arrays of the run
+    """
+    p = get_strategy_params(strategy, skwargs)
+    unsupported = [k for k in UNSUPPORTED_PARAMS if p[k]]
+    if unsupported:
+        raise ValueError(
+            "{} not supported by the vectorized engine, use engine='backtrader'".format(
+                ", ".join(unsupported)
+            )
+        )
+
+    buy, sell, minperiod, indicators = get_signals_func(strategy)(
+        data, p, {} if cache is None else cache
+    )
+    account, cash, sizes = simulate(data, buy, sell, minperiod, p)
+
+    values = cash + sizes * data["close"]
+    final_value = values[-1]
+    run_metrics = get_run_metrics(
+        values,
+        data["datetime"],
+        p["init_cash"],
+        final_value,
+        round(final_value - p["init_cash"], 2),
+        account.trade_pnls,
+        account.n_trades,
+        metrics,
+    )
+    arrays = dict(
+        values=values,
+        cash=cash,
+        sizes=sizes,
+        minperiod=minperiod,
+        orders=account.orders,
+        indicators=indicators,
+    )
+    return p, run_metrics, arrays
+
+
+def get_data_arrays(data):
+    """
+    Numeric columns of a dataframe processed by `initalize_data` as numpy arrays
+    """
+    arrays = {
+        col: data[col].values.astype(float)
+        for col in data.columns
+        if col != "datetime" and pd.api.types.is_numeric_dtype(data[col])
+    }
+    arrays["datetime"] = data["datetime"].values.astype("datetime64[ns]")
+    return arrays
+
+
+def get_history_dfs(data, p, arrays, strat_idx, history_key, metrics=None):
+    """
+    Order, periodic and indicator history dataframes with the same columns as the backtrader engine
+    """
+    dts = pd.to_datetime(data["datetime"])
+    start = arrays["minperiod"] - 1
+    orders = arrays["orders"]
+    order_history_df = pd.DataFrame(
+        dict(
+            dt=[dts[bar] for bar, *_ in orders],
+            type=["buy" if size > 0 else "sell" for _, size, *_ in orders],
+            price=[o[2] for o in orders],
+            size=[o[1] for o in orders],
+            order_value=[o[3] for o in orders],
+            portfolio_value=[arrays["values"][o[0]] for o in orders],
+            commission=[o[4] for o in orders],
+            pnl=[o[5] for o in orders],
+        )
+    )
+    periodic_history_df = pd.DataFrame(
+        dict(
+            dt=dts[start:],
+            portfolio_value=arrays["values"][start:],
+            cash=arrays["cash"][start:],
+            size=arrays["sizes"][start:],
+        )
+    )
+    periodic_history_df["return"] = periodic_history_df.portfolio_value.pct_change()
+    if metrics is not None and "rolling_sharpe" in metrics:
+        periodic_history_df["rolling_sharpe"] = get_rolling_sharpe(
+            periodic_history_df["return"].values
+        )
+    indicators_df = pd.DataFrame(dict(dt=dts, **arrays["indicators"]))
+
+    dfs = []
+    for df in [order_history_df, periodic_history_df, indicators_df]:
+        df = df.reset_index(drop=True)
+        df.insert(0, "strat_name", history_key)
+        df.insert(0, "strat_id", strat_idx)
+        dfs.append(df)
+    return dfs
+
+
+def run_vectorized(iterstrats, data, return_history, verbose, metrics=None, **kwargs):
+    """
+    Vectorized counterpart of running `iterstrats` through Cerebro and `analyze_stratrun`
+
+    Parameters
+    ----------
+    iterstrats : list
+        list of parameter combinations, each a tuple with a single `(strategy class, args, kwargs)`
+    data : pandas.DataFrame
+        dataframe already processed by `initalize_data`
+    return_history : bool
+        whether to include the order, periodic and indicator history of each run
+    verbose : int
+        verbosity level of `backtest`
+    metrics : list
+        names of the metrics to compute (default: the ones of `METRICS`)
+    kwargs : dict
+        grid parameters passed to `backtest`, used to name the history of each run
+
+    Returns
+    -------
+    list of dicts with the same keys as the output of `analyze_stratrun`, ordered by strat id
+    """
+    strategies = set(
+        stratcls for iterstrat in iterstrats for stratcls, _, _ in iterstrat
+    )
+    for stratcls in strategies:
+        if get_signals_func(stratcls) is None:
+            raise ValueError(
+                "{} has no vectorized signals, use engine='backtrader'".format(
+                    stratcls.__name__
+                )
+            )
+
+    arrays = get_data_arrays(data)
+    cache = {}
+    results = []
+    tstart = time.time()
+    for strat_idx, iterstrat in enumerate(iterstrats):
+        if len(iterstrat) != 1:
+            raise ValueError("The vectorized engine runs one strategy at a time")
+        stratcls, _, skwargs = iterstrat[0]
+        p, run_metrics, run_arrays = run_vectorized_strat(
+            stratcls, arrays, skwargs, cache, metrics
+        )
+        params = {k: v for k, v in p.items() if k not in RUN_PARAMS}
+
+        orders, periodic, indicators = [], [], []
+        if return_history:
+            history_key = "_".join(
+                ["{}{}".format(k, v) for k, v in p.items() if k in kwargs]
+            )
+            orders, periodic, indicators = [
+                [df]
+                for df in get_history_dfs(
+                    data, p, run_arrays, strat_idx, history_key, metrics
+                )
+            ]
+
+        if verbose > 0:
+            print("--------------------------------------------------")
+            print_dict(params, "Strategy Parameters")
+            print_dict(run_metrics, "Metrics")
+
+        results.append(
+            dict(
+                params=params,
+                metrics=run_metrics,
+                orders=orders,
+                periodic=periodic,
+                indicators=indicators,
+            )
+        )
+
+    if verbose > 0:
+        print("Time used (seconds):", str(time.time() - tstart))
+    return results
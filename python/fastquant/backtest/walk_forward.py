@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Walk-forward optimization of strategy parameters
+- The splits of `fastquant.utils.data_split.walk_forward_split` are backtested fold by fold
+- Each fold runs a grid search on its train data and evaluates the optimal parameters on its test data,
+  with the train data kept in front of the test data to warm up the indicators
+
+"""
+
+import multiprocessing
+
+import pandas as pd
+
+from fastquant.backtest.backtest import backtest
+from fastquant.backtest.metrics import (
+    get_drawdown_metrics,
+    get_returns_metrics,
+    get_sharpe_ratio,
+)
+from fastquant.backtest.runner import get_n_jobs
+from fastquant.utils.data_split import walk_forward_split
+
+
+def get_datetimes(data):
+    """
+    Datetimes of the bars of `data`, from its `dt` or `datetime` column or its index
+    """
+    for col in ["dt", "datetime"]:
+        if col in data.columns:
+            return pd.to_datetime(data[col]).reset_index(drop=True)
+    return pd.Series(pd.to_datetime(data.index))
+
+
+def _run_fold(args):
+    fold, strategy, data, train_ix, test_ix, param_grid, sort_by, kwargs = args
+    dts = get_datetimes(data)
+
+    train_df = backtest(
+        strategy, data.iloc[train_ix].copy(), sort_by=sort_by, **kwargs, **param_grid
+    )
+    optim_params = {name: train_df[name].iloc[0] for name in param_grid}
+
+    # Trading starts at the test data, the train data before it only warms up the indicators,
+    # which matches a live strategy that kept running after its optimization
+    _, history = backtest(
+        strategy,
+        data.iloc[train_ix[0] : test_ix[-1] + 1].copy(),
+        sort_by=sort_by,
+        return_history=True,
+        trade_start=dts[test_ix[0]],
+        **kwargs,
+        **optim_params,
+    )
+    equity = history["periodic"][["dt", "portfolio_value"]].copy()
+    equity["fold"] = fold
+
+    values = equity.portfolio_value.values
+    test_metrics = get_returns_metrics(values[0], values[-1], len(values))
+    test_metrics["maxdrawdown"] = get_drawdown_metrics(values)["max"]["drawdown"]
+    test_metrics.update(
+        get_sharpe_ratio(values, pd.to_datetime(equity.dt).dt.year, values[0])
+    )
+
+    fold_row = dict(
+        fold=fold,
+        train_start=dts[train_ix[0]],
+        train_end=dts[train_ix[-1]],
+        test_start=dts[test_ix[0]],
+        test_end=dts[test_ix[-1]],
+        **optim_params,
+        **{"train_" + sort_by: train_df[sort_by].iloc[0]},
+        **{"test_" + k: v for k, v in test_metrics.items()},
+    )
+    return fold_row, equity
+
+
+def walk_forward_backtest(
+    strategy,
+    data,
+    param_grid,
+    train_size=0.80,
+    test_size=None,
+    n_splits=3,
+    mode="sliding",
+    n_jobs=1,
+    sort_by="rnorm",
+    **kwargs,
+):
+    """Optimizes a strategy on each train fold of a walk-forward split and evaluates it on the following test fold
+
+    Parameters
+    ----------------
+    strategy : str or an instance of `fastquant.strategies.base.BaseStrategy`
+        strategy to optimize (same as `backtest`, except "multi")
+    data : pandas.DataFrame
+        dataframe with at least close price indexed with time
+    param_grid : dict
+        parameters of the strategy searched on each train fold, as lists of values (or single values)
+    train_size, test_size, n_splits, mode
+        arguments of `fastquant.utils.data_split.walk_forward_split` ("sliding" or "expanding" train folds)
+    n_jobs : int
+        number of worker processes, where each fold is run by a single worker
+        (None or -1 uses all the available cores) (default=1)
+    sort_by : str
+        metric maximized on each train fold (default="rnorm")
+    kwargs : dict
+        other arguments of `backtest`, used on every fold
+
+    Returns
+    -------
+    A tuple of
+    - pandas.DataFrame with a row per fold: its dates, the optimal parameters of its train data,
+      their train `sort_by` metric, and their metrics on the test data (prefixed with "test_")
+    - pandas.DataFrame of the out-of-sample portfolio value of every test bar (`dt`, `portfolio_value`, `fold`),
+      where each fold continues from the final value of the previous one
+    """
+    kwargs = dict(kwargs, plot=False, verbose=0)
+    # Each fold already has its own process, so its grid runs serially
+    kwargs["n_jobs"] = 1
+    tasks = [
+        (fold, strategy, data, train_ix, test_ix, param_grid, sort_by, kwargs)
+        for fold, (train_ix, test_ix) in enumerate(
+            walk_forward_split(
+                data,
+                train_size=train_size,
+                test_size=test_size,
+                n_splits=n_splits,
+                mode=mode,
+            )
+        )
+    ]
+
+    n_jobs = min(get_n_jobs(n_jobs), max(len(tasks), 1))
+    if n_jobs == 1:
+        outputs = list(map(_run_fold, tasks))
+    else:
+        pool = multiprocessing.Pool(n_jobs)
+        try:
+            outputs = pool.map(_run_fold, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    folds_df = pd.DataFrame([fold_row for fold_row, _ in outputs])
+
+    # Chain the test folds into a single curve by compounding their returns
+    equities = []
+    scale = 1.0
+    for _, equity in outputs:
+        if len(equity) == 0:
+            continue
+        equity = equity.copy()
+        start_value = equity.portfolio_value.iloc[0]
+        equity["portfolio_value"] *= scale
+        scale = equity.portfolio_value.iloc[-1] / start_value
+        equities.append(equity)
+    equity_df = pd.concat(equities, ignore_index=True) if equities else None
+
+    return folds_df, equity_df
@@ -51,6 +51,9 @@ DATA_PATH = resource_filename(__name__, "data")
 if not Path(DATA_PATH).exists():
     os.makedirs(DATA_PATH)
 
+# Directory of the memory-mapped OHLCV store (see `fastquant.store.OHLCVStore`)
+STORE_PATH = Path(DATA_PATH, "store")
+
 # CSV file containing all the listed PSE companies
 PSE_STOCK_TABLE_FILE = "stock_table.py"
 
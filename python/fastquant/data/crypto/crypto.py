@@ -2,6 +2,8 @@ from datetime import datetime, timedelta
 import pandas as pd
 import ccxt
 
+from fastquant.store import get_store
+
 # Only support top 6 listed on https://www.coingecko.com/en/exchanges for now
 CRYPTO_EXCHANGES = [
     "binance",
@@ -28,7 +30,7 @@ def unix_time_millis(date):
 
 
 def get_crypto_data(
-    ticker, start_date, end_date, time_resolution="1d", exchange="binance"
+    ticker, start_date, end_date, time_resolution="1d", exchange="binance", store=None
 ):
     """
     Get crypto data in OHLCV format
@@ -43,7 +45,18 @@ def get_crypto_data(
        resolutions: '1w', '1d' (default), '1h', '1m'
     exchange : str
        market exchanges: 'binance' (default), 'coinbasepro', 'bithumb', 'kraken', 'kucoin', 'bitstamp'
+    store : bool, str or fastquant.OHLCVStore
+        local store where the data is read from if it covers the date range, or else saved to after the query:
+        True for the default store, or its directory (default=None, no store)
     """
+    store = get_store(store)
+    store_symbol = "{}:{}".format(exchange, ticker)
+    if store is not None and store.covers(
+        store_symbol, start_date, end_date, time_resolution
+    ):
+        # Copied, since the columns read from the store are read-only
+        return store.read(store_symbol, start_date, end_date, time_resolution).copy()
+
     dt_format = (
         DATETIME_FORMAT["intraday"]
         if "m" in time_resolution or "h" in time_resolution
@@ -130,6 +143,14 @@ def get_crypto_data(
             ohlcv_df.end_date = end_date
             ohlcv_df.symbol = ticker
             ohlcv_df = ohlcv_df.set_index("dt")
+            if store is not None:
+                store.write(
+                    store_symbol,
+                    ohlcv_df,
+                    time_resolution,
+                    start_date=start_date,
+                    end_date=end_date,
+                )
 
         return ohlcv_df
     else:
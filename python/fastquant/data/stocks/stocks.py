@@ -5,6 +5,7 @@ Created on Tue Jun 25 19:48:03 2019
 
 @authors: enzoampil & jpdeleon
 """
+
 import numpy as np
 
 # Import from config
@@ -13,6 +14,7 @@ from fastquant.config import DATA_FORMAT_COLS
 # Import package
 from fastquant.data.stocks.pse import get_pse_data
 from fastquant.data.stocks.yahoofinance import get_yahoo_data
+from fastquant.store import get_store
 
 
 def get_stock_data(
@@ -22,6 +24,7 @@ def get_stock_data(
     source="yahoo",
     format="ohlcv",
     dividends=True,
+    store=None,
 ):
     """Returns pricing data for a specified stock and source.
 
@@ -42,6 +45,10 @@ def get_stock_data(
         the query is run on the other source.
     format : str
         Format of the output data
+    store : bool, str or fastquant.OHLCVStore
+        local store where the data is read from if it covers the date range with the columns of `format`,
+        or else saved to after the query: True for the default store, or its directory (default=None, no store).
+        The data is stored by source, symbol and `dividends`
 
     Returns
     -------
@@ -49,22 +56,40 @@ def get_stock_data(
         Stock data (in the specified `format`) for the specified company and date range
     """
 
-    if source == "yahoo":
+    if source not in ["yahoo", "phisix"]:
+        raise Exception("Source must be either 'phisix' or 'yahoo'")
+    if source == "phisix" or symbol == "JFC":
+        # Only the close is queried
+        format = "c"
+
+    store = get_store(store)
+    # Sources return different data for the same symbol, and only yahoo has dividends
+    store_symbol = "{}:{}{}".format(source, symbol, ":dividends" if dividends else "")
+    df = None
+    if store is not None and store.covers(store_symbol, start_date, end_date):
+        df = store.read(store_symbol, start_date, end_date)
+        if all(DATA_FORMAT_COLS[c] in df.columns for c in format):
+            # Copied, since the columns read from the store are read-only
+            df = df.copy()
+        else:
+            # Stored without these columns (e.g. a yahoo query answered by PSE), so it's queried again
+            df = None
+
+    if df is None and source == "yahoo":
         # The query is run on 'yahoo', but if the symbol isn't found, the same query is run on 'phisix'.
         df = get_yahoo_data(symbol, start_date, end_date, dividends)
         if df is None or symbol == "JFC":
             format = "c"
             df = get_pse_data(symbol, start_date, end_date, format=format)
 
-    elif source == "phisix":
+    elif df is None and source == "phisix":
         # The query is run on 'phisix', but if the symbol isn't found, the same query is run on 'yahoo'.
-        format = "c"
         df = get_pse_data(symbol, start_date, end_date, format=format)
         if df is None:
             df = get_yahoo_data(symbol, start_date, end_date, dividends)
 
-    else:
-        raise Exception("Source must be either 'phisix' or 'yahoo'")
+    if store is not None and not store.covers(store_symbol, start_date, end_date):
+        store.write(store_symbol, df, start_date=start_date, end_date=end_date)
 
     df_columns = [DATA_FORMAT_COLS[c] for c in format]
     missing_columns = [col for col in df_columns if col not in df.columns]
@@ -1,8 +1,7 @@
 # Modules available for fastquant.indicators.*
 
 from fastquant.indicators.sentiment import Sentiment
-from fastquant.indicators.custom import CustomIndicator
-
+from fastquant.indicators.custom import CustomIndicator, ExpressionSignals
 
 # Import backtrader indicators
 from fastquant.indicators.backtrader_indicators import *
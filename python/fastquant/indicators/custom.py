@@ -7,6 +7,7 @@ from __future__ import (
     print_function,
     unicode_literals,
 )
+import array
 from pkg_resources import resource_filename
 import datetime
 import sys
@@ -16,7 +17,6 @@ import backtrader as bt
 
 
 class CustomIndicator(bt.Indicator):
-
     """
     Custom Indicator
     """
@@ -40,3 +40,40 @@ class CustomIndicator(bt.Indicator):
 
     def next(self):
         self.lines.custom[0] = getattr(self.datas[0], self.custom_column)[0]
+
+
+class ExpressionSignals(bt.Indicator):
+    """
+    Buy and sell signals precomputed as arrays (see `fastquant.strategies.expression`),
+    which hold the strategy until the bar `minperiod`
+    """
+
+    lines = ("buy", "sell")
+
+    params = (
+        ("buy_signals", None),
+        ("sell_signals", None),
+        ("minperiod", 1),
+    )
+
+    plotinfo = dict(plotymargin=0.15, plotyticks=[0, 1])
+
+    def __init__(self):
+        super().__init__()
+        self.addminperiod(self.p.minperiod)
+
+    def _plotlabel(self):
+        return []
+
+    def next(self):
+        idx = len(self) - 1
+        self.lines.buy[0] = self.p.buy_signals[idx]
+        self.lines.sell[0] = self.p.sell_signals[idx]
+
+    def once(self, start, end):
+        self.lines.buy.array[start:end] = array.array(
+            "d", self.p.buy_signals[start:end].astype(float).tobytes()
+        )
+        self.lines.sell.array[start:end] = array.array(
+            "d", self.p.sell_signals[start:end].astype(float).tobytes()
+        )
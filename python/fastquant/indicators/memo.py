@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Import standard library
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals,
+)
+
+import array
+
+# Import modules
+import backtrader as bt
+import numpy as np
+
+# Import from package
+from fastquant.indicators.numpy_indicators import PLOT_PARAMS, get_array_indicator
+
+# Memoized classes of each indicator class, created once by `memoize`
+_MEMO_CLASSES = dict()
+
+
+class MemoizedIndicator(bt.Indicator):
+    """
+    Base of the indicators returned by `memoize`
+
+    The lines of the wrapped indicator are computed once per data feed and set of parameters.
+    The first strategy run computes them and stores the arrays on the data feed,
+    and the other runs of a grid search (all the strategies sharing the feed) copy them.
+    Indicators of `ARRAY_INDICATORS` on a preloaded data feed are computed with numpy on its arrays,
+    and the others by backtrader as usual. Only the preloaded (runonce) mode stores values,
+    other modes compute the indicator each time.
+    """
+
+    # Set by `memoize`
+    indicator_class = None
+
+    def __init__(self):
+        super().__init__()
+        self._memo, self._memo_key = self._get_memo()
+        self._arrays = None
+        self._source = None
+
+        entry = self._memo.get(self._memo_key) if self._memo is not None else None
+        cached = entry is not None and len(entry["arrays"][0]) == self._clock.buflen()
+        array_inputs = None if cached else self._get_array_inputs()
+        if cached:
+            self._arrays = entry["arrays"]
+            minperiods = entry["minperiods"]
+            plotinfo = entry["plotinfo"]
+            if entry["plot_params"] == self._get_plot_params():
+                self._plotlabels = entry["plotlabels"]
+            else:
+                self._plotlabels = self._get_plot_source()._plotlabel()
+        elif array_inputs is not None:
+            func, _, params = get_array_indicator(self.indicator_class)
+            kwargs = {name: getattr(self.p, name) for name in params}
+            lines = func(*array_inputs, **kwargs)
+            lines = lines if isinstance(lines, tuple) else (lines,)
+            self._arrays = [array.array("d", line.tobytes()) for line in lines]
+            # Lines are NaN until backtrader would output their first value (never: past the last bar)
+            minperiods = [
+                int(np.argmax(np.append(~np.isnan(line), True))) + 1 for line in lines
+            ]
+            plotinfo = self.plotinfo._getkwargs()
+            self._plotlabels = self._get_plot_source()._plotlabel()
+            self._memo[self._memo_key] = dict(
+                arrays=self._arrays,
+                minperiods=minperiods,
+                plotinfo=plotinfo,
+                plotlabels=self._plotlabels,
+                plot_params=self._get_plot_params(),
+            )
+        else:
+            self._source = self.indicator_class(*self.datas, **self.p._getkwargs())
+            minperiods = [line._minperiod for line in self._source.lines]
+            # Only this indicator is plotted
+            plotinfo = self._source.plotinfo._getkwargs()
+            self._source.plotinfo.plot = False
+            self._plotlabels = self._source._plotlabel()
+
+        # Indicators using these lines wait for the same number of bars as with the source lines
+        for line, minperiod in zip(self.lines, minperiods):
+            line.updateminperiod(minperiod)
+
+        for name, value in plotinfo.items():
+            if name not in ["plot", "plotname"]:
+                setattr(self.plotinfo, name, value)
+
+    def _get_memo(self):
+        """
+        Returns the memo of the data feed and the key of this indicator (None if it can't be shared)
+        """
+        strategy = self._owner
+        if not isinstance(strategy, bt.Strategy):
+            return None, None
+
+        # The source lines are identified by their position in the data feeds of the strategy
+        sources = []
+        for source in self.datas:
+            for data_idx, data in enumerate(strategy.datas):
+                if source is data:
+                    sources.append((data_idx, None))
+                    break
+                line_idxs = [
+                    i for i, line in enumerate(data.lines) if line is source.lines[0]
+                ]
+                if line_idxs:
+                    sources.append((data_idx, line_idxs[0]))
+                    break
+            else:
+                return None, None
+
+        # Parameters that only change the plot (e.g. the bands of the RSI) share the lines
+        params = tuple(
+            (name, value)
+            for name, value in self.p._getkwargs().items()
+            if name not in PLOT_PARAMS
+        )
+        key = (self.indicator_class, params, tuple(sources))
+        try:
+            hash(key)
+        except TypeError:
+            return None, None
+
+        feed = strategy.datas[0]
+        if not hasattr(feed, "_indicator_memo"):
+            feed._indicator_memo = dict()
+        return feed._indicator_memo, key
+
+    def _get_array_inputs(self):
+        """
+        Returns the arrays of the data feed passed to the numpy function of the indicator
+        (None if backtrader has to compute it)
+        """
+        spec = get_array_indicator(self.indicator_class)
+        if spec is None or self._memo is None:
+            return None
+        _, inputs, params = spec
+        # Parameters without a numpy equivalent, e.g. another moving average
+        for name in self.p._getkeys():
+            if (
+                name not in params
+                and name not in PLOT_PARAMS
+                and self.p.notdefault(name)
+            ):
+                return None
+
+        sources = self._memo_key[2]
+        if len(sources) != 1:
+            return None
+        data_idx, line_idx = sources[0]
+        data = self._owner.datas[data_idx]
+        # Only preloaded data feeds hold all their values when the strategy starts
+        if getattr(data, "streaming", False) or not (
+            0 < len(data.lines[0].array) == data.buflen()
+        ):
+            return None
+        if inputs == ("data",):
+            lines = [data.lines[line_idx or 0]]
+        elif line_idx is None:
+            lines = [getattr(data.lines, name) for name in inputs]
+        else:
+            # A single line instead of the whole data feed
+            return None
+        # Copies, since the line buffers can't be resized while a numpy view of them exists
+        return [np.array(line.array, dtype=float) for line in lines]
+
+    def _get_plot_params(self):
+        return {
+            name: getattr(self.p, name)
+            for name in PLOT_PARAMS
+            if name in self.p._getkeys()
+        }
+
+    def _get_plot_source(self):
+        # An instance of the indicator class (left uninitialized) with the parameters and plotinfo of this one,
+        # which gives the plot labels and horizontal lines of these parameters
+        source = object.__new__(self.indicator_class)
+        source.p = source.params = self.p
+        source.plotinfo = self.plotinfo
+        return source
+
+    def _plotinit(self):
+        self._get_plot_source()._plotinit()
+
+    def _plotlabel(self):
+        return self._plotlabels
+
+    def _copy(self, start, end):
+        if self._arrays is None:
+            arrays = [line.array for line in self._source.lines]
+        else:
+            arrays = self._arrays
+        for line, array in zip(self.lines, arrays):
+            line.array[start:end] = array[start:end]
+
+    def prenext(self):
+        self.next()
+
+    def next(self):
+        if self._arrays is None:
+            for line, source_line in zip(self.lines, self._source.lines):
+                line[0] = source_line[0]
+        else:
+            idx = len(self) - 1
+            for line, array in zip(self.lines, self._arrays):
+                line[0] = array[idx]
+
+    def preonce(self, start, end):
+        self._copy(start, end)
+
+    def oncestart(self, start, end):
+        self._copy(start, end)
+
+    def once(self, start, end):
+        self._copy(start, end)
+        if self._arrays is None and self._memo is not None:
+            self._memo[self._memo_key] = dict(
+                arrays=[line.array for line in self._source.lines],
+                minperiods=[line._minperiod for line in self._source.lines],
+                plotinfo=self._source.plotinfo._getkwargs(),
+                plotlabels=self._plotlabels,
+                plot_params=self._get_plot_params(),
+            )
+
+
+def memoize(indicator_class):
+    """
+    Returns a version of `indicator_class` with the same lines, parameters and plot labels,
+    computed once per backtest for each set of parameters and source lines
+
+    Example
+    -------
+    sma_fast = memoize(bt.ind.SMA)(period=self.fast_period)
+    """
+    if indicator_class not in _MEMO_CLASSES:
+        plotinfo = dict(indicator_class.plotinfo._getpairs())
+        plotinfo["plotname"] = plotinfo["plotname"] or indicator_class.__name__
+        _MEMO_CLASSES[indicator_class] = type(MemoizedIndicator)(
+            # Private name so that it isn't registered as a backtrader indicator
+            str("_Memoized" + indicator_class.__name__),
+            (MemoizedIndicator,),
+            dict(
+                indicator_class=indicator_class,
+                lines=indicator_class.lines._getlines(),
+                params=indicator_class.params._gettuple(),
+                plotinfo=plotinfo,
+                plotlines=dict(indicator_class.plotlines._getpairs()),
+            ),
+        )
+    return _MEMO_CLASSES[indicator_class]
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Indicators computed on whole numpy arrays, with the same values as their backtrader counterparts
+- Rolling sums, highs and lows take O(n) operations whatever the period: the array is split into blocks
+  of `period` values, and each window joins the suffix of a block with the prefix of the next one
+  (sums are compensated to round like the exact sums of backtrader)
+- Moving averages with a recursive smoothing (EMA, SMMA) are linear filters, also in O(n)
+- Values are NaN until the bar where backtrader outputs its first value
+
+`ARRAY_INDICATORS` maps the backtrader indicators to these functions, and is used by
+`fastquant.indicators.memo.memoize` to inject the arrays as the lines of the indicator
+"""
+
+import numpy as np
+import pandas as pd
+import backtrader as bt
+from scipy.signal import lfilter
+
+
+def _block_scan(x, period, ufunc, fill):
+    # Result of `ufunc` over each window of `period` values, from the bar `period - 1` on
+    n = len(x)
+    n_blocks = -(-n // period)
+    padded = np.full(n_blocks * period, fill)
+    padded[:n] = x
+    blocks = padded.reshape(n_blocks, period)
+    prefix = ufunc.accumulate(blocks, axis=1).ravel()
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    ends = np.arange(period - 1, n)
+    starts = ends - period + 1
+    out = suffix[starts]
+    # Windows which don't start a block end in the next one
+    partial = starts % period != 0
+    out[partial] = ufunc(out[partial], prefix[ends[partial]])
+    return out
+
+
+def _rolling(x, period, ufunc, fill):
+    x = np.asarray(x, dtype=float)
+    out = np.full(len(x), np.nan)
+    if period < 1 or len(x) < period:
+        return out
+    nans = np.isnan(x)
+    out[period - 1 :] = _block_scan(np.where(nans, fill, x), period, ufunc, fill)
+    if nans.any():
+        # Windows with a missing value are missing
+        n_nans = _block_scan(nans.astype(float), period, np.add, 0.0)
+        out[period - 1 :][n_nans > 0] = np.nan
+    return out
+
+
+def _two_sum(a, b):
+    # Rounded sum of `a` and `b`, and its rounding error
+    total = a + b
+    b_part = total - a
+    return total, (a - (total - b_part)) + (b - b_part)
+
+
+def _prefix_sums(blocks):
+    # Compensated cumulative sums along the rows, as the rounded sums and their errors
+    sums, errors = np.empty_like(blocks), np.empty_like(blocks)
+    total, error = np.zeros(len(blocks)), np.zeros(len(blocks))
+    for col in range(blocks.shape[1]):
+        total, col_error = _two_sum(total, blocks[:, col])
+        error = error + col_error
+        sums[:, col], errors[:, col] = total, error
+    return sums, errors
+
+
+def rolling_sum(x, period):
+    """Sum of the last `period` values
+
+    The sums are compensated, so that they round like the exact sums of backtrader (`math.fsum`),
+    and equal averages stay equal (e.g. for the crossovers of prices with few decimals)
+    """
+    x = np.asarray(x, dtype=float)
+    out = np.full(len(x), np.nan)
+    if period < 1 or len(x) < period:
+        return out
+    nans = np.isnan(x)
+    n = len(x)
+    n_blocks = -(-n // period)
+    padded = np.zeros(n_blocks * period)
+    padded[:n] = np.where(nans, 0.0, x)
+    blocks = padded.reshape(n_blocks, period)
+    prefix, prefix_errors = (a.ravel() for a in _prefix_sums(blocks))
+    suffix, suffix_errors = (a[:, ::-1].ravel() for a in _prefix_sums(blocks[:, ::-1]))
+    ends = np.arange(period - 1, n)
+    starts = ends - period + 1
+    sums, errors = suffix[starts], suffix_errors[starts]
+    # Windows which don't start a block end in the next one
+    partial = starts % period != 0
+    sums[partial], error = _two_sum(sums[partial], prefix[ends[partial]])
+    errors[partial] += error + prefix_errors[ends[partial]]
+    out[period - 1 :] = sums + errors
+    if nans.any():
+        # Windows with a missing value are missing
+        n_nans = _block_scan(nans.astype(float), period, np.add, 0.0)
+        out[period - 1 :][n_nans > 0] = np.nan
+    return out
+
+
+def highest(x, period):
+    """Highest of the last `period` values"""
+    return _rolling(x, period, np.maximum, -np.inf)
+
+
+def lowest(x, period):
+    """Lowest of the last `period` values"""
+    return _rolling(x, period, np.minimum, np.inf)
+
+
+def shift(x, periods=1):
+    """Values of `periods` bars before (or after, if negative), NaN where there are none"""
+    x = np.asarray(x, dtype=float)
+    out = np.full(len(x), np.nan)
+    if periods >= 0 and periods < len(x):
+        out[periods:] = x[: len(x) - periods]
+    elif periods < 0 and -periods < len(x):
+        out[:periods] = x[-periods:]
+    return out
+
+
+def sma(x, period):
+    """Simple moving average, NaN until `period` values are available"""
+    return rolling_sum(x, period) / period
+
+
+def smoothing(x, period, alpha):
+    """Exponential smoothing seeded with the simple moving average of the first `period` valid values"""
+    x = np.asarray(x, dtype=float)
+    out = np.full(len(x), np.nan)
+    valid = np.flatnonzero(~np.isnan(x))
+    if len(valid) == 0 or len(x) - valid[0] < period:
+        return out
+    seed_idx = valid[0] + period - 1
+    seed = x[valid[0] : seed_idx + 1].sum() / period
+    out[seed_idx] = seed
+    out[seed_idx + 1 :] = lfilter(
+        [alpha], [1.0, alpha - 1.0], x[seed_idx + 1 :], zi=[(1.0 - alpha) * seed]
+    )[0]
+    return out
+
+
+def ema(x, period):
+    """Exponential moving average"""
+    return smoothing(x, period, 2.0 / (1.0 + period))
+
+
+def smma(x, period):
+    """Smoothed (Wilder's) moving average"""
+    return smoothing(x, period, 1.0 / period)
+
+
+def stddev(x, period):
+    """Population standard deviation over `period` values"""
+    x = np.asarray(x, dtype=float)
+    return np.sqrt(np.abs(sma(x * x, period) - sma(x, period) ** 2))
+
+
+def rsi(x, period=14):
+    """Relative Strength Index, using a smoothed moving average of the up and down moves"""
+    diff = np.diff(np.asarray(x, dtype=float), prepend=np.nan)
+    up = np.where(np.isnan(diff), np.nan, np.maximum(diff, 0.0))
+    down = np.where(np.isnan(diff), np.nan, np.maximum(-diff, 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rs = smma(up, period) / smma(down, period)
+    return 100.0 - 100.0 / (1.0 + rs)
+
+
+def macd(x, period_me1=12, period_me2=26, period_signal=9):
+    """MACD line (difference of the fast and slow EMAs) and its signal line (EMA of the MACD)"""
+    macd_line = ema(x, period_me1) - ema(x, period_me2)
+    return macd_line, ema(macd_line, period_signal)
+
+
+def bollinger(x, period=20, devfactor=2.0):
+    """Middle (SMA), top and bottom Bollinger bands, `devfactor` standard deviations away from the middle"""
+    mid = sma(x, period)
+    dev = devfactor * stddev(x, period)
+    return mid, mid + dev, mid - dev
+
+
+def true_range(high, low, close):
+    """Range from the lowest to the highest of the bar's low and high and the previous close"""
+    prev_close = shift(close)
+    return np.maximum(high, prev_close) - np.minimum(low, prev_close)
+
+
+def atr(high, low, close, period=14):
+    """Average True Range, a smoothed moving average of the true range"""
+    return smma(true_range(high, low, close), period)
+
+
+def stochastic(high, low, close, period=14, period_dfast=3, period_dslow=3):
+    """Slow stochastic oscillator: %K (the SMA of the fast %K) and %D (the SMA of %K)"""
+    lowestlow = lowest(low, period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        k = 100.0 * ((close - lowestlow) / (highest(high, period) - lowestlow))
+    perc_k = sma(k, period_dfast)
+    return perc_k, sma(perc_k, period_dslow)
+
+
+def williams_r(high, low, close, period=14):
+    """Williams %R, the distance of the close below the highest high of `period` bars, in % of their range"""
+    h = highest(high, period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return -100.0 * (h - close) / (h - lowest(low, period))
+
+
+def cci(high, low, close, period=20, factor=0.015):
+    """Commodity Channel Index of the typical price
+
+    Same as backtrader, the mean deviation averages the deviation of each bar from its own moving average
+    """
+    tp = (high + low + close) / 3.0
+    tpmean = sma(tp, period)
+    dev = tp - tpmean
+    meandev = sma(np.abs(dev), period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return dev / (factor * meandev)
+
+
+def ichimoku(
+    high, low, close, tenkan=9, kijun=26, senkou=52, senkou_lead=26, chikou=26
+):
+    """Ichimoku cloud: tenkan sen, kijun sen, senkou span A and B (pushed `senkou_lead` bars forward)
+    and chikou span (the close `chikou` bars later)"""
+    tenkan_sen = (highest(high, tenkan) + lowest(low, tenkan)) / 2.0
+    kijun_sen = (highest(high, kijun) + lowest(low, kijun)) / 2.0
+    senkou_span_a = shift((tenkan_sen + kijun_sen) / 2.0, senkou_lead)
+    senkou_span_b = shift(
+        (highest(high, senkou) + lowest(low, senkou)) / 2.0, senkou_lead
+    )
+    return tenkan_sen, kijun_sen, senkou_span_a, senkou_span_b, shift(close, -chikou)
+
+
+def parabolic_sar(high, low, close, period=2, af=0.02, afmax=0.2):
+    """Parabolic SAR, the stop and reverse level that follows the trend with an accelerating factor
+
+    Each value depends on the previous one, so this is a single O(n) loop over the bars
+    """
+    n = len(close)
+    out = np.full(n, np.nan)
+    if n < 2:
+        return out
+    high, low, close = (np.asarray(x, dtype=float).tolist() for x in (high, low, close))
+    # State after the bar 1, where the first trend is the reverse of the first move
+    sar = (high[1] + low[1]) / 2.0
+    accel = af
+    if close[1] >= close[0]:
+        trend, extreme = False, low[0]
+    else:
+        trend, extreme = True, high[0]
+    for i in range(1, n):
+        hi, lo = high[i], low[i]
+        if (trend and sar >= lo) or (not trend and sar <= hi):
+            # Reverse the trend
+            trend = not trend
+            sar = extreme
+            extreme = hi if trend else lo
+            accel = af
+        out[i] = sar
+        if trend and hi > extreme:
+            extreme = hi
+            accel = min(accel + af, afmax)
+        elif not trend and lo < extreme:
+            extreme = lo
+            accel = min(accel + af, afmax)
+        sar = sar + accel * (extreme - sar)
+        # The SAR of the next bar stays beyond the last 2 bars
+        if trend and (sar > lo or sar > low[i - 1]):
+            sar = min(lo, low[i - 1])
+        elif not trend and (sar < hi or sar < high[i - 1]):
+            sar = max(hi, high[i - 1])
+    out[: period - 1] = np.nan
+    return out
+
+
+def trix(x, period=15, _rocperiod=1):
+    """TRIX, the rate of change (%) of a triple exponential moving average"""
+    ema3 = ema(ema(ema(x, period), period), period)
+    return 100.0 * (ema3 / shift(ema3, _rocperiod) - 1.0)
+
+
+def adx(high, low, close, period=14):
+    """Average Directional Movement Index, the smoothed spread of the +DI and -DI"""
+    upmove = high - shift(high)
+    downmove = shift(low) - low
+    plus_dm = np.where((upmove > downmove) & (upmove > 0.0), upmove, 0.0)
+    minus_dm = np.where((downmove > upmove) & (downmove > 0.0), downmove, 0.0)
+    # No move on the first bar
+    plus_dm[:1] = minus_dm[:1] = np.nan
+    atr_line = atr(high, low, close, period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        plus_di = 100.0 * smma(plus_dm, period) / atr_line
+        minus_di = 100.0 * smma(minus_dm, period) / atr_line
+        dx = np.abs(plus_di - minus_di) / (plus_di + minus_di)
+    return 100.0 * smma(dx, period)
+
+
+def crossover(a, b):
+    """
+    1 when `a` crosses `b` upwards, -1 when it crosses downwards, NaN until the previous bar of both is valid
+
+    Equal values do not reset the previous side of the cross (same as backtrader's CrossOver)
+    """
+    diff = a - b
+    valid = np.flatnonzero(~np.isnan(diff))
+    out = np.full(len(diff), np.nan)
+    if len(valid) < 2:
+        return out
+    nzd = pd.Series(np.where(diff == 0, np.nan, diff))
+    nzd.iloc[valid[0]] = diff[valid[0]]
+    prev = nzd.ffill().shift().values
+    cross = ((prev < 0) & (a > b)).astype(float) - ((prev > 0) & (a < b))
+    out[valid[0] + 1 :] = cross[valid[0] + 1 :]
+    return out
+
+
+# Lines of the data feed that the function takes, where "data" is the first line of the source
+# (the close of a data feed), and the parameters of the backtrader indicator passed to it.
+# Other parameters only change the plot, or fall back to backtrader unless they are left as default
+ARRAY_INDICATORS = {
+    bt.ind.MovingAverageSimple: (sma, ("data",), ("period",)),
+    bt.ind.ExponentialMovingAverage: (ema, ("data",), ("period",)),
+    bt.ind.SmoothedMovingAverage: (smma, ("data",), ("period",)),
+    bt.ind.StandardDeviation: (stddev, ("data",), ("period",)),
+    bt.ind.RelativeStrengthIndex: (rsi, ("data",), ("period",)),
+    bt.ind.MACD: (macd, ("data",), ("period_me1", "period_me2", "period_signal")),
+    bt.ind.BollingerBands: (bollinger, ("data",), ("period", "devfactor")),
+    bt.ind.AverageTrueRange: (atr, ("high", "low", "close"), ("period",)),
+    bt.ind.Stochastic: (
+        stochastic,
+        ("high", "low", "close"),
+        ("period", "period_dfast", "period_dslow"),
+    ),
+    bt.ind.WilliamsR: (williams_r, ("high", "low", "close"), ("period",)),
+    bt.ind.CommodityChannelIndex: (
+        cci,
+        ("high", "low", "close"),
+        ("period", "factor"),
+    ),
+    bt.ind.Ichimoku: (
+        ichimoku,
+        ("high", "low", "close"),
+        ("tenkan", "kijun", "senkou", "senkou_lead", "chikou"),
+    ),
+    bt.ind.ParabolicSAR: (
+        parabolic_sar,
+        ("high", "low", "close"),
+        ("period", "af", "afmax"),
+    ),
+    bt.ind.Trix: (trix, ("data",), ("period", "_rocperiod")),
+    bt.ind.AverageDirectionalMovementIndex: (
+        adx,
+        ("high", "low", "close"),
+        ("period",),
+    ),
+}
+
+# Parameters which only set the horizontal lines of the plot
+PLOT_PARAMS = ["upperband", "lowerband"]
+
+
+def get_array_indicator(indicator_class):
+    """
+    `(function, inputs, params)` of `ARRAY_INDICATORS` computing the lines of `indicator_class`, or None
+
+    Aliases of backtrader indicators (e.g. bt.ind.SMA) are subclasses with the same lines and parameters
+    """
+    for cls in indicator_class.__mro__:
+        if cls in ARRAY_INDICATORS:
+            same_lines = indicator_class.lines._getlines() == cls.lines._getlines()
+            same_params = indicator_class.params._getkeys() == cls.params._getkeys()
+            return ARRAY_INDICATORS[cls] if same_lines and same_params else None
+    return None
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local store of OHLCV data, kept as one memory-mapped numpy array per column
+- Each symbol and resolution is a directory of versions, each with the `.npy` files of a write:
+  `dt` (sorted datetime64[ns]) and one float64 file per column
+- Reads slice the arrays by date with a binary search on `dt`, and the slices are views of the memory map,
+  so many processes reading the same data share the pages of the operating system cache
+- `meta.json` records the current version and the date ranges fetched into the store, to tell whether a query
+  can be answered from it. Writes only replace it once all the files of their version are written,
+  so readers never mix the columns of two writes
+
+"""
+
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from fastquant.config import STORE_PATH
+
+__all__ = ["OHLCVStore"]
+
+META_FILE = "meta.json"
+
+
+def to_datetime64(date):
+    """
+    A date string, datetime or timestamp as numpy datetime64[ns]
+    """
+    return pd.Timestamp(date).to_datetime64().astype("datetime64[ns]")
+
+
+def merge_ranges(ranges):
+    """
+    Sorted union of `(start, end)` date ranges, where overlapping ranges are joined
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class StoreSelection:
+    """
+    Date range of a symbol in an `OHLCVStore`, which can be passed as the `data` of `backtest`
+
+    It only holds the location of the data, so worker processes read the data from the memory map
+    instead of receiving a copy of it
+    """
+
+    def __init__(self, path, symbol, start_date=None, end_date=None, resolution="1d"):
+        self.path = str(path)
+        self.symbol = symbol
+        self.start_date = start_date
+        self.end_date = end_date
+        self.resolution = resolution
+
+    def read(self):
+        return OHLCVStore(self.path).read(
+            self.symbol, self.start_date, self.end_date, self.resolution
+        )
+
+
+class OHLCVStore:
+    """
+    Memory-mapped columnar store of OHLCV data, by symbol and resolution
+
+    Parameters
+    ----------
+    path : str
+        directory of the store (default: `fastquant.config.STORE_PATH`)
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(STORE_PATH if path is None else path)
+
+    def get_dir(self, symbol, resolution="1d"):
+        # Symbols like "BTC/USDT" are escaped into a single directory name
+        return Path(self.path, quote(symbol, safe=""), resolution)
+
+    def get_meta(self, symbol, resolution="1d"):
+        """
+        Columns and fetched date ranges of a symbol, or None if it isn't stored
+        """
+        meta_fp = Path(self.get_dir(symbol, resolution), META_FILE)
+        if not meta_fp.exists():
+            return None
+        with open(meta_fp) as f:
+            return json.load(f)
+
+    def covers(self, symbol, start_date, end_date, resolution="1d"):
+        """
+        Whether the range from `start_date` to `end_date` was fetched into the store
+        """
+        meta = self.get_meta(symbol, resolution)
+        if meta is None:
+            return False
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        return any(
+            pd.Timestamp(s) <= start and end <= pd.Timestamp(e)
+            for s, e in meta["ranges"]
+        )
+
+    def read_arrays(
+        self, symbol, start_date=None, end_date=None, resolution="1d", columns=None
+    ):
+        """
+        Arrays of the stored columns between `start_date` and `end_date` (both included),
+        as read-only views of the memory-mapped files, with the datetimes in `dt`
+        """
+        meta = self.get_meta(symbol, resolution)
+        if meta is None:
+            raise KeyError("{} ({}) is not in the store".format(symbol, resolution))
+        # Stores written before the versions keep their files in the directory of the symbol
+        store_dir = Path(self.get_dir(symbol, resolution), meta.get("version", ""))
+        dts = np.load(Path(store_dir, "dt.npy"), mmap_mode="r")
+        start = 0 if start_date is None else dts.searchsorted(to_datetime64(start_date))
+        end = (
+            len(dts)
+            if end_date is None
+            else dts.searchsorted(to_datetime64(end_date), side="right")
+        )
+        arrays = dict(dt=dts[start:end])
+        for col in meta["columns"] if columns is None else columns:
+            arrays[col] = np.load(Path(store_dir, col + ".npy"), mmap_mode="r")[
+                start:end
+            ]
+        return arrays
+
+    def read(
+        self, symbol, start_date=None, end_date=None, resolution="1d", columns=None
+    ):
+        """
+        pandas.DataFrame of the stored columns between `start_date` and `end_date` (both included), indexed by `dt`
+
+        The columns are views of the memory-mapped files instead of copies, and are read-only
+        """
+        arrays = self.read_arrays(symbol, start_date, end_date, resolution, columns)
+        index = pd.DatetimeIndex(arrays.pop("dt"), name="dt")
+        return pd.DataFrame(arrays, index=index, copy=False)
+
+    def select(self, symbol, start_date=None, end_date=None, resolution="1d"):
+        """
+        `StoreSelection` of a date range, read by `backtest` (and each of its worker processes) from the store
+        """
+        if self.get_meta(symbol, resolution) is None:
+            raise KeyError("{} ({}) is not in the store".format(symbol, resolution))
+        return StoreSelection(self.path, symbol, start_date, end_date, resolution)
+
+    def write(self, symbol, data, resolution="1d", start_date=None, end_date=None):
+        """
+        Merges the numeric columns of `data` (indexed by, or with a column of, datetimes) into the store
+
+        Rows of `data` replace the stored rows with the same datetime. `start_date` and `end_date` are the range
+        that was fetched (default: the first and last datetimes of `data`), which may start or end without bars
+        """
+        if "dt" not in data.columns:
+            data = data.rename_axis("dt").reset_index()
+        data = data.assign(
+            dt=pd.to_datetime(data["dt"]).values.astype("datetime64[ns]")
+        )
+        columns = [
+            col for col in data.columns if col != "dt" and is_numeric_dtype(data[col])
+        ]
+        data = data[["dt"] + columns]
+
+        ranges = []
+        if len(data):
+            start = data.dt.min() if start_date is None else start_date
+            end = data.dt.max() if end_date is None else end_date
+            ranges.append([pd.Timestamp(start), pd.Timestamp(end)])
+        meta = self.get_meta(symbol, resolution)
+        if meta is not None:
+            stored = self.read(symbol, resolution=resolution).reset_index()
+            data = pd.concat([stored, data], ignore_index=True)
+            columns = meta["columns"] + [c for c in columns if c not in meta["columns"]]
+            ranges += [[pd.Timestamp(s), pd.Timestamp(e)] for s, e in meta["ranges"]]
+        data = data.drop_duplicates("dt", keep="last").sort_values("dt")
+
+        store_dir = self.get_dir(symbol, resolution)
+        version = "v" + uuid.uuid4().hex
+        version_dir = Path(store_dir, version)
+        version_dir.mkdir(parents=True)
+        arrays = dict(dt=data.dt.values.astype("datetime64[ns]"))
+        for col in columns:
+            arrays[col] = data[col].to_numpy(dtype=float, na_value=np.nan)
+        for name, values in arrays.items():
+            np.save(Path(version_dir, name + ".npy"), np.ascontiguousarray(values))
+        previous = None if meta is None else meta.get("version")
+        meta = dict(
+            version=version,
+            columns=columns,
+            ranges=[[s.isoformat(), e.isoformat()] for s, e in merge_ranges(ranges)],
+        )
+        tmp_fp = Path(store_dir, META_FILE + ".tmp")
+        with open(tmp_fp, "w") as f:
+            json.dump(meta, f)
+        # The new version is only visible once the meta is replaced (atomically)
+        os.replace(tmp_fp, Path(store_dir, META_FILE))
+
+        # The previous version is kept for the readers that loaded the meta before it was replaced
+        for path in store_dir.iterdir():
+            if path.is_dir() and path.name not in [version, previous]:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def get_store(store):
+    """
+    `OHLCVStore` of the `store` argument of the data functions: a store, a directory, or True for the default one
+    """
+    if store is None or store is False:
+        return None
+    if isinstance(store, OHLCVStore):
+        return store
+    return OHLCVStore(None if store is True else store)
@@ -8,3 +8,4 @@ from fastquant.strategies.macd import MACDStrategy
 from fastquant.strategies.rsi import RSIStrategy
 from fastquant.strategies.sentiment import SentimentStrategy
 from fastquant.strategies.custom import CustomStrategy, TernaryStrategy
+from fastquant.strategies.expression import ExpressionStrategy
@@ -32,6 +32,112 @@ from fastquant.config import (
     SHORT_MAX,
 )
 
+# Values of streamed data recorded between two reductions into `BaseStrategy.value_curve`
+VALUE_CHUNK_SIZE = 100000
+# Rows first allocated for the orders, and for the bars of streamed data, doubled when full
+HISTORY_BUFFER_SIZE = 64
+
+
+class HistoryBuffer:
+    """
+    Columns of a history, recorded a row at a time into preallocated numpy arrays
+
+    `dt` holds backtrader date numbers, which are only converted to datetimes by `to_frame`.
+    The float columns of `integral` are returned as integers when all their values are
+    """
+
+    def __init__(self, dtypes, size=HISTORY_BUFFER_SIZE, integral=()):
+        self.arrays = {
+            name: np.empty(max(size, 1), dtype=dtype) for name, dtype in dtypes.items()
+        }
+        self.integral = integral
+        self.n_rows = 0
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, name):
+        return self.arrays[name][: self.n_rows]
+
+    def append(self, *values):
+        if self.n_rows == len(self.arrays["dt"]):
+            for name, array in self.arrays.items():
+                self.arrays[name] = np.concatenate([array, np.empty_like(array)])
+        for array, value in zip(self.arrays.values(), values):
+            array[self.n_rows] = value
+        self.n_rows += 1
+
+    def to_frame(self, tz=None):
+        """
+        pandas.DataFrame of the recorded rows, with the datetimes of `dt` in the timezone `tz` of the data
+        """
+        # Imported here since fastquant.backtest imports the strategies
+        from fastquant.backtest.metrics import get_bar_datetimes
+
+        df = pd.DataFrame({name: self[name] for name in self.arrays})
+        df["dt"] = get_bar_datetimes(df.dt.values, tz)
+        for name in self.integral:
+            values = df[name].values
+            if (values == np.round(values)).all():
+                df[name] = values.astype(np.int64)
+        return df
+
+
+# Pandas offset aliases of `add_cash_freq` kept as the cron schedules they stood for:
+# the first day of each month, mondays, and the first day of each quarter
+CASH_FREQ_CRONS = {"M": "0 0 1 * *", "W": "0 0 * * 1", "Q": "0 0 1 1,4,7,10 *"}
+
+
+def get_cash_datetimes(freq, start, end):
+    """
+    Datetimes (numpy datetime64[us]) of the cash additions of `freq` after `start`, up to the first one after `end`
+
+    `freq` is a cron expression or a pandas offset alias (e.g. "BMS" for the first business day of each month)
+    """
+    freq = CASH_FREQ_CRONS.get(freq, freq)
+    start = pd.Timestamp(start).to_pydatetime()
+    if croniter.croniter.is_valid(freq):
+        cron = croniter.croniter(freq, start)
+        dts = [cron.get_next(datetime.datetime)]
+        while dts[-1] <= end:
+            dts.append(cron.get_next(datetime.datetime))
+        return np.array(dts, dtype="datetime64[us]")
+    offset = pd.tseries.frequencies.to_offset(freq)
+    dts = pd.date_range(start, pd.Timestamp(end) + offset, freq=offset, normalize=True)
+    return dts[dts > start].values.astype("datetime64[us]")
+
+
+def get_cash_schedule(data, freq, origin=None):
+    """
+    Datetimes of the cash additions of `freq` over the bars of a preloaded feed (after its first bar, or `origin`),
+    and the number of them due by each bar
+
+    Computed once per feed, and shared by every run on it
+    """
+    # Imported here since fastquant.backtest imports the strategies
+    from fastquant.backtest.metrics import get_bar_datetimes
+
+    dts = get_bar_datetimes(data.datetime.array, data._tz)
+    start = dts[0] if origin is None else min(dts[0], np.datetime64(origin, "us"))
+    schedules = data.__dict__.setdefault("cash_schedules", {})
+    if (freq, start) not in schedules:
+        cash_dts = get_cash_datetimes(freq, start, dts[-1])
+        schedules[freq, start] = cash_dts, cash_dts.searchsorted(dts, side="right")
+    return schedules[freq, start]
+
+
+def get_cash_counts(n_due, start, n_added):
+    """
+    Number of cash additions made by each bar from the bar `start` on, when `n_added` were made before it
+
+    Each bar adds at most one of the additions due by its datetime, so missed ones (e.g. weekly additions
+    on monthly bars) are caught up by the next bars
+    """
+    due = np.maximum(n_due[start:], n_added)
+    steps = np.arange(len(due))
+    # Solves counts[i] = min(counts[i - 1] + 1, due[i]) for every bar at once
+    return steps + np.minimum(n_added + 1, np.minimum.accumulate(due - steps))
+
 
 class BaseStrategy(bt.Strategy):
     """
@@ -66,6 +172,16 @@ class BaseStrategy(bt.Strategy):
         ("add_cash_amount", 0),
         ("add_cash_freq", "M"),
         ("invest_div", True),
+        ("trade_start", None),  # None means trading starts at the first bar
+        ("profile", False),  # Times the signals and the orders in `timings`
+        (
+            "record_history",
+            True,
+        ),  # Records the orders, and the value, cash and size of every bar, for `return_history`
+        (
+            "resume_state",
+            None,
+        ),  # State returned by `get_state` at the end of a previous run
     )
 
     def log(self, txt, dt=None):
@@ -73,20 +189,33 @@ class BaseStrategy(bt.Strategy):
         print("%s, %s" % (dt.isoformat(), txt))
 
     def update_order_history(self, order):
-        self.order_history["dt"].append(self.datas[0].datetime.datetime(0))
-        self.order_history["type"].append("buy" if order.isbuy() else "sell")
-        self.order_history["price"].append(order.executed.price)
-        self.order_history["size"].append(order.executed.size)
-        self.order_history["order_value"].append(order.executed.value)
-        self.order_history["portfolio_value"].append(self.broker.getvalue())
-        self.order_history["commission"].append(order.executed.comm)
-        self.order_history["pnl"].append(order.executed.pnl)
+        self.order_history.append(
+            self.datas[0].datetime[0],
+            "buy" if order.isbuy() else "sell",
+            order.executed.price,
+            order.executed.size,
+            order.executed.value,
+            self.broker.getvalue(),
+            order.executed.comm,
+            order.executed.pnl,
+        )
 
     def update_periodic_history(self):
-        self.periodic_history["dt"].append(self.datas[0].datetime.datetime(0))
-        self.periodic_history["portfolio_value"].append(self.broker.getvalue())
-        self.periodic_history["cash"].append(self.broker.getcash())
-        self.periodic_history["size"].append(self.position.size)
+        self.periodic_history.append(
+            self.datas[0].datetime[0],
+            self.broker.getvalue(),
+            self.broker.getcash(),
+            self.position.size,
+        )
+
+    @property
+    def order_history_df(self):
+        # Built on access, so runs without `return_history` never build it
+        return self.order_history.to_frame(self.datas[0]._tz)
+
+    @property
+    def periodic_history_df(self):
+        return self.periodic_history.to_frame(self.datas[0]._tz)
 
     def __init__(self):
         # Global variables
@@ -102,14 +231,20 @@ class BaseStrategy(bt.Strategy):
         self.single_position = self.params.single_position
         self.commission = self.params.commission
         self.channel = self.params.channel
+        self.symbol = self.params.symbol
         self.stop_loss = self.params.stop_loss
         self.stop_trail = self.params.stop_trail
         self.take_profit = self.params.take_profit
         self.allow_short = self.params.allow_short
         self.short_max = self.params.short_max
         self.invest_div = self.params.invest_div
+        self.trade_start = self.params.trade_start
+        self.resume_state = self.params.resume_state
+        if self.trade_start is not None:
+            self.trade_start = pd.Timestamp(self.trade_start).to_pydatetime()
+        if self.params.profile:
+            self.profile_methods()
         self.broker.set_coc(True)
-        add_cash_freq = self.params.add_cash_freq
 
         # Sets whether to include the current position as a condition buying or selling
         # It will only buy or sell as a single pair in each trade if this is not None
@@ -120,19 +255,25 @@ class BaseStrategy(bt.Strategy):
         else:
             self.strategy_position = None
 
-        # Longer term, we plan to add `freq` like notation, similar to pandas datetime
-        # https://pandas.pydata.org/pandas-docs/stable/user_guide/timeseries.html
-        # M means add cash at the first day of each month
-        if add_cash_freq == "M":
-            self.add_cash_freq = "0 0 1 * *"
-        # W means add cash once a week on monday
-        elif add_cash_freq == "W":
-            self.add_cash_freq = "0 0 * * 1"
-        # Otherwise, it assumes the input is in cron notation (no change)
-        else:
-            self.add_cash_freq = add_cash_freq
-
+        # Either a pandas offset alias, similar to pandas datetime (https://pandas.pydata.org/pandas-docs/stable/user_guide/timeseries.html)
+        # where M means the first day of each month and W mondays, or a cron expression (see `get_cash_datetimes`)
+        self.add_cash_freq = self.params.add_cash_freq
         self.add_cash_amount = self.params.add_cash_amount
+        # Number of cash additions made by each bar, precomputed when the schedule starts (see `start_cash_schedule`)
+        self.cash_counts = None
+        # Portfolio value at every bar and profit of every closed trade, from which the metrics are computed
+        self.value_history = []
+        # Streamed data keeps a bounded number of bars, so the values are reduced as they are recorded
+        self.streaming = getattr(self.datas[0], "streaming", False)
+        self.value_curve = None
+        self.value_dates = []
+        if self.streaming:
+            # Imported here since fastquant.backtest imports the strategies
+            from fastquant.backtest.metrics import ValueCurve
+
+            self.value_curve = ValueCurve()
+        self.trade_pnls = []
+        self.n_trades = 0
         # Attribute that tracks how much cash was added over time
         self.total_cash_added = 0
 
@@ -147,26 +288,6 @@ class BaseStrategy(bt.Strategy):
             self.log("take_profit : {}".format(self.take_profit))
             self.log("allow_short : {}".format(self.allow_short))
 
-        self.order_history = {
-            "dt": [],
-            "type": [],
-            "price": [],
-            "size": [],
-            "order_value": [],
-            "portfolio_value": [],
-            "commission": [],
-            "pnl": [],
-        }
-
-        self.periodic_history = {
-            "dt": [],
-            "portfolio_value": [],
-            "cash": [],
-            "size": [],
-        }
-        self.order_history_df = None
-        self.periodic_history_df = None
-
         self.dataclose = self.datas[0].close
         self.dataopen = self.datas[0].open
 
@@ -178,8 +299,35 @@ class BaseStrategy(bt.Strategy):
         self.order = None
         self.buyprice = None
         self.buycomm = None
-        # Number of ticks in the input data
-        self.len_data = len(list(self.datas[0]))
+        # Number of ticks in the input data (unknown until the end of streamed data, see `bars_left`)
+        self.len_data = None if self.streaming else len(list(self.datas[0]))
+
+        # Sizes can be fractional without `fractional` (e.g. a `buy_prop` of the open price execution),
+        # and are only returned as integers when all of them are
+        integral = () if self.fractional else ("size",)
+        self.order_history = HistoryBuffer(
+            dict(
+                dt=float,
+                type=object,
+                price=float,
+                size=float,
+                order_value=float,
+                portfolio_value=float,
+                commission=float,
+                pnl=float,
+            ),
+            integral=integral,
+        )
+        # Allocated once for every bar of the data, and only when the history is recorded
+        self.periodic_history = HistoryBuffer(
+            dict(dt=float, portfolio_value=float, cash=float, size=float),
+            size=(
+                0
+                if not self.params.record_history
+                else self.len_data or HISTORY_BUFFER_SIZE
+            ),
+            integral=integral,
+        )
         # Sets the latest action as "buy", "sell", or "neutral"
         self.action = None
         # Initialize price bought
@@ -191,6 +339,14 @@ class BaseStrategy(bt.Strategy):
         # Initialize stoploss trail order
         self.stoploss_trail_order = None
 
+    def bars_left(self):
+        """
+        Number of bars of the data after the current one
+        """
+        if self.streaming:
+            return self.datas[0].bars_left()
+        return self.len_data - len(self)
+
     def buy_signal(self):
         return False
 
@@ -213,7 +369,8 @@ class BaseStrategy(bt.Strategy):
 
         if order.status in [order.Completed]:
             # Update order history whenever an order is completed
-            self.update_order_history(order)
+            if self.params.record_history:
+                self.update_order_history(order)
             if order.isbuy():
                 self.action = "buy"
                 self.buyprice = order.executed.price
@@ -249,8 +406,12 @@ class BaseStrategy(bt.Strategy):
         self.order = None
 
     def notify_trade(self, trade):
+        # Recorded for the trade metrics computed after the run
+        if trade.justopened:
+            self.n_trades += 1
         if not trade.isclosed:
             return
+        self.trade_pnls.append(trade.pnlcomm)
         if self.transaction_logging:
             self.log(
                 "OPERATION PROFIT, GROSS: %.2f, NET: %.2f" % (trade.pnl, trade.pnlcomm)
@@ -262,8 +423,25 @@ class BaseStrategy(bt.Strategy):
             self.log("Cash %s Value %s" % (cash, value))
         self.cash = cash
         self.value = value
+        self.value_history.append(value)
+        if self.streaming:
+            self.value_dates.append(self.datas[0].datetime[0])
+            if len(self.value_history) >= VALUE_CHUNK_SIZE:
+                self.reduce_value_history()
+
+    def reduce_value_history(self):
+        """
+        Moves the recorded values of streamed data to `value_curve`
+        """
+        self.value_curve.update(self.value_history, self.value_dates)
+        self.value_history = []
+        self.value_dates = []
 
     def stop(self):
+        # Before the broker credits the pending cash to get the final value
+        self.end_state = self.get_state()
+        if self.streaming:
+            self.reduce_value_history()
         # Saving to self so it's accessible later during optimization
         self.final_value = self.broker.getvalue()
         # Note that PnL is the final portfolio value minus the initial cash balance minus the total cash added
@@ -271,8 +449,6 @@ class BaseStrategy(bt.Strategy):
         if self.strategy_logging:
             self.log("Final Portfolio Value: {}".format(self.final_value))
             self.log("Final PnL: {}".format(self.pnl))
-        self.order_history_df = pd.DataFrame(self.order_history)
-        self.periodic_history_df = pd.DataFrame(self.periodic_history)
 
         last_date = str(self.datas[0].datetime.date(0))
         if self.channel:
@@ -285,36 +461,148 @@ class BaseStrategy(bt.Strategy):
     def start(self):
         # Used to signal setting the first iteration
         self.first_timepoint = True
+        if self.resume_state is not None:
+            self.set_state(self.resume_state)
+
+    def get_state(self):
+        """
+        State of the run at the current bar, which continues on new bars with the `resume_state` parameter
+        """
+        # Cash added during the bar is only credited by the next broker step,
+        # which reads the dividend line again at its own bar
+        pending_cash = sum(
+            c for c in self.broker._cash_addition if not isinstance(c, bt.LineRoot)
+        )
+        return dict(
+            dt=self.datas[0].datetime.datetime(0),
+            cash=self.broker.getcash(),
+            value=self.value,
+            pending_cash=pending_cash,
+            position_size=self.position.size,
+            position_price=self.position.price,
+            strategy_position=self.strategy_position,
+            price_bought=self.price_bought,
+            total_cash_added=self.total_cash_added,
+            next_cash_datetime=getattr(self, "next_cash_datetime", None),
+            action=self.action,
+        )
+
+    def set_state(self, state):
+        """
+        Restores the broker and the strategy to a state returned by `get_state`
+        """
+        self.broker.set_cash(state["cash"])
+        position = self.broker.positions[self.datas[0]]
+        position.update(state["position_size"], state["position_price"], state["dt"])
+        self.strategy_position = state["strategy_position"]
+        self.price_bought = state["price_bought"]
+        self.total_cash_added = state["total_cash_added"]
+        self.action = state["action"]
+        if state["next_cash_datetime"] is not None:
+            self.next_cash_datetime = state["next_cash_datetime"]
+            self.first_timepoint = False
+
+    def profile_methods(self):
+        """
+        Accumulates the seconds spent in the signals, and in the rest of `next`, in `self.timings`
+        """
+        timings = self.timings = dict(signals=0.0, orders=0.0)
+        next_ = self.next
+
+        def timed_signal(signal):
+            def wrapper(*args, **kwargs):
+                tstart = time.perf_counter()
+                try:
+                    return signal(*args, **kwargs)
+                finally:
+                    timings["signals"] += time.perf_counter() - tstart
+
+            return wrapper
+
+        def timed_next():
+            tstart = time.perf_counter()
+            signals = timings["signals"]
+            next_()
+            timings["orders"] += (
+                time.perf_counter() - tstart - (timings["signals"] - signals)
+            )
+
+        # Instance attributes take precedence over the methods of the strategy class
+        self.buy_signal = timed_signal(self.buy_signal)
+        self.sell_signal = timed_signal(self.sell_signal)
+        self.next = timed_next
 
     def next(self):
 
+        # Bars before `trade_start` only warm up the indicators
+        if (
+            self.trade_start is not None
+            and self.datas[0].datetime.datetime(0) < self.trade_start
+        ):
+            return
+
+        # The last bar of a resumed run was already accounted for, only its trading decision is left
+        if (
+            self.resume_state is None
+            or self.datas[0].datetime.datetime(0) > self.resume_state["dt"]
+        ):
+            self.update_cash()
+            if self.params.record_history:
+                self.update_periodic_history()
+        else:
+            # Queue the cash that the previous run left for the next broker step
+            if self.invest_div and self.datadiv is not None:
+                self.broker.add_cash(self.datadiv)
+            if self.resume_state["pending_cash"]:
+                self.broker.add_cash(self.resume_state["pending_cash"])
+
+        if self.periodic_logging:
+            self.log("Close, %.2f" % self.dataclose[0])
+        if self.order:
+            return
+
+        if self.periodic_logging:
+            self.log("CURRENT POSITION SIZE: {}".format(self.position.size))
+
+        # Skip the last observation since purchases are based on next day closing prices (no value for the last observation)
+        if self.bars_left() <= 1:
+            return
+
+        self.trade()
+
+    def update_cash(self):
+        """
+        Adds the dividends and the scheduled cash of the current bar to the broker
+        """
         # add dividend to cash
         if self.invest_div and self.datadiv is not None:
             self.broker.add_cash(self.datadiv)
 
         if self.add_cash_amount:
-            if self.first_timepoint:
-                # Initialize income date iterator, and set next
-                start_date = self.datas[0].datetime.datetime(0)
-                self.cron = croniter.croniter(self.add_cash_freq, start_date)
-                self.next_cash_datetime = self.cron.get_next(datetime.datetime)
-
-                if self.transaction_logging:
-                    self.log("Start date: {}".format(start_date.strftime("%Y-%m-%d")))
-                    self.log(
-                        "Next cash date: {}".format(
-                            self.next_cash_datetime.strftime("%Y-%m-%d")
-                        )
-                    )
-
-                # Change state to indicate that the cash date iterator has been set
-                self.first_timepoint = False
+            if self.first_timepoint or (
+                self.cash_counts is None and not self.streaming
+            ):
+                self.start_cash_schedule()
 
             # Add cash to broker if date is same or later to the next income date
             # This means if the dataset is only for weekdays, a date on a weekend will be executed on the next monday
-            if self.datas[0].datetime.datetime(0) >= self.next_cash_datetime:
+            if self.streaming:
+                # The bars of streamed data aren't known in advance
+                is_due = self.datas[0].datetime.datetime(0) >= self.next_cash_datetime
+                if is_due:
+                    self.next_cash_datetime = get_cash_datetimes(
+                        self.add_cash_freq,
+                        self.next_cash_datetime,
+                        self.next_cash_datetime,
+                    )[0].item()
+            else:
+                n_added = self.cash_counts[len(self.datas[0]) - 1 - self.cash_start]
+                is_due = n_added > self.n_cash_added
+                if is_due:
+                    self.n_cash_added = n_added
+                    self.next_cash_datetime = self.cash_datetimes[n_added].item()
+            if is_due:
                 self.broker.add_cash(self.add_cash_amount)
-                self.next_cash_datetime = self.cron.get_next(datetime.datetime)
                 self.total_cash_added += self.add_cash_amount
 
                 if self.transaction_logging:
@@ -326,19 +614,55 @@ class BaseStrategy(bt.Strategy):
                         )
                     )
 
-        self.update_periodic_history()
-        if self.periodic_logging:
-            self.log("Close, %.2f" % self.dataclose[0])
-        if self.order:
-            return
-
-        if self.periodic_logging:
-            self.log("CURRENT POSITION SIZE: {}".format(self.position.size))
+    def start_cash_schedule(self):
+        """
+        Starts the cash additions after the current bar, or continues those of a resumed run
+        """
+        start_date = self.datas[0].datetime.datetime(0)
+        resumed = not self.first_timepoint
+        if self.streaming:
+            if not resumed:
+                self.next_cash_datetime = get_cash_datetimes(
+                    self.add_cash_freq, start_date, start_date
+                )[0].item()
+        else:
+            self.cash_datetimes, n_due = get_cash_schedule(
+                self.datas[0],
+                self.add_cash_freq,
+                # The next addition of a resumed run may fall before the bars of the feed
+                origin=(
+                    self.next_cash_datetime - datetime.timedelta(microseconds=1)
+                    if resumed
+                    else None
+                ),
+            )
+            self.cash_start = len(self.datas[0]) - 1
+            self.n_cash_added = (
+                self.cash_datetimes.searchsorted(
+                    np.datetime64(self.next_cash_datetime, "us")
+                )
+                if resumed
+                else n_due[self.cash_start]
+            )
+            self.cash_counts = get_cash_counts(
+                n_due, self.cash_start, self.n_cash_added
+            )
+            self.next_cash_datetime = self.cash_datetimes[self.n_cash_added].item()
 
-        # Skip the last observation since purchases are based on next day closing prices (no value for the last observation)
-        if len(self) + 1 >= self.len_data:
-            return
+        if not resumed and self.transaction_logging:
+            self.log("Start date: {}".format(start_date.strftime("%Y-%m-%d")))
+            self.log(
+                "Next cash date: {}".format(
+                    self.next_cash_datetime.strftime("%Y-%m-%d")
+                )
+            )
+        # Change state to indicate that the cash schedule has been set
+        self.first_timepoint = False
 
+    def trade(self):
+        """
+        Places the orders of the current bar based on the signals of the strategy
+        """
         # Only sell if you hold least one unit of the stock (and sell only that stock, so no short selling)
         # TODO: This needs to be changed. Assuming partials at 50 value - 50 cash
         # and then if the value of the stock goes down 10% then we have 45 value - 50 cash
@@ -12,6 +12,7 @@ from __future__ import (
 import backtrader as bt
 
 # Import from package
+from fastquant.indicators.memo import memoize
 from fastquant.strategies.base import BaseStrategy
 
 
@@ -46,7 +47,7 @@ class BBandsStrategy(BaseStrategy):
             print("===Strategy level arguments===")
             print("period :", self.period)
             print("devfactor :", self.devfactor)
-        bbands = bt.ind.BBands(period=self.period, devfactor=self.devfactor)
+        bbands = memoize(bt.ind.BBands)(period=self.period, devfactor=self.devfactor)
         self.mid = bbands.mid
         self.top = bbands.top
         self.bot = bbands.bot
@@ -33,7 +33,7 @@ class BuyAndHoldStrategy(BaseStrategy):
         return self.buy_and_hold
 
     def sell_signal(self):
-        if (len(self) + 2) >= self.len_data:
+        if self.bars_left() <= 2:
             self.buy_and_hold_sell = True
         else:
             self.buy_and_hold_sell = False
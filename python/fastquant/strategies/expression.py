@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Strategies declared as expressions over the columns of the data and array indicators
+- e.g. buy="rsi(14) < 30 & close > sma(200)" and sell="rsi(14) > 70"
+- Each expression is compiled once per data feed into an array of signals, which `next` only indexes
+- Names that aren't columns are parameters of the strategy, so that they can be searched by `backtest`
+  (e.g. buy="rsi(period) < lower" with period=[7, 14] and lower=[20, 30])
+
+"""
+
+import ast
+import io
+import sys
+import tokenize
+
+import numpy as np
+
+from fastquant.indicators.custom import ExpressionSignals
+from fastquant.indicators.numpy_indicators import (
+    crossover,
+    ema,
+    rsi,
+    shift,
+    sma,
+    smma,
+    stddev,
+)
+from fastquant.strategies.base import BaseStrategy
+
+# `&`, `|` and `~` are evaluated as an elementwise `and`, `or` and `not`, which have a lower precedence
+# than the comparisons (same as `pandas.eval`), so that "rsi(14) < 30 & close > sma(200)" needs no brackets
+BOOLEAN_OPERATORS = {"&": "and", "|": "or", "~": "not"}
+
+BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+    ast.Pow: np.power,
+    ast.Mod: np.mod,
+}
+
+COMPARE_OPERATORS = {
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+}
+
+
+def get_expression_functions():
+    """
+    Functions of the expressions, as `name: (function, number of array arguments)`
+
+    Indicators take a period, and an optional line before it (default: the close), e.g. sma(20) or sma(high, 20)
+    """
+
+    def shift_back(x, periods):
+        # Later values would leak the future into the signals
+        if periods < 0:
+            raise ValueError("shift takes a number of bars back (>= 0)")
+        return shift(x, periods)
+
+    return dict(
+        sma=(sma, 1),
+        ema=(ema, 1),
+        smma=(smma, 1),
+        rsi=(rsi, 1),
+        stddev=(stddev, 1),
+        shift=(shift_back, 1),
+        crossover=(crossover, 2),
+    )
+
+
+def parse_expression(expression):
+    """
+    Syntax tree of an expression, with `&`, `|` and `~` replaced by `and`, `or` and `not`
+    """
+    tokens = []
+    for token in tokenize.generate_tokens(io.StringIO(expression.strip()).readline):
+        if token.type == tokenize.OP and token.string in BOOLEAN_OPERATORS:
+            tokens.append((tokenize.NAME, BOOLEAN_OPERATORS[token.string]))
+        else:
+            tokens.append((token.type, token.string))
+    return ast.parse(tokenize.untokenize(tokens).strip(), mode="eval")
+
+
+def get_number(node):
+    """
+    Value of a numeric literal, or None for any other node (numbers are parsed as `ast.Num` before Python 3.8)
+    """
+    if sys.version_info < (3, 8):
+        value = node.n if isinstance(node, ast.Num) else None
+    else:
+        value = node.value if isinstance(node, ast.Constant) else None
+    return value if isinstance(value, (int, float)) else None
+
+
+def get_first_valid(values):
+    """
+    Index of the first value that isn't NaN (the length of `values` if there is none)
+    """
+    valid = ~np.isnan(values)
+    return int(np.argmax(valid)) if valid.any() else len(values)
+
+
+class ExpressionCompiler:
+    """
+    Evaluates expressions on the arrays of the data
+
+    Every subexpression is identified by a key where the parameters are replaced by their values,
+    so the indicators and signals computed for a combination are reused by the others in `cache`
+    """
+
+    def __init__(self, arrays, variables=None, cache=None):
+        self.arrays = arrays
+        self.variables = variables or {}
+        self.cache = {} if cache is None else cache
+        self.functions = get_expression_functions()
+        self.n_bars = len(next(iter(arrays.values())))
+
+    def compile(self, expression):
+        """
+        Boolean array of the expression at every bar, and the minimum period of its indicators
+        (bars until all of them are valid, like the `minperiod` of backtrader)
+        """
+        if expression is None:
+            return np.zeros(self.n_bars, dtype=bool), 1
+        key = ("expression", str(expression), tuple(sorted(self.variables.items())))
+        if key not in self.cache:
+            self.expression = str(expression)
+            self.first_valids = [0]
+            value, _ = self.evaluate(parse_expression(str(expression)).body)
+            if np.ndim(value) == 0:
+                value = np.full(self.n_bars, value)
+            if value.dtype != bool:
+                raise ValueError("{} is not a condition".format(expression))
+            self.cache[key] = value, max(self.first_valids) + 1
+        return self.cache[key]
+
+    def evaluate(self, node):
+        """
+        Value (array or number) of a node, and its key
+        """
+        number = get_number(node)
+        if number is not None:
+            return number, number
+
+        if isinstance(node, ast.Name):
+            if node.id in self.variables:
+                value = self.variables[node.id]
+                return value, value
+            if node.id in self.arrays:
+                key = ("line", node.id)
+                if key not in self.cache:
+                    values = self.arrays[node.id]
+                    self.cache[key] = values, get_first_valid(values)
+                return self.get_cached(key)
+            raise ValueError(
+                "{} is neither a column of the data nor a parameter".format(node.id)
+            )
+
+        if isinstance(node, ast.Call):
+            return self.evaluate_call(node)
+
+        if isinstance(node, ast.UnaryOp) and isinstance(
+            node.op, (ast.Not, ast.USub, ast.UAdd)
+        ):
+            value, key = self.evaluate(node.operand)
+            func = dict(Not=np.logical_not, USub=np.negative, UAdd=np.positive)[
+                type(node.op).__name__
+            ]
+            return func(value), (type(node.op).__name__, key)
+
+        if isinstance(node, ast.BoolOp):
+            values, keys = zip(*[self.evaluate(value) for value in node.values])
+            func = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return func.reduce(values), (type(node.op).__name__, keys)
+
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            left, left_key = self.evaluate(node.left)
+            right, right_key = self.evaluate(node.right)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                value = BINARY_OPERATORS[type(node.op)](left, right)
+            return value, (type(node.op).__name__, left_key, right_key)
+
+        if isinstance(node, ast.Compare) and all(
+            type(op) in COMPARE_OPERATORS for op in node.ops
+        ):
+            # Chained comparisons (e.g. 30 < rsi(14) < 70) hold when each of them holds
+            left, left_key = self.evaluate(node.left)
+            values, keys = [], [left_key]
+            for op, comparator in zip(node.ops, node.comparators):
+                right, right_key = self.evaluate(comparator)
+                with np.errstate(invalid="ignore"):
+                    values.append(COMPARE_OPERATORS[type(op)](left, right))
+                keys += [type(op).__name__, right_key]
+                left = right
+            return np.logical_and.reduce(values), ("Compare", tuple(keys))
+
+        raise ValueError(
+            "Unsupported {} in expression: {}".format(
+                type(node).__name__, self.expression
+            )
+        )
+
+    def evaluate_call(self, node):
+        name = node.func.id if isinstance(node.func, ast.Name) else None
+        if name not in self.functions or node.keywords:
+            raise ValueError(
+                "Unsupported function: {} in expression: {} (available: {})".format(
+                    name or type(node.func).__name__,
+                    self.expression,
+                    ", ".join(self.functions),
+                )
+            )
+        func, n_lines = self.functions[name]
+        args = list(node.args)
+        if n_lines == 1 and len(args) == 1:
+            # Indicators of the close by default
+            args.insert(0, ast.Name(id="close", ctx=ast.Load()))
+        evaluated = [self.evaluate(arg) for arg in args]
+        key = (name,) + tuple(arg_key for _, arg_key in evaluated)
+        if key not in self.cache:
+            values = [value for value, _ in evaluated]
+            lines = [np.asarray(value, dtype=float) for value in values[:n_lines]]
+            params = [int(value) for value in values[n_lines:]]
+            values = func(*lines, *params)
+            self.cache[key] = values, get_first_valid(values)
+        return self.get_cached(key)
+
+    def get_cached(self, key):
+        values, first_valid = self.cache[key]
+        self.first_valids.append(first_valid)
+        return values, key
+
+
+class ExpressionStrategy(BaseStrategy):
+    """
+    Buys and sells on conditions written as expressions, e.g. buy="rsi(14) < 30 & close > sma(200)"
+
+    Expressions combine the columns of the data (e.g. close, volume, or a custom column), numbers,
+    the indicators sma, ema, smma, rsi and stddev (of the close, or of another line given first, e.g. sma(high, 20)),
+    shift(line, periods) and crossover(a, b) (1 when `a` crosses `b` upwards, -1 downwards),
+    with arithmetic, comparisons, and `&` (and), `|` (or) and `~` (not).
+    Trading starts once every indicator of the expressions is available
+
+    Parameters
+    ----------
+    buy : str
+        condition of the buy signal (default=None, never)
+    sell : str
+        condition of the sell signal (default=None, never)
+    other parameters
+        any other name of the expressions, whose values are set with the keyword arguments of `backtest`
+        (e.g. buy="rsi(period) < lower", period=[7, 14], lower=30)
+    """
+
+    params = (
+        ("buy", None),
+        ("sell", None),
+    )
+
+    # Names of the parameters added by `with_params`
+    variable_names = ()
+
+    @classmethod
+    def with_params(cls, names):
+        """
+        Strategy class with the parameters of `names` that aren't parameters of this one
+        """
+        names = tuple(
+            sorted(name for name in names if name not in cls.params._getkeys())
+        )
+        if not names:
+            return cls
+        class_name = "__".join(("ExpressionStrategy",) + names)
+        if class_name not in globals():
+            # Stored in the module, so that the class can be pickled by name for the worker processes
+            globals()[class_name] = type(
+                class_name,
+                (cls,),
+                dict(
+                    params=tuple((name, None) for name in names),
+                    variable_names=names,
+                    __module__=__name__,
+                ),
+            )
+        return globals()[class_name]
+
+    def __init__(self):
+        # Initialize global variables
+        super().__init__()
+        # Strategy level variables
+        self.buy_expression = self.params.buy
+        self.sell_expression = self.params.sell
+        variables = {name: getattr(self.params, name) for name in self.variable_names}
+
+        if self.strategy_logging:
+            print("===Strategy level arguments===")
+            print("buy :", self.buy_expression)
+            print("sell :", self.sell_expression)
+            for name, value in variables.items():
+                print("{} : {}".format(name, value))
+
+        data = self.datas[0]
+        if self.streaming or len(data.close.array) != data.buflen():
+            raise ValueError("Expression strategies need preloaded data")
+        # The signals are compiled once per data feed and parameters, and shared by every run on it
+        if not hasattr(data, "_expression_memo"):
+            data._expression_memo = dict()
+        arrays = {
+            name: np.asarray(getattr(data.lines, name).array)
+            for name in data.lines.getlinealiases()
+        }
+        compiler = ExpressionCompiler(arrays, variables, data._expression_memo)
+        self.buy_signals, buy_minperiod = compiler.compile(self.buy_expression)
+        self.sell_signals, sell_minperiod = compiler.compile(self.sell_expression)
+        # Holds the strategy until the indicators of the expressions are available
+        self.signals = ExpressionSignals(
+            buy_signals=self.buy_signals,
+            sell_signals=self.sell_signals,
+            minperiod=max(buy_minperiod, sell_minperiod),
+        )
+
+    def buy_signal(self):
+        return self.buy_signals[len(self.datas[0]) - 1]
+
+    def sell_signal(self):
+        return self.sell_signals[len(self.datas[0]) - 1]
+
+
+def __getattr__(name):
+    # Classes of `ExpressionStrategy.with_params` unpickled by processes which didn't create them
+    if name.startswith("ExpressionStrategy__"):
+        return ExpressionStrategy.with_params(name.split("__")[1:])
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
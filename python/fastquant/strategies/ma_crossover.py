@@ -12,6 +12,7 @@ from __future__ import (
 import backtrader as bt
 
 # Import from package
+from fastquant.indicators.memo import memoize
 from fastquant.strategies.base import BaseStrategy
 
 
@@ -44,8 +45,8 @@ class SMACStrategy(BaseStrategy):
             print("===Strategy level arguments===")
             print("fast_period :", self.fast_period)
             print("slow_period :", self.slow_period)
-        sma_fast = bt.ind.SMA(period=self.fast_period)  # fast moving average
-        sma_slow = bt.ind.SMA(period=self.slow_period)  # slow moving average
+        sma_fast = memoize(bt.ind.SMA)(period=self.fast_period)  # fast moving average
+        sma_slow = memoize(bt.ind.SMA)(period=self.slow_period)  # slow moving average
         self.crossover = bt.ind.CrossOver(sma_fast, sma_slow)  # crossover signal
 
     def buy_signal(self):
@@ -84,8 +85,8 @@ class EMACStrategy(BaseStrategy):
             print("===Strategy level arguments===")
             print("fast_period :", self.fast_period)
             print("slow_period :", self.slow_period)
-        ema_fast = bt.ind.EMA(period=self.fast_period)  # fast moving average
-        ema_slow = bt.ind.EMA(period=self.slow_period)  # slow moving average
+        ema_fast = memoize(bt.ind.EMA)(period=self.fast_period)  # fast moving average
+        ema_slow = memoize(bt.ind.EMA)(period=self.slow_period)  # slow moving average
         self.crossover = bt.ind.CrossOver(ema_fast, ema_slow)  # crossover signal
 
     def buy_signal(self):
@@ -12,6 +12,7 @@ from __future__ import (
 import backtrader as bt
 
 # Import from package
+from fastquant.indicators.memo import memoize
 from fastquant.strategies.base import BaseStrategy
 
 
@@ -64,7 +65,7 @@ class MACDStrategy(BaseStrategy):
             print("signal_period :", self.signal_period)
             print("sma_period :", self.sma_period)
             print("dir_period :", self.dir_period)
-        macd_ind = bt.ind.MACD(
+        macd_ind = memoize(bt.ind.MACD)(
             period_me1=self.fast_period,
             period_me2=self.slow_period,
             period_signal=self.signal_period,
@@ -76,7 +77,7 @@ class MACDStrategy(BaseStrategy):
         )  # crossover buy signal
 
         # Control market trend
-        self.sma = bt.indicators.SMA(period=self.sma_period)
+        self.sma = memoize(bt.indicators.SMA)(period=self.sma_period)
         self.smadir = self.sma - self.sma(-self.dir_period)
 
     def buy_signal(self):
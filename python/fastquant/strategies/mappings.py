@@ -10,6 +10,7 @@ from fastquant.strategies import (
     SentimentStrategy,
     CustomStrategy,
     TernaryStrategy,
+    ExpressionStrategy,
 )
 
 # Register your strategy here
@@ -24,4 +25,5 @@ STRATEGY_MAPPING = {
     "sentiment": SentimentStrategy,
     "custom": CustomStrategy,
     "ternary": TernaryStrategy,
+    "expression": ExpressionStrategy,
 }
@@ -12,6 +12,7 @@ from __future__ import (
 import backtrader as bt
 
 # Import from package
+from fastquant.indicators.memo import memoize
 from fastquant.strategies.base import BaseStrategy
 
 
@@ -45,7 +46,7 @@ class RSIStrategy(BaseStrategy):
             print("rsi_period :", self.rsi_period)
             print("rsi_upper :", self.rsi_upper)
             print("rsi_lower :", self.rsi_lower)
-        self.rsi = bt.indicators.RelativeStrengthIndex(
+        self.rsi = memoize(bt.indicators.RelativeStrengthIndex)(
             period=self.rsi_period,
             upperband=self.rsi_upper,
             lowerband=self.rsi_lower,
@@ -1,10 +1,29 @@
+import importlib
+import math
+import pytest
 import pandas as pd
 import numpy as np
 import pickle
+import backtrader as bt
 from pathlib import Path
 from datetime import datetime
+from fastquant.backtest.cache import ResultCache
+from fastquant.backtest.data_prep import ArrayData, initalize_data
+from fastquant.backtest.metrics import ValueCurve, get_run_metrics
+from fastquant.backtest.post_backtest import get_strategy_metrics
+from fastquant.backtest.runner import ANALYZERS, run_stratrun
+from fastquant.indicators.memo import memoize
+from fastquant.indicators.numpy_indicators import ARRAY_INDICATORS, rsi, sma
+from fastquant.strategies.base import get_cash_counts
+from fastquant.strategies.expression import ExpressionCompiler, ExpressionStrategy
 from fastquant import (
     backtest,
+    backtest_many,
+    incremental_backtest,
+    monte_carlo,
+    optimize,
+    walk_forward_backtest,
+    OHLCVStore,
     STRATEGY_MAPPING,
     DATA_PATH,
     get_yahoo_data,
@@ -16,6 +35,7 @@ from fastquant import (
 SENTI_PKL = Path(DATA_PATH, "bt_sentiments_tests.pkl")
 DISCLOSURE_PKL = Path(DATA_PATH, "senti_disclosures.pkl")
 SAMPLE_CSV = Path(DATA_PATH, "JFC_20180101_20190110_DCV.csv")
+OHLCV_CSV = Path(DATA_PATH, "JFC_2010-01-01_2019-01-01_OHLCV.csv")
 SAMPLE_STRAT_DICT = {
     "smac": {"fast_period": 35, "slow_period": [40, 50]},
     "rsi": {"rsi_lower": [15, 30], "rsi_upper": 70},
@@ -86,6 +106,45 @@ def test_multi_backtest():
     assert cerebro is not None, "Backtest encountered error for strategy 'multi'!"
 
 
+def test_independent_multi_backtest(monkeypatch):
+    """
+    Test that independent multi strategies run the sum of their grids, with the results of single strategies
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    results = backtest(
+        "multi",
+        sample.copy(),
+        strats=SAMPLE_STRAT_DICT,
+        multi_mode="independent",
+        plot=False,
+        verbose=0,
+    )
+    assert len(results) == 4
+
+    smac = backtest(
+        "smac", sample.copy(), plot=False, verbose=0, **SAMPLE_STRAT_DICT["smac"]
+    )
+    smac_results = results.dropna(subset=["smac.slow_period"])
+    assert smac_results["smac.slow_period"].tolist() == smac.slow_period.tolist()
+    np.testing.assert_allclose(smac_results.rnorm, smac.rnorm)
+
+    # Runs are named after their strategy, even when two names share a class
+    monkeypatch.setitem(STRATEGY_MAPPING, "smac_copy", STRATEGY_MAPPING["smac"])
+    strats = dict(smac={"fast_period": [10, 15]}, smac_copy={"fast_period": 20})
+    for n_jobs in [1, 2]:
+        results = backtest(
+            "multi",
+            sample.copy(),
+            strats=strats,
+            multi_mode="independent",
+            n_jobs=n_jobs,
+            plot=False,
+            verbose=0,
+        )
+        assert sorted(results["smac.fast_period"].dropna()) == [10, 15]
+        assert results["smac_copy.fast_period"].dropna().tolist() == [20]
+
+
 def test_grid_backtest():
     """
     Test grid search
@@ -99,3 +158,768 @@ def test_grid_backtest():
         plot=False,
     )
     assert cerebro is not None, "Backtest encountered error doing grid search on SMAC!"
+
+
+def test_grid_backtest_plot():
+    """
+    Test that the optimal run of a grid search is the one plotted
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    res, fig = backtest(
+        "smac",
+        sample,
+        fast_period=[10, 15],
+        slow_period=40,
+        verbose=0,
+        return_plot=True,
+    )
+    labels = [label for ax in fig.axes for label in ax.get_legend_handles_labels()[1]]
+    assert any(
+        label.startswith("SMA ({})".format(res.fast_period[0])) for label in labels
+    )
+
+
+def test_parallel_grid_backtest():
+    """
+    Test that a grid search distributed over multiple processes gives the same results as a serial one
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    grid = dict(fast_period=range(15, 30, 5), slow_period=range(40, 55, 5))
+    serial = backtest("smac", sample.copy(), plot=False, verbose=0, **grid)
+    parallel = backtest("smac", sample.copy(), plot=False, verbose=0, n_jobs=2, **grid)
+    pd.testing.assert_frame_equal(serial, parallel)
+
+
+def test_memoized_indicators():
+    """
+    Test that indicators shared across a grid search give the same results as separate runs
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    grid = backtest(
+        "macd",
+        sample,
+        signal_period=[7, 9],
+        sma_period=[20, 30],
+        plot=False,
+        verbose=0,
+    ).set_index(["signal_period", "sma_period"])
+    for signal_period, sma_period in grid.index:
+        single = backtest(
+            "macd",
+            sample,
+            signal_period=signal_period,
+            sma_period=sma_period,
+            plot=False,
+            verbose=0,
+        )
+        row = grid.loc[(signal_period, sma_period)]
+        assert single.final_value[0] == row.final_value
+        assert single.total[0] == row.total
+
+
+def test_memoized_plot_params(monkeypatch):
+    """
+    Test that the parameters which only change the plot (e.g. the bands of the RSI) share the computed lines
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    key = bt.ind.RelativeStrengthIndex
+    func, inputs, params = ARRAY_INDICATORS[key]
+    calls = []
+
+    def counted(*args, **kwargs):
+        calls.append(kwargs)
+        return func(*args, **kwargs)
+
+    monkeypatch.setitem(ARRAY_INDICATORS, key, (counted, inputs, params))
+    grid = backtest(
+        "rsi",
+        sample.copy(),
+        rsi_period=14,
+        rsi_upper=[60, 65, 70, 75],
+        rsi_lower=[20, 25, 30],
+        plot=False,
+        verbose=0,
+    ).set_index(["rsi_upper", "rsi_lower"])
+    assert len(grid) == 12 and len(calls) == 1
+
+    single = backtest(
+        "rsi", sample.copy(), rsi_upper=65, rsi_lower=25, plot=False, verbose=0
+    )
+    assert single.final_value[0] == grid.loc[(65, 25)].final_value
+
+
+def test_numpy_indicators():
+    """
+    Test that the indicators computed with numpy by `memoize` have the same lines as backtrader
+    """
+    sample = pd.read_csv(
+        Path(DATA_PATH, "JFC_2010-01-01_2019-01-01_OHLCV.csv"), parse_dates=["dt"]
+    ).set_index("dt")
+    indicator_classes = [
+        bt.ind.SMA,
+        bt.ind.EMA,
+        bt.ind.RSI,
+        bt.ind.MACD,
+        bt.ind.BBands,
+        bt.ind.ATR,
+        bt.ind.Stochastic,
+        bt.ind.WilliamsR,
+        bt.ind.CCI,
+        bt.ind.Ichimoku,
+        bt.ind.ParabolicSAR,
+        bt.ind.TRIX,
+        bt.ind.ADX,
+    ]
+
+    class IndicatorStrategy(bt.Strategy):
+        def __init__(self):
+            self.pairs = [(cls(), memoize(cls)()) for cls in indicator_classes]
+
+    # Bar by bar, where the chikou span of backtrader has no value past the last close
+    cerebro = bt.Cerebro(stdstats=False, runonce=False)
+    cerebro.adddata(bt.feeds.PandasData(dataname=sample))
+    cerebro.addstrategy(IndicatorStrategy)
+    strat = cerebro.run()[0]
+    for expected, result in strat.pairs:
+        # Computed from the arrays of the data feed instead of by backtrader
+        assert result._source is None
+        assert result._minperiod <= expected._minperiod
+        for expected_line, line in zip(expected.lines, result.lines):
+            np.testing.assert_allclose(line.array, expected_line.array, rtol=1e-9)
+
+    # Exact sums like backtrader, so that equal averages don't cross
+    close = sample.close.values
+    assert sma(close, 7)[99] == math.fsum(close[93:100]) / 7
+
+
+def test_metrics_result_mode():
+    """
+    Test that keeping only the metrics of each run gives the same results as keeping the strategies
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    grid = dict(fast_period=range(15, 30, 5), slow_period=range(40, 55, 5))
+    full = backtest("smac", sample.copy(), plot=False, verbose=0, **grid)
+    metrics = backtest(
+        "smac", sample.copy(), plot=False, verbose=0, result_mode="metrics", **grid
+    )
+    pd.testing.assert_frame_equal(full, metrics)
+
+
+def test_backtest_profile():
+    """
+    Test that profiling returns the time of each phase without changing the results
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    grid = dict(fast_period=[10, 15], slow_period=[30, 40])
+    expected = backtest("smac", sample.copy(), plot=False, verbose=0, **grid)
+    for kwargs in [dict(), dict(result_mode="metrics")]:
+        results, timings = backtest(
+            "smac", sample.copy(), plot=False, verbose=0, profile=True, **grid, **kwargs
+        )
+        pd.testing.assert_frame_equal(results, expected)
+        assert (timings.seconds >= 0).all()
+        assert timings.seconds["run"] > timings.seconds["signals"] > 0
+        assert (
+            timings.seconds["total"] >= timings.seconds[["data", "run", "sort"]].sum()
+        )
+
+
+def test_backtest_metrics():
+    """
+    Test that only the requested metrics and the sorting metric are computed, with the same values
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    grid = dict(fast_period=[10, 15], slow_period=[30, 40])
+    expected = backtest("smac", sample.copy(), plot=False, verbose=0, **grid)
+    for kwargs in [dict(), dict(engine="vectorized"), dict(result_mode="metrics")]:
+        results = backtest(
+            "smac",
+            sample.copy(),
+            plot=False,
+            verbose=0,
+            metrics=["maxdrawdown"],
+            **grid,
+            **kwargs,
+        )
+        assert "rnorm" in results.columns and "maxdrawdown" in results.columns
+        assert (
+            "sharperatio" not in results.columns and "win_rate" not in results.columns
+        )
+        if not kwargs:
+            pd.testing.assert_frame_equal(results, expected[results.columns])
+
+    # The metrics added to the backtrader ones are opt-in
+    assert "sortino" not in expected.columns
+    for kwargs in [dict(), dict(engine="vectorized")]:
+        results, history = backtest(
+            "smac",
+            sample.copy(),
+            plot=False,
+            verbose=0,
+            return_history=True,
+            metrics=["sortino", "calmar", "rolling_sharpe"],
+            **grid,
+            **kwargs,
+        )
+        assert "sortino" in results.columns and "calmar" in results.columns
+        assert "rolling_sharpe" in history["periodic"].columns
+
+    with pytest.raises(ValueError):
+        backtest("smac", sample.copy(), plot=False, verbose=0, metrics=["unknown"])
+
+
+def test_post_run_metrics():
+    """
+    Test that the metrics computed after a run match the backtrader analyzers
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    feed, _, _ = initalize_data(sample, None, "")
+    strat = run_stratrun(
+        [(STRATEGY_MAPPING["rsi"], (), dict(commission=0.005, strategy_logging=False))],
+        feed,
+        dict(init_cash=100000, commission=0.005, analyzers=list(ANALYZERS)),
+    )[0]
+    metrics = get_strategy_metrics(strat, 100000)
+
+    expected = {
+        **strat.analyzers.returns.get_analysis(),
+        **strat.analyzers.drawdown.get_analysis(),
+        **strat.analyzers.timedraw.get_analysis(),
+        **strat.analyzers.mysharpe.get_analysis(),
+    }
+    for key, value in expected.items():
+        if key == "max":
+            assert metrics[key] == pytest.approx(dict(value))
+        else:
+            assert metrics[key] == pytest.approx(value)
+    trades = strat.analyzers.tradeanalyzer.get_analysis()
+    assert metrics["total"] == trades["total"]["total"] > 0
+    assert metrics["won_avg"] == pytest.approx(trades["won"]["pnl"]["average"])
+    assert metrics["lost_max"] == pytest.approx(trades["lost"]["pnl"]["max"])
+    # The metrics that backtrader doesn't have are only computed when requested
+    assert "sortino" not in metrics and "calmar" not in metrics
+    metrics = get_strategy_metrics(strat, 100000, ["sortino", "calmar"])
+    assert np.isfinite(metrics["sortino"]) and np.isfinite(metrics["calmar"])
+
+
+def test_history_buffers():
+    """
+    Test that the history is only recorded when requested, into buffers that grow past their size
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    feed, _, _ = initalize_data(sample, None, "")
+    recorded, skipped = [
+        run_stratrun(
+            [(STRATEGY_MAPPING["rsi"], (), dict(strategy_logging=False, **params))],
+            feed,
+            dict(init_cash=100000, commission=0),
+        )[0]
+        for params in [dict(), dict(record_history=False)]
+    ]
+    assert len(skipped.periodic_history) == len(skipped.order_history) == 0
+    periodic = recorded.periodic_history_df
+    # Recorded from the first bar after the warm-up of the indicators
+    n_bars = len(periodic)
+    np.testing.assert_array_equal(periodic.dt.values, sample.dt.values[-n_bars:])
+    np.testing.assert_array_equal(
+        periodic.portfolio_value, recorded.value_history[-n_bars:]
+    )
+    # The orders start with a smaller buffer than the bars
+    assert len(recorded.order_history.arrays["dt"]) < len(sample)
+    orders = recorded.order_history_df
+    assert len(orders) > 0 and orders.dt.isin(sample.dt).all()
+    assert set(orders.type) == {"buy", "sell"}
+
+
+def test_cash_schedule():
+    """
+    Test that the cash additions are scheduled once per feed, and that missed ones are caught up one per bar
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    # Weekly additions on bars every two weeks, so that each bar has more than one due
+    sparse = sample.iloc[::10].reset_index(drop=True)
+    kwargs = dict(add_cash_amount=1000, fast_period=3, slow_period=10)
+    results = {
+        freq: backtest(
+            "smac", sparse.copy(), plot=False, verbose=0, add_cash_freq=freq, **kwargs
+        )
+        for freq in ["W", "0 0 * * 1", "M", "BMS", "Q"]
+    }
+    pd.testing.assert_series_equal(
+        results["W"].final_value, results["0 0 * * 1"].final_value
+    )
+    assert (results["W"].final_value > results["M"].final_value).all()
+    assert (results["M"].final_value > results["Q"].final_value).all()
+
+    n_due = np.array([0, 0, 3, 3, 3, 4, 9])
+    counts = get_cash_counts(n_due, 1, 0)
+    np.testing.assert_array_equal(counts, [0, 1, 2, 3, 4, 5])
+    np.testing.assert_array_equal(get_cash_counts(n_due, 2, 3), [3, 3, 3, 4, 5])
+
+    feed, _, _ = initalize_data(sparse.copy(), None, "")
+    strat = run_stratrun(
+        [(STRATEGY_MAPPING["smac"], (), dict(strategy_logging=False, **kwargs))],
+        feed,
+        dict(init_cash=100000, commission=0),
+    )[0]
+    assert len(feed.cash_schedules) == 1
+    cash_dts, _ = next(iter(feed.cash_schedules.values()))
+    n_added = strat.cash_counts[-1] - strat.cash_counts[0]
+    assert strat.total_cash_added == 1000 * n_added > 0
+    assert (np.diff(cash_dts) > np.timedelta64(0)).all()
+
+
+def test_array_data_feed():
+    """
+    Test that the array feed loads the same lines as PandasData, and that its classes are reused
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    sample["custom"] = np.arange(len(sample), dtype=float)
+    feed, _, _ = initalize_data(sample.copy(), None, "")
+    other_feed, _, _ = initalize_data(sample.copy(), None, "")
+    pandas_feed, _, _ = initalize_data(
+        sample.copy(), None, "", data_class=bt.feeds.PandasData
+    )
+    assert isinstance(feed, ArrayData)
+    assert type(feed) is type(other_feed)
+
+    for data_feed in [feed, pandas_feed]:
+        bt.Cerebro().adddata(data_feed)
+        data_feed._start()
+        data_feed.preload()
+    for name in pandas_feed.lines.getlinealiases():
+        np.testing.assert_array_equal(
+            getattr(feed.lines, name).array, getattr(pandas_feed.lines, name).array
+        )
+
+    fromdate = datetime(2018, 6, 1)
+    results = backtest(
+        "smac",
+        sample.copy(),
+        plot=False,
+        verbose=0,
+        data_kwargs=dict(fromdate=fromdate),
+    )
+    expected = backtest(
+        "smac",
+        sample.copy(),
+        plot=False,
+        verbose=0,
+        data_class=bt.feeds.PandasData,
+        data_kwargs=dict(fromdate=fromdate),
+    )
+    pd.testing.assert_frame_equal(results, expected)
+
+
+def test_streamed_backtest(tmp_path):
+    """
+    Test that data streamed a chunk at a time gives the same results and history as a dataframe
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    expected, expected_history = backtest(
+        "smac", sample.copy(), plot=False, verbose=0, return_history=True
+    )
+    chunks = (sample.iloc[i : i + 50].copy() for i in range(0, len(sample), 50))
+    results, history = backtest(
+        "smac", chunks, plot=False, verbose=0, return_history=True
+    )
+    pd.testing.assert_frame_equal(results, expected)
+    for key in ["orders", "periodic"]:
+        pd.testing.assert_frame_equal(history[key], expected_history[key])
+
+    # The values of a stream are reduced by chunks, with the same metrics as the full curve
+    values = expected_history["periodic"].portfolio_value.values
+    dates = expected_history["periodic"].dt.values
+    curve = ValueCurve()
+    for i in range(0, len(values), 7):
+        curve.update(values[i : i + 7], dates[i : i + 7])
+    pd.testing.assert_series_equal(
+        pd.Series(get_run_metrics(curve, None, 100000, values[-1], 0, [], 0)),
+        pd.Series(get_run_metrics(values, dates, 100000, values[-1], 0, [], 0)),
+    )
+
+    # An iterator can only be read by a single run, and streams can't be plotted
+    chunks = (sample.iloc[i : i + 50].copy() for i in range(0, len(sample), 50))
+    with pytest.raises(ValueError):
+        backtest("smac", chunks, plot=False, verbose=0, fast_period=[10, 20])
+    with pytest.raises(ValueError):
+        backtest("smac", iter([sample.copy()]), verbose=0)
+
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "sample.parquet")
+    sample.to_parquet(path)
+    results = backtest("smac", path, plot=False, verbose=0, fast_period=[10, 15])
+    expected = backtest(
+        "smac", sample.copy(), plot=False, verbose=0, fast_period=[10, 15]
+    )
+    pd.testing.assert_frame_equal(results, expected)
+
+
+def test_ohlcv_store(tmp_path, monkeypatch):
+    """
+    Test that the store merges the fetched ranges, and that its selections backtest like a dataframe
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    store = OHLCVStore(tmp_path)
+    store.write("JFC", sample.iloc[:150], "1d", "2018-01-01", "2018-08-31")
+    store.write("JFC", sample.iloc[100:].set_index("dt"))
+    assert store.covers("JFC", "2018-01-01", "2018-12-31")
+    assert not store.covers("JFC", "2017-12-01", "2018-12-31")
+    assert not store.covers("JFCX", "2018-01-01", "2018-12-31")
+
+    stored = store.read("JFC")
+    np.testing.assert_array_equal(stored.close.values, sample.close.values)
+    arrays = store.read_arrays("JFC", "2018-03-01", "2018-03-31")
+    assert (arrays["dt"] >= np.datetime64("2018-03-01")).all()
+    assert (arrays["dt"] <= np.datetime64("2018-03-31")).all()
+    # Reads are views of the memory-mapped files
+    assert isinstance(arrays["close"], np.memmap)
+
+    # Readers that loaded the meta before a write still read all the columns of its version
+    meta = store.get_meta("JFC")
+    store.write("JFC", sample.iloc[:50].assign(close=0.0))
+    assert (store.read("JFC").close.iloc[:50] == 0).all()
+    monkeypatch.setattr(store, "get_meta", lambda *args: meta)
+    np.testing.assert_array_equal(store.read("JFC").close.values, sample.close.values)
+    monkeypatch.undo()
+    store.write("JFC", sample)
+    # Only the previous version is kept
+    assert len(list(store.get_dir("JFC").iterdir())) == 3
+
+    selection = store.select("JFC", "2018-02-01", "2018-12-31")
+    period = sample[(sample.dt >= "2018-02-01") & (sample.dt <= "2018-12-31")]
+    expected = backtest(
+        "smac", period.copy(), plot=False, verbose=0, fast_period=[10, 15]
+    )
+    for n_jobs in [1, 2]:
+        results = backtest(
+            "smac",
+            selection,
+            plot=False,
+            verbose=0,
+            fast_period=[10, 15],
+            n_jobs=n_jobs,
+        )
+        pd.testing.assert_frame_equal(results, expected)
+    with pytest.raises(KeyError):
+        store.select("JFCX")
+
+
+def test_stock_data_store(tmp_path, monkeypatch):
+    """
+    Test that stored stock data is only read back for the same source, dividends and columns, as a writable copy
+    """
+    stocks = importlib.import_module("fastquant.data.stocks.stocks")
+    sample = pd.read_csv(OHLCV_CSV, parse_dates=["dt"]).set_index("dt")
+    sample = sample.rename(columns=dict(value="volume"))
+    queries = []
+
+    def get_yahoo_data(symbol, start_date, end_date, dividends=True):
+        queries.append(("yahoo", dividends))
+        data = sample.loc[start_date:end_date]
+        return data.assign(dividend=0.0) if dividends else data.copy()
+
+    def get_pse_data(symbol, start_date, end_date, format="c"):
+        queries.append(("phisix", None))
+        return sample.loc[start_date:end_date, ["close"]] * 2
+
+    monkeypatch.setattr(stocks, "get_yahoo_data", get_yahoo_data)
+    monkeypatch.setattr(stocks, "get_pse_data", get_pse_data)
+    store = OHLCVStore(tmp_path)
+    args = ("MEG", "2017-01-01", "2017-12-31")
+
+    yahoo = get_stock_data(*args, store=store)
+    assert get_stock_data(*args, store=store).equals(yahoo)
+    assert queries == [("yahoo", True)]
+    get_stock_data(*args, dividends=False, store=store)
+    phisix = get_stock_data(*args, source="phisix", store=store)
+    assert queries[1:] == [("yahoo", False), ("phisix", None)]
+    assert get_stock_data(*args, source="phisix", store=store).equals(phisix)
+    assert (phisix.close == 2 * yahoo.close).all()
+
+    # Stored data without the columns of the format is queried again
+    store.write("yahoo:AC:dividends", sample[["close"]], start_date="2017-01-01")
+    get_stock_data("AC", "2017-01-01", "2017-12-31", store=store)
+    assert len(queries) == 4
+
+    stored = get_stock_data(*args, store=store)
+    stored.loc[stored.index[0], "close"] = 0.0
+    assert get_stock_data(*args, store=store).close.iloc[0] == yahoo.close.iloc[0]
+
+
+def test_sampled_grid_backtest():
+    """
+    Test that random and Latin hypercube searches run a reproducible subset of the grid
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    grid = dict(fast_period=range(5, 30, 5), slow_period=range(30, 60, 5))
+    full = backtest("smac", sample.copy(), plot=False, verbose=0, **grid)
+    full = full.set_index(["fast_period", "slow_period"])
+    for search in ["random", "lhs"]:
+        res = backtest(
+            "smac",
+            sample.copy(),
+            plot=False,
+            verbose=0,
+            search=search,
+            n_samples=6,
+            seed=1,
+            **grid,
+        )
+        same = backtest(
+            "smac",
+            sample.copy(),
+            plot=False,
+            verbose=0,
+            search=search,
+            n_samples=6,
+            seed=1,
+            **grid,
+        )
+        pd.testing.assert_frame_equal(res, same)
+
+        assert 0 < len(res) <= 6
+        res = res.set_index(["fast_period", "slow_period"])
+        assert res.index.isin(full.index).all()
+        pd.testing.assert_series_equal(res.rnorm, full.rnorm.loc[res.index])
+
+
+def test_optimize():
+    """
+    Test that the optimizer searches the given ranges and returns the trials sorted by the objective
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    space = dict(fast_period=(5, 20), slow_period=(25, 60), commission=0.0)
+    for search in ["tpe", "gp", "random"]:
+        res = optimize(
+            "smac", sample, space, n_trials=15, search=search, seed=0, verbose=0
+        )
+        assert res.fast_period.between(5, 20).all()
+        assert res.slow_period.between(25, 60).all()
+        assert (res.rnorm.diff().dropna() <= 0).all()
+
+    same = optimize(
+        "smac", sample, space, n_trials=15, search="random", seed=0, verbose=0
+    )
+    pd.testing.assert_frame_equal(res, same)
+
+
+def test_backtest_many():
+    """
+    Test that each symbol gets the same results as its own backtest, and that failed symbols are skipped
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    data = dict(JFC=sample, HALF=sample.iloc[: len(sample) // 2], BAD=sample.iloc[:0])
+    grid = dict(fast_period=[10, 15], slow_period=30)
+    with pytest.warns(UserWarning, match="BAD"):
+        res, optim = backtest_many(
+            ["JFC", "HALF", "BAD"], "smac", data=data, n_jobs=2, **grid
+        )
+    assert list(res.symbol.unique()) == ["JFC", "HALF"]
+    assert set(optim.index) == {"JFC", "HALF"}
+
+    expected = backtest(
+        "smac", data["HALF"].copy(), plot=False, verbose=0, symbol="HALF", **grid
+    )
+    half = res[res.symbol == "HALF"].reset_index(drop=True)
+    pd.testing.assert_frame_equal(half, expected)
+    assert optim.loc["HALF", "fast_period"] == expected.fast_period.iloc[0]
+
+
+def test_walk_forward_backtest():
+    """
+    Test that each fold trades only on its test data and that parallel folds give the same results
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    grid = dict(fast_period=[10, 15], slow_period=[30, 40])
+    folds, equity = walk_forward_backtest(
+        "smac", sample, grid, train_size=100, test_size=50
+    )
+    assert len(folds) == 3
+    assert (folds.test_start > folds.train_end).all()
+    for _, fold in folds.iterrows():
+        fold_equity = equity[equity.fold == fold.fold]
+        assert fold_equity.dt.min() == fold.test_start
+        assert fold_equity.dt.max() == fold.test_end
+
+    parallel_folds, parallel_equity = walk_forward_backtest(
+        "smac", sample, grid, train_size=100, test_size=50, n_jobs=2
+    )
+    pd.testing.assert_frame_equal(folds, parallel_folds)
+    pd.testing.assert_frame_equal(equity, parallel_equity)
+
+    # The start of the trading isn't a parameter of the results
+    result = backtest(
+        "smac", sample, plot=False, verbose=0, trade_start=folds.test_start.iloc[0]
+    )
+    assert "trade_start" not in result.columns
+
+
+def test_backtest_cache(tmp_path):
+    """
+    Test that cached runs give the same results, and that an extended grid only runs its new combinations
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    cache = tmp_path / "cache.sqlite"
+    grid = dict(fast_period=[10, 15], slow_period=[30, 40])
+    expected = backtest("smac", sample.copy(), plot=False, verbose=0, **grid)
+
+    first = backtest("smac", sample.copy(), plot=False, verbose=0, cache=cache, **grid)
+    pd.testing.assert_frame_equal(first, expected)
+    assert len(ResultCache(cache)) == 4
+
+    grid["fast_period"].append(20)
+    extended = backtest(
+        "smac", sample.copy(), plot=False, verbose=0, cache=cache, **grid
+    )
+    assert len(ResultCache(cache)) == 6
+    pd.testing.assert_frame_equal(
+        extended, backtest("smac", sample.copy(), plot=False, verbose=0, **grid)
+    )
+
+    # Other data or global parameters are different runs
+    backtest(
+        "smac", sample.iloc[:200].copy(), plot=False, verbose=0, cache=cache, **grid
+    )
+    backtest(
+        "smac",
+        sample.copy(),
+        plot=False,
+        verbose=0,
+        cache=cache,
+        commission=0.01,
+        **grid,
+    )
+    assert len(ResultCache(cache)) == 18
+
+
+def test_incremental_backtest():
+    """
+    Test that continuing a snapshot on new bars gives the same portfolio as a single run on all the bars
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    sample["dividend"] = 0.0
+    sample.loc[sample.index[::17], "dividend"] = 2.0
+    kwargs = dict(fast_period=5, slow_period=20, add_cash_amount=1000)
+    full, _ = incremental_backtest("smac", sample, **kwargs)
+    expected = backtest("smac", sample.copy(), plot=False, verbose=0, **kwargs)
+    assert full.final_value.iloc[0] == expected.final_value.iloc[0]
+    # The state of a resumed run isn't a parameter of the results
+    assert "resume_state" not in expected.columns
+
+    res, snapshot = incremental_backtest("smac", sample.iloc[:150], **kwargs)
+    # Either the new bars only or the full history can be passed
+    for new_data in [sample.iloc[150:151], sample.iloc[151:187], sample]:
+        res, snapshot = incremental_backtest(None, new_data, snapshot=snapshot)
+    assert res.dt.iloc[0] == sample.dt.iloc[-1]
+    assert res.action.iloc[0] == full.action.iloc[0]
+    assert res.final_value.iloc[0] == pytest.approx(full.final_value.iloc[0])
+    assert res.pnl.iloc[0] == pytest.approx(full.pnl.iloc[0])
+
+
+def test_monte_carlo():
+    """
+    Test the distributions of trade shuffles and block bootstraps of a backtest history
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    result = backtest(
+        "smac",
+        sample,
+        fast_period=[3, 5],
+        slow_period=10,
+        plot=False,
+        verbose=0,
+        return_history=True,
+    )
+
+    shuffled = monte_carlo(result, n=500, seed=0, chunk_size=200)
+    assert len(shuffled) == 500
+    # The order of the trades only changes the drawdown
+    np.testing.assert_allclose(shuffled.final_value, shuffled.final_value.iloc[0])
+    assert shuffled.maxdrawdown.std() > 0
+
+    bootstrapped = monte_carlo(result, n=500, method="block_bootstrap", seed=0)
+    assert bootstrapped.final_value.std() > 0
+    assert (bootstrapped.maxdrawdown >= 0).all()
+    pd.testing.assert_frame_equal(
+        bootstrapped, monte_carlo(result, n=500, method="block_bootstrap", seed=0)
+    )
+
+    with pytest.raises(ValueError):
+        monte_carlo(result[1])
+
+    # The trades are net of the commissions of both of their orders, so on a run that
+    # ends without a position the shuffled trades add up to its pnl
+    kwargs = dict(fast_period=3, slow_period=10, commission=0.01, return_history=True)
+    _, history = backtest("smac", sample, plot=False, verbose=0, **kwargs)
+    orders = history["orders"]
+    last_sell = orders.dt[orders.type == "sell"].max()
+    result = backtest(
+        "smac", sample[sample.dt <= last_sell], plot=False, verbose=0, **kwargs
+    )
+    assert result[1]["periodic"]["size"].iloc[-1] == 0
+    shuffled = monte_carlo(result, n=100, seed=0)
+    np.testing.assert_allclose(
+        shuffled.final_value - result[0].init_cash.iloc[0],
+        result[0].pnl.iloc[0],
+        atol=0.01,
+    )
+
+
+def test_expression_strategy():
+    """
+    Test that an expression strategy matches the built-in strategy it declares, on both engines
+    """
+    sample = pd.read_csv(SAMPLE_CSV, parse_dates=["dt"])
+    kwargs = dict(plot=False, verbose=0, return_history=True)
+    expected, expected_history = backtest(
+        "rsi", sample.copy(), rsi_period=[7, 14], rsi_lower=30, rsi_upper=70, **kwargs
+    )
+    res, history = backtest(
+        "expression",
+        sample.copy(),
+        buy="rsi(period) < lower",
+        sell="rsi(period) > upper",
+        period=[7, 14],
+        lower=30,
+        upper=70,
+        **kwargs,
+    )
+    # Names that aren't columns of the data are parameters of the strategy
+    assert list(res.period) == list(expected.rsi_period)
+    np.testing.assert_allclose(res.final_value, expected.final_value)
+    assert len(history["periodic"]) == len(expected_history["periodic"])
+
+    vectorized = backtest(
+        "expression",
+        sample.copy(),
+        buy="rsi(period) < lower",
+        sell="rsi(period) > upper",
+        period=[7, 14],
+        lower=30,
+        upper=70,
+        engine="vectorized",
+        plot=False,
+        verbose=0,
+    )
+    np.testing.assert_allclose(vectorized.final_value, res.final_value)
+
+    # `&` binds looser than the comparisons
+    compiler = ExpressionCompiler(
+        dict(close=sample.close.values.astype(float)), dict(lower=30)
+    )
+    signals, minperiod = compiler.compile("rsi(14) < lower & close > sma(50)")
+    with np.errstate(invalid="ignore"):
+        assert (
+            signals
+            == (rsi(sample.close.values, 14) < 30)
+            & (sample.close.values > sma(sample.close.values, 50))
+        ).all()
+    assert minperiod == 50
+    for expression in ["rsi(14) < unknown", "close.real > 1", "max(close) > 1"]:
+        with pytest.raises(ValueError):
+            compiler.compile(expression)
+
+    # Strategies with parameters are pickled by name for the worker processes
+    strategy = ExpressionStrategy.with_params(["period", "lower"])
+    assert pickle.loads(pickle.dumps(strategy)) is strategy
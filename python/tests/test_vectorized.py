@@ -0,0 +1,113 @@
+import pandas as pd
+import numpy as np
+import pytest
+from pathlib import Path
+from fastquant import backtest, DATA_PATH
+
+SAMPLE_CSV = Path(DATA_PATH, "JFC_20180101_20190110_DCV.csv")
+OHLCV_CSV = Path(DATA_PATH, "JFC_2010-01-01_2019-01-01_OHLCV.csv")
+
+PARITY_CASES = [
+    ("smac", {"fast_period": [10, 15], "slow_period": 30}),
+    ("emac", {"allow_short": True}),
+    ("rsi", {"buy_prop": 0.5, "commission": 0.005}),
+    ("bbands", {"devfactor": [1.5, 2.0]}),
+    ("macd", {"commission": 0.002}),
+    ("custom", {"fractional": True, "buy_prop": 0.3}),
+    # Without slippage, fractional buys take all the cash and the broker rounding decides them
+    ("emac", {"fractional": True, "slippage": 0.0, "allow_short": True}),
+    ("rsi", {"fractional": True, "slippage": 0.0, "commission": 0.001}),
+    ("ternary", {"custom_column": "ternary", "single_position": 1}),
+    ("ternary", {"custom_column": "held", "buy_prop": 0.5}),
+    ("buynhold", {}),
+]
+
+
+def load_sample(path):
+    sample = pd.read_csv(path, parse_dates=["dt"])
+    rng = np.random.RandomState(0)
+    # Simulate custom indicators
+    sample["custom"] = rng.random_sample(sample.shape[0]) * 100
+    sample["ternary"] = rng.choice([-1, 0, 0, 0, 1], sample.shape[0])
+    # Signals held for several bars, like the predictions of a model
+    changes = rng.random_sample(sample.shape[0]) < 0.05
+    sample["held"] = (
+        pd.Series(rng.choice([-1, 0, 1], sample.shape[0])).where(changes).ffill()
+    ).fillna(0)
+    return sample
+
+
+def assert_same_results(strategy, data, **kwargs):
+    expected, expected_history = backtest(
+        strategy, data.copy(), plot=False, verbose=0, return_history=True, **kwargs
+    )
+    result, history = backtest(
+        strategy,
+        data.copy(),
+        plot=False,
+        verbose=0,
+        return_history=True,
+        engine="vectorized",
+        **kwargs
+    )
+
+    # Drawdown maximums are stored as dicts
+    for df in [expected, result]:
+        max_drawdowns = df.pop("max")
+        for key in ["len", "drawdown", "moneydown"]:
+            df["max_" + key] = [dict(m)[key] for m in max_drawdowns]
+    pd.testing.assert_frame_equal(expected, result, check_dtype=False)
+    for key in ["orders", "periodic", "indicators"]:
+        pd.testing.assert_frame_equal(
+            expected_history[key].reset_index(drop=True),
+            history[key].reset_index(drop=True),
+            check_dtype=False,
+        )
+
+
+@pytest.mark.parametrize("strategy,kwargs", PARITY_CASES)
+def test_vectorized_parity(strategy, kwargs):
+    """
+    Ensures that the vectorized engine gives the same metrics and history as the backtrader engine
+    """
+    assert_same_results(strategy, load_sample(SAMPLE_CSV), **kwargs)
+
+
+def test_vectorized_parity_ohlcv():
+    """
+    Ensures the parity of the engines with dividends, open price execution and short positions
+    """
+    sample = load_sample(OHLCV_CSV)
+    sample["dividend"] = 0.0
+    sample.loc[sample.index[::37], "dividend"] = 3.0
+
+    assert_same_results("rsi", sample, execution_type="open")
+    # Partial buys of the open price execution have fractional sizes, even without `fractional`
+    assert_same_results(
+        "rsi",
+        sample,
+        execution_type="open",
+        buy_prop=0.5,
+        single_position=1,
+        commission=0.001,
+    )
+    assert_same_results(
+        "ternary",
+        sample,
+        custom_column="ternary",
+        single_position=1,
+        allow_short=True,
+    )
+    # Held signals skip the bars without orders, up to the dividends that afford a buy
+    assert_same_results("ternary", sample, custom_column="held", buy_prop=0.5)
+    assert_same_results("ternary", sample, custom_column="held", allow_short=True)
+    assert_same_results("emac", sample, fractional=True, slippage=0.0)
+
+
+def test_vectorized_unsupported():
+    """
+    Ensures that parameters which need the backtrader engine are rejected
+    """
+    sample = load_sample(SAMPLE_CSV)
+    with pytest.raises(ValueError):
+        backtest("smac", sample, plot=False, engine="vectorized", stop_loss=0.1)